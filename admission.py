@@ -0,0 +1,426 @@
+# Control de admisión para las horas pico, antes de que cada petición tome una conexión de la base:
+#   - token buckets por cliente (RATE_LIMIT_CLIENT_HEADER o la IP) y, si se configuran, por clase de ruta: si no hay
+#     token se responde 429 al instante, con Retry-After hasta el siguiente token
+#   - un tope de peticiones en curso por worker (ADMISSION_MAX_IN_FLIGHT, por defecto el tamaño del pool) con una cola
+#     de espera acotada. Al liberarse un lugar pasa primero la clase más prioritaria: las escrituras de pedidos antes
+#     que las demás, y analytics/all_info/exportaciones al final, con a lo sumo ADMISSION_LOW_PRIORITY_SHARE de los
+#     lugares. Con la cola llena, una petición más prioritaria desplaza a la más nueva de la clase menos prioritaria.
+#     Lo que no entra o espera más de ADMISSION_QUEUE_TIMEOUT recibe 503 con Retry-After. Las lecturas que sirven
+#     las cachés (menú y clientes) no ocupan lugar: un acierto no toca la base y los fallos ya se cargan una vez por clave.
+#
+# Los buckets viven en memoria de cada worker (RATE_LIMIT_BACKEND=memory). Con varios workers, RATE_LIMIT_BACKEND=postgres
+# los comparte a través de la tabla rate_limit_buckets; cualquier objeto con take() sirve de backend (BUCKET_STORES).
+#
+#   RATE_LIMIT_PER_CLIENT=20 RATE_LIMIT_BACKEND=postgres python serve.py --workers 4
+#   RATE_LIMIT_ROUTES=analytics=20:40,bulk=1:2 RATE_LIMIT_TRUSTED_PROXIES=10.0.0.5 python serve.py
+#   python admission.py --purge   borra de DATABASE_URL los buckets sin uso
+import asyncio
+import math
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from psycopg2 import connect
+from database import ASYNC_MODE, DATABASE_URL, POOL_MAX_SIZE, ConnectionPool
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", str(POOL_MAX_SIZE)))
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", "100"))
+# Menor que DB_POOL_ACQUIRE_TIMEOUT: es mejor rechazar en la puerta que después de esperar el pool
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "2"))
+ADMISSION_LOW_PRIORITY_SHARE = float(os.environ.get("ADMISSION_LOW_PRIORITY_SHARE", "0.5"))
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", "1"))
+
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+# Sin encabezado se usa la IP del cliente
+RATE_LIMIT_CLIENT_HEADER = os.environ.get("RATE_LIMIT_CLIENT_HEADER", "").lower().encode()
+# IPs de los proxies (separadas por comas, o "*") cuyo X-Forwarded-For se cree: detrás del balanceador todas las
+# peticiones llegan desde su IP y compartirían un solo bucket. Sin proxies configurados el encabezado se ignora,
+# porque cualquier cliente podría inventarlo.
+RATE_LIMIT_TRUSTED_PROXIES = {ip.strip() for ip in os.environ.get("RATE_LIMIT_TRUSTED_PROXIES", "").split(",") if ip.strip()}
+# Peticiones por segundo y ráfaga de cada cliente; 0 lo desactiva. Por defecto solo se limita si hay cómo distinguir a
+# los clientes (proxies de confianza o RATE_LIMIT_CLIENT_HEADER): detrás del balanceador, con la IP del socket, todos
+# compartirían el bucket del proxy.
+RATE_LIMIT_PER_CLIENT = float(
+    os.environ.get("RATE_LIMIT_PER_CLIENT", "50" if RATE_LIMIT_TRUSTED_PROXIES or RATE_LIMIT_CLIENT_HEADER else "0")
+)
+RATE_LIMIT_CLIENT_BURST = float(os.environ.get("RATE_LIMIT_CLIENT_BURST", "100"))
+# Límite opcional por clase de ruta, compartido por todos los clientes: "clase=tokens_por_segundo:ráfaga,..."
+# (por ejemplo "analytics=20:40,lists=20:40,bulk=1:2"). Sin valor solo se limita por cliente.
+RATE_LIMIT_ROUTES = os.environ.get("RATE_LIMIT_ROUTES", "")
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_BUCKET_TTL = int(os.environ.get("RATE_LIMIT_BUCKET_TTL", "3600"))
+# El backend postgres usa su propio pool, aparte del de las peticiones, así que un pool lleno no apaga el límite.
+# Si no consigue conexión a tiempo, la petición pasa sin consumir token.
+RATE_LIMIT_DB_POOL_SIZE = int(os.environ.get("RATE_LIMIT_DB_POOL_SIZE", "4"))
+RATE_LIMIT_ACQUIRE_TIMEOUT = float(os.environ.get("RATE_LIMIT_ACQUIRE_TIMEOUT", "0.5"))
+
+ORDER_WRITES, DEFAULT, LOW = 0, 1, 2
+
+# queued=False: la clase solo pasa por los token buckets, no por la cola de peticiones en curso
+RouteClass = namedtuple("RouteClass", "name priority queued", defaults=(True,))
+
+# La primera regla que coincide decide la clase; las rutas exentas no pasan por la admisión (monitoreo, feeds SSE
+# de larga duración que no usan la base, documentación)
+EXEMPT_PATHS = re.compile(r"^/($|metrics$|pool/|admission/|docs|redoc|openapi\.json$|orders/feed$|orders/by_customer/\d+/feed$|.*/cache/stats$)")
+ROUTE_RULES = [
+    ({"POST"}, re.compile(r"/import$|^/orders/totals/rebuild$|^/orders/archive$|^/analytics/rollups/refresh$"), RouteClass("bulk", LOW)),
+    ({"GET"}, re.compile(r"^/analytics/"), RouteClass("analytics", LOW)),
+    # Solo sin query string: /menu/all_info?limit=...&after=... pagina desde la base y va con "lists"
+    ({"GET"}, re.compile(r"^/menu/(all_info|\d+)$|^/clients/(\d+|by_clerk/[^/]+)$"), RouteClass("cached", DEFAULT, queued=False)),
+    ({"GET"}, re.compile(r"/all_info|^/orders/batch$|/export$|^/orders/totals/verify$|^/orders/archive/status$"), RouteClass("lists", LOW)),
+    ({"POST", "PUT", "DELETE"}, re.compile(r"^/orders/"), RouteClass("order_writes", ORDER_WRITES)),
+    ({"POST", "PUT", "PATCH", "DELETE"}, re.compile(r""), RouteClass("writes", DEFAULT)),
+]
+READS = RouteClass("reads", DEFAULT)
+
+
+def classify(method: str, path: str, query_string: bytes = b""):
+    if EXEMPT_PATHS.match(path):
+        return None
+    for methods, pattern, route_class in ROUTE_RULES:
+        if method in methods and pattern.search(path):
+            if not route_class.queued and query_string:
+                continue
+            return route_class
+    return READS
+
+
+def parse_route_limits(spec: str):
+    limits = {}
+    for part in filter(None, (item.strip() for item in spec.split(","))):
+        name, _, limit = part.partition("=")
+        rate, _, burst = limit.partition(":")
+        limits[name.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+class MemoryBucketStore:
+    # Buckets de este worker; los menos usados se olvidan pasando RATE_LIMIT_MAX_KEYS (vuelven llenos)
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, rate: float, burst: float):
+        return self.take_now(key, rate, burst, time.monotonic())
+
+    def take_now(self, key: str, rate: float, burst: float, now: float):
+        # Devuelve 0 si hubo token, o los segundos que faltan para el siguiente
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1 if wait == 0 else tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def stats(self):
+        return {"keys": len(self._buckets)}
+
+
+# El bucket se lee y actualiza con la fila bloqueada, así que dos workers no gastan el mismo token
+TAKE_TOKEN = "SELECT take_rate_limit_token(%s, %s, %s)"
+PURGE_BUCKETS = "DELETE FROM rate_limit_buckets WHERE updated_at < now() - %s * interval '1 second'"
+
+
+class PostgresBucketStore:
+    # Buckets compartidos por todos los workers. Cada token es un solo SELECT en autocommit, sin BEGIN/COMMIT alrededor,
+    # sobre un pool chico propio que se abre con el primer token; si ese pool o la base no responden a tiempo, deja
+    # pasar la petición en vez de rechazarla
+    def __init__(self, dsn: str = DATABASE_URL, pool_size: int = RATE_LIMIT_DB_POOL_SIZE, acquire_timeout: float = RATE_LIMIT_ACQUIRE_TIMEOUT):
+        self.acquire_timeout = acquire_timeout
+        self._errors = 0
+        if ASYNC_MODE:
+            from psycopg_pool import AsyncConnectionPool
+
+            self._pool = AsyncConnectionPool(
+                dsn, min_size=0, max_size=pool_size, timeout=acquire_timeout, kwargs={"autocommit": True}, open=False
+            )
+        else:
+            self._pool = ConnectionPool(dsn, min_size=0, max_size=pool_size, acquire_timeout=acquire_timeout)
+
+    async def take(self, key: str, rate: float, burst: float):
+        try:
+            if ASYNC_MODE:
+                return await self._take_async(key, rate, burst)
+            return await run_in_threadpool(self._take, key, rate, burst)
+        except Exception as e:
+            self._errors += 1
+            print(f"Error in PostgresBucketStore.take: {e}")
+            return 0.0
+
+    def _take(self, key: str, rate: float, burst: float):
+        with self._pool.connection() as conn:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(TAKE_TOKEN, (key, rate, burst))
+                return cursor.fetchone()[0]
+
+    async def _take_async(self, key: str, rate: float, burst: float):
+        # open() no hace nada si el pool ya está abierto
+        await self._pool.open()
+        async with self._pool.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(TAKE_TOKEN, (key, rate, burst))
+                return (await cursor.fetchone())[0]
+
+    async def close(self):
+        if ASYNC_MODE:
+            await self._pool.close()
+        else:
+            await run_in_threadpool(self._pool.close)
+
+    def stats(self):
+        stats = self._pool.get_stats() if ASYNC_MODE else self._pool.stats()
+        return {"errors": self._errors, "pool_size": stats.get("pool_size", stats.get("size", 0))}
+
+
+BUCKET_STORES = {"memory": MemoryBucketStore, "postgres": PostgresBucketStore}
+
+
+class Overloaded(Exception):
+    pass
+
+
+class _Waiter:
+    __slots__ = ("priority", "future")
+
+    def __init__(self, priority: int, future):
+        self.priority = priority
+        self.future = future
+
+
+class AdmissionQueue:
+    # Lugares para peticiones en curso con una cola por prioridad. Solo se usa desde el event loop.
+    def __init__(
+        self, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT, max_queued: int = ADMISSION_QUEUE_SIZE,
+        timeout: float = ADMISSION_QUEUE_TIMEOUT, low_priority_share: float = ADMISSION_LOW_PRIORITY_SHARE
+    ):
+        self.max_in_flight = max(max_in_flight, 1)
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.caps = {ORDER_WRITES: self.max_in_flight, DEFAULT: self.max_in_flight, LOW: max(1, int(self.max_in_flight * low_priority_share))}
+        self.in_flight = {priority: 0 for priority in self.caps}
+        self._waiting = {priority: deque() for priority in self.caps}
+        self._stats = {"admitted": 0, "waited": 0, "shed": 0, "timeouts": 0, "rejected_full": 0}
+
+    @property
+    def running(self):
+        return sum(self.in_flight.values())
+
+    @property
+    def queued(self):
+        return sum(len(waiters) for waiters in self._waiting.values())
+
+    def _can_run(self, priority: int):
+        return self.running < self.max_in_flight and self.in_flight[priority] < self.caps[priority]
+
+    def _ahead(self, priority: int):
+        return any(self._waiting[p] for p in self._waiting if p <= priority)
+
+    async def acquire(self, priority: int):
+        if self._can_run(priority) and not self._ahead(priority):
+            self.in_flight[priority] += 1
+            self._stats["admitted"] += 1
+            return
+        if self.queued >= self.max_queued and not self._shed_below(priority):
+            self._stats["rejected_full"] += 1
+            raise Overloaded("queue is full")
+
+        waiter = _Waiter(priority, asyncio.get_running_loop().create_future())
+        self._waiting[priority].append(waiter)
+        self._stats["waited"] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.timeout)
+        except asyncio.TimeoutError:
+            if self._forget(waiter):
+                self._stats["timeouts"] += 1
+                raise Overloaded("timed out waiting for a slot")
+            # El lugar (o el desalojo) llegó justo al vencerse la espera
+            waiter.future.result()
+        except asyncio.CancelledError:
+            # El cliente se fue: si el lugar ya se le había dado, pasa al siguiente
+            if not self._forget(waiter) and waiter.future.done() and waiter.future.exception() is None:
+                self.release(priority)
+            raise
+        self._stats["admitted"] += 1
+
+    def _forget(self, waiter: _Waiter):
+        try:
+            self._waiting[waiter.priority].remove(waiter)
+        except ValueError:
+            return False
+        waiter.future.cancel()
+        return True
+
+    def _shed_below(self, priority: int):
+        # Saca de la cola a la más nueva de la clase menos prioritaria que esta petición
+        for p in sorted(self._waiting, reverse=True):
+            if p <= priority:
+                return False
+            if self._waiting[p]:
+                shed = self._waiting[p].pop()
+                shed.future.set_exception(Overloaded("shed for a higher-priority request"))
+                self._stats["shed"] += 1
+                return True
+        return False
+
+    def release(self, priority: int):
+        self.in_flight[priority] -= 1
+        # El lugar pasa directo al siguiente en espera, de la clase más prioritaria que todavía tenga cupo
+        for p in sorted(self._waiting):
+            waiters = self._waiting[p]
+            while waiters and self._can_run(p):
+                waiter = waiters.popleft()
+                if waiter.future.done():
+                    continue
+                self.in_flight[p] += 1
+                waiter.future.set_result(True)
+                return
+
+    def stats(self):
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.running,
+            "queued": self.queued,
+            **{f"in_flight_{name}": self.in_flight[p] for name, p in (("order_writes", ORDER_WRITES), ("default", DEFAULT), ("low", LOW))},
+            **self._stats,
+        }
+
+
+def forwarded_client(scope, trusted_proxies: set):
+    # X-Forwarded-For de derecha a izquierda: la primera IP que no es de un proxy de confianza es la del cliente. Las
+    # de más a la izquierda las escribe el propio cliente y no se usan.
+    hops = []
+    for name, value in scope["headers"]:
+        if name == b"x-forwarded-for":
+            hops.extend(hop.strip() for hop in value.decode("latin-1").split(","))
+    hops = [hop for hop in hops if hop]
+    if "*" in trusted_proxies:
+        # Solo se confía en el proxy que llama: la IP que él agregó es la de más a la derecha
+        return hops[-1] if hops else None
+    for hop in reversed(hops):
+        if hop not in trusted_proxies:
+            return hop
+    return hops[0] if hops else None
+
+
+class Admission:
+    def __init__(
+        self, store=None, queue: AdmissionQueue = None, client_rate: float = RATE_LIMIT_PER_CLIENT,
+        client_burst: float = RATE_LIMIT_CLIENT_BURST, route_limits: dict = None, enabled: bool = ADMISSION_ENABLED,
+        trusted_proxies: set = None
+    ):
+        self.enabled = enabled
+        self.trusted_proxies = trusted_proxies if trusted_proxies is not None else RATE_LIMIT_TRUSTED_PROXIES
+        self.store = store if store is not None else BUCKET_STORES[RATE_LIMIT_BACKEND]()
+        self.queue = queue if queue is not None else AdmissionQueue()
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.route_limits = route_limits if route_limits is not None else parse_route_limits(RATE_LIMIT_ROUTES)
+        self._limited = {"client": 0, "route": 0}
+
+    def client_key(self, scope):
+        if RATE_LIMIT_CLIENT_HEADER:
+            for name, value in scope["headers"]:
+                if name == RATE_LIMIT_CLIENT_HEADER:
+                    return value.decode("latin-1")
+        client = scope.get("client")
+        peer = client[0] if client else "unknown"
+        if self.trusted_proxies and (peer in self.trusted_proxies or "*" in self.trusted_proxies):
+            return forwarded_client(scope, self.trusted_proxies) or peer
+        return peer
+
+    async def rate_limit_wait(self, scope, route_class: RouteClass):
+        # Primero el bucket de la ruta (compartido), luego el del cliente
+        limit = self.route_limits.get(route_class.name)
+        if limit and limit[0] > 0:
+            wait = await self.store.take(f"route:{route_class.name}", *limit)
+            if wait:
+                self._limited["route"] += 1
+                return wait
+        if self.client_rate > 0:
+            wait = await self.store.take(f"client:{self.client_key(scope)}", self.client_rate, self.client_burst)
+            if wait:
+                self._limited["client"] += 1
+                return wait
+        return 0.0
+
+    async def close(self):
+        if hasattr(self.store, "close"):
+            await self.store.close()
+
+    def stats(self):
+        stats = {"enabled": self.enabled, "rate_limited_client": self._limited["client"], "rate_limited_route": self._limited["route"]}
+        stats.update(self.queue.stats())
+        stats.update({f"store_{key}": value for key, value in self.store.stats().items()})
+        return stats
+
+
+admission = Admission()
+
+
+def _retry_after(seconds: float):
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+
+class AdmissionMiddleware:
+    # Middleware ASGI puro, como MetricsMiddleware: la petición rechazada no llega a la app ni toma conexión
+    def __init__(self, app, controller: Admission = None):
+        self.app = app
+        self.admission = controller if controller is not None else admission
+
+    async def __call__(self, scope, receive, send):
+        route_class = (
+            classify(scope["method"], scope["path"], scope.get("query_string", b""))
+            if scope["type"] == "http" and self.admission.enabled else None
+        )
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        wait = await self.admission.rate_limit_wait(scope, route_class)
+        if wait:
+            response = JSONResponse(status_code=429, content={"detail": "Too Many Requests"}, headers=_retry_after(wait))
+            await response(scope, receive, send)
+            return
+        if not route_class.queued:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self.admission.queue.acquire(route_class.priority)
+        except Overloaded:
+            response = JSONResponse(
+                status_code=503, content={"detail": "Server is busy, try again later"}, headers=_retry_after(ADMISSION_RETRY_AFTER)
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.admission.queue.release(route_class.priority)
+
+
+def main():
+    if "--purge" not in sys.argv:
+        print("Usage: python admission.py --purge")
+        return
+    conn = connect(DATABASE_URL)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(PURGE_BUCKETS, (RATE_LIMIT_BUCKET_TTL,))
+            print(f"Purged {cursor.rowcount} rate limit buckets")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,506 @@
+# Analítica de ventas sobre rollups. Al entregarse un pedido, orders.py lo anota en sales_rollup_queue dentro de la
+# misma transacción; RollupRefresher (una tarea por worker) va sumando la cola por lotes a sales_daily,
+# item_sales_daily y customer_sales. Las escrituras nunca tocan las filas de los rollups, así que no compiten entre
+# sí por la fila del día. Las consultas leen solo los rollups y lo que se agrega en Python se hace con numpy.
+#
+#   python analytics.py --refresh   suma a los rollups todo lo que está en la cola
+#   python analytics.py --rebuild   recalcula los rollups desde cero a partir de orders y orderdetails, incluido el
+#                                   historial archivado (más rápido que vaciar la cola después de migrar un historial grande)
+import asyncio
+import os
+import sys
+import time
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+from zoneinfo import ZoneInfo
+import numpy as np
+from psycopg2 import connect
+from fastapi import HTTPException
+from pydantic import BaseModel
+from database import DATABASE_URL, db_connection, run_db
+from queries import db_errors, record_or_none, records
+
+ANALYTICS_REFRESH_INTERVAL = float(os.environ.get("ANALYTICS_REFRESH_INTERVAL", "5"))
+ANALYTICS_REFRESH_BATCH = int(os.environ.get("ANALYTICS_REFRESH_BATCH", "5000"))
+# Zona horaria con la que se corta el día de venta; si cambia hay que correr --rebuild
+ANALYTICS_TIMEZONE = os.environ.get("ANALYTICS_TIMEZONE", "UTC")
+# Sin start, el ranking de productos cubre los últimos días hasta end (u hoy): sin ese tope recorrería todo
+# item_sales_daily, que crece con cada día y producto vendido
+ANALYTICS_TOP_ITEMS_DAYS = int(os.environ.get("ANALYTICS_TOP_ITEMS_DAYS", "90"))
+
+# Solo un worker suma la cola a la vez: dos lotes con los mismos días o clientes se bloquearían entre sí
+ROLLUP_LOCK_ID = 7267002
+
+PERIODS = ("day", "week", "month")
+ITEM_RANKINGS = ("quantity", "revenue", "orders")
+
+class RevenuePeriod(BaseModel):
+    period_start: date
+    orders: int
+    revenue: float
+    average_ticket: float
+
+class AverageTicket(BaseModel):
+    orders: int
+    revenue: float
+    average_ticket: float
+
+class ItemSales(BaseModel):
+    item_id: int
+    name: Optional[str] = None
+    orders: int
+    quantity: int
+    revenue: float
+
+class CustomerValue(BaseModel):
+    customer_id: int
+    orders: int
+    revenue: float
+    average_ticket: float
+    first_order_at: Optional[datetime] = None
+    last_order_at: Optional[datetime] = None
+
+class LifetimeValueSummary(BaseModel):
+    customers: int
+    revenue: float
+    mean: float
+    median: float
+    p90: float
+    p99: float
+    average_orders: float
+    top: List[CustomerValue]
+
+# Registros de las filas de los rollups, con los mismos campos que ItemSales y CustomerValue (sin average_ticket)
+@dataclass
+class ItemSalesRecord:
+    item_id: int
+    name: Optional[str]
+    orders: int
+    quantity: int
+    revenue: float
+
+@dataclass
+class CustomerSalesRecord:
+    customer_id: int
+    orders: int
+    revenue: float
+    first_order_at: Optional[datetime]
+    last_order_at: Optional[datetime]
+
+# Un solo statement suma los pedidos de batch a los tres rollups; {sold_orders} trae de cada pedido del lote su fila
+# de orders (AS orders) si ya se entregó. La cola nunca tiene pedidos archivados (archive.py espera a que se sumen),
+# así que solo --rebuild lee de las vistas con el historial archivado
+FOLD_INTO_ROLLUPS = """
+    WITH batch AS ({batch}), sold AS (
+        SELECT orders.order_id, orders.customer_id, orders.total_price, orders.delivered_at,
+               (orders.delivered_at AT TIME ZONE %(timezone)s)::date AS day
+        FROM {sold_orders}
+    ), daily AS (
+        INSERT INTO sales_daily AS rollup (day, orders, revenue)
+        SELECT day, count(*), sum(total_price) FROM sold GROUP BY day
+        ON CONFLICT (day) DO UPDATE SET
+            orders = rollup.orders + EXCLUDED.orders,
+            revenue = rollup.revenue + EXCLUDED.revenue
+    ), items AS (
+        INSERT INTO item_sales_daily AS rollup (day, item_id, orders, quantity, revenue)
+        SELECT sold.day, orderdetails.item_id, count(DISTINCT sold.order_id), sum(orderdetails.quantity),
+               sum(orderdetails.unit_price * orderdetails.quantity)
+        FROM sold
+        JOIN {orderdetails} AS orderdetails ON orderdetails.order_id = sold.order_id
+        GROUP BY sold.day, orderdetails.item_id
+        ON CONFLICT (day, item_id) DO UPDATE SET
+            orders = rollup.orders + EXCLUDED.orders,
+            quantity = rollup.quantity + EXCLUDED.quantity,
+            revenue = rollup.revenue + EXCLUDED.revenue
+    ), customers AS (
+        INSERT INTO customer_sales AS rollup (customer_id, orders, revenue, first_order_at, last_order_at)
+        SELECT customer_id, count(*), sum(total_price), min(delivered_at), max(delivered_at)
+        FROM sold
+        GROUP BY customer_id
+        ON CONFLICT (customer_id) DO UPDATE SET
+            orders = rollup.orders + EXCLUDED.orders,
+            revenue = rollup.revenue + EXCLUDED.revenue,
+            first_order_at = LEAST(rollup.first_order_at, EXCLUDED.first_order_at),
+            last_order_at = GREATEST(rollup.last_order_at, EXCLUDED.last_order_at)
+    )
+    SELECT count(*) FROM batch
+"""
+
+# Saca un lote de la cola. Lo que se agregó en transacciones aún sin confirmar no se ve, y queda para la siguiente vuelta.
+# Cada pedido del lote se busca por la llave de orders (el LIMIT 1 del LATERAL impide que el planner lo convierta en un
+# hash join que recorre orders entera): el costo depende del lote, no del tamaño de la tabla.
+REFRESH_ROLLUPS = FOLD_INTO_ROLLUPS.format(
+    orderdetails="orderdetails",
+    batch="""
+        DELETE FROM sales_rollup_queue
+        WHERE order_id IN (SELECT order_id FROM sales_rollup_queue ORDER BY order_id LIMIT %(batch_size)s)
+        RETURNING order_id
+    """,
+    sold_orders="""
+        batch
+        CROSS JOIN LATERAL (
+            SELECT order_id, customer_id, total_price, delivered_at FROM orders
+            WHERE orders.order_id = batch.order_id AND orders.delivered_at IS NOT NULL
+            LIMIT 1
+        ) AS orders
+    """,
+)
+
+# Todo el historial de una vez. El TRUNCATE de la cola espera a las entregas en curso; las que lleguen después
+# entran a la cola y no están en este recálculo, así que no se cuentan dos veces.
+TRUNCATE_ROLLUPS = "TRUNCATE sales_daily, item_sales_daily, customer_sales, sales_rollup_queue"
+
+REBUILD_ROLLUPS = FOLD_INTO_ROLLUPS.format(
+    orderdetails="orderdetails_history",
+    batch="SELECT order_id FROM orders_history WHERE delivered_at IS NOT NULL",
+    sold_orders="batch JOIN orders_history AS orders ON orders.order_id = batch.order_id",
+)
+
+DAY_RANGE = "day BETWEEN COALESCE(%(start)s, '-infinity'::date) AND COALESCE(%(end)s, 'infinity'::date)"
+
+# Una sola fila con tres arreglos en vez de una fila por día; numpy los toma tal cual
+DAILY_REVENUE = f"""
+    SELECT array_agg(day - DATE '1970-01-01' ORDER BY day), array_agg(orders ORDER BY day), array_agg(revenue::float8 ORDER BY day)
+    FROM sales_daily
+    WHERE {DAY_RANGE}
+"""
+
+TOTAL_REVENUE = f"SELECT COALESCE(sum(orders), 0)::bigint, COALESCE(sum(revenue), 0)::float8 FROM sales_daily WHERE {DAY_RANGE}"
+
+# Se agrupa solo por producto y el nombre se busca después, en las pocas filas que quedan
+TOP_ITEMS = {
+    ranking: f"""
+        SELECT sales.item_id, menu.name, sales.orders, sales.quantity, sales.revenue
+        FROM (
+            SELECT item_id, sum(orders)::bigint AS orders, sum(quantity)::bigint AS quantity, sum(revenue)::float8 AS revenue
+            FROM item_sales_daily
+            WHERE {DAY_RANGE}
+            GROUP BY item_id
+        ) AS sales
+        LEFT JOIN menu ON menu.menu_id = sales.item_id
+        ORDER BY sales.{ranking} DESC, sales.item_id
+        LIMIT %(limit)s
+    """
+    for ranking in ITEM_RANKINGS
+}
+
+CUSTOMER_VALUES = """
+    SELECT array_agg(customer_id) AS customer_ids, array_agg(orders) AS orders, array_agg(revenue::float8) AS revenue
+    FROM customer_sales
+"""
+
+CUSTOMER_VALUE = """
+    SELECT client.id AS customer_id, COALESCE(sales.orders, 0) AS orders, COALESCE(sales.revenue, 0)::float8 AS revenue,
+           sales.first_order_at, sales.last_order_at
+    FROM client
+    LEFT JOIN customer_sales AS sales ON sales.customer_id = client.id
+    WHERE client.id = %s
+"""
+
+TOP_CUSTOMERS = """
+    SELECT customer_id, orders, revenue::float8 AS revenue, first_order_at, last_order_at
+    FROM customer_sales
+    WHERE customer_id = ANY(%s)
+"""
+
+
+def _check_period(period: str):
+    if period not in PERIODS:
+        raise HTTPException(status_code=400, detail=f"Unknown period: {period}")
+
+def _check_ranking(ranking: str):
+    if ranking not in ITEM_RANKINGS:
+        raise HTTPException(status_code=400, detail=f"Unknown ranking: {ranking}")
+
+def _top_items_range(start: date, end: date):
+    if start is None:
+        start = (end or datetime.now(ZoneInfo(ANALYTICS_TIMEZONE)).date()) - timedelta(days=ANALYTICS_TOP_ITEMS_DAYS)
+    return {"start": start, "end": end}
+
+def _ticket(revenue, orders):
+    return round(revenue / orders, 2) if orders else 0.0
+
+def period_starts(days, period: str):
+    # days: datetime64[D]. Las semanas empiezan en lunes (1970-01-01 fue jueves)
+    if period == "week":
+        return days - ((days.astype(np.int64) + 3) % 7).astype("timedelta64[D]")
+    if period == "month":
+        return days.astype("datetime64[M]").astype("datetime64[D]")
+    return days
+
+def revenue_by_period(day_numbers, orders, revenue, period: str):
+    if not day_numbers:
+        return []
+    days = np.asarray(day_numbers, dtype=np.int64).astype("datetime64[D]")
+    starts, bucket = np.unique(period_starts(days, period), return_inverse=True)
+    bucket = bucket.ravel()
+    order_totals = np.bincount(bucket, weights=np.asarray(orders, dtype=np.float64), minlength=len(starts))
+    revenue_totals = np.bincount(bucket, weights=np.asarray(revenue, dtype=np.float64), minlength=len(starts))
+    tickets = np.divide(revenue_totals, order_totals, out=np.zeros_like(revenue_totals), where=order_totals > 0)
+    return [
+        RevenuePeriod(period_start=start, orders=int(order_count), revenue=round(total, 2), average_ticket=round(ticket, 2))
+        for start, order_count, total, ticket in zip(starts.tolist(), order_totals.tolist(), revenue_totals.tolist(), tickets.tolist())
+    ]
+
+def lifetime_value_summary(customer_ids, orders, revenue, top: int):
+    # Entre los clientes con al menos un pedido entregado. Devuelve el resumen y los ids de los top clientes en orden
+    if not customer_ids:
+        return dict(customers=0, revenue=0.0, mean=0.0, median=0.0, p90=0.0, p99=0.0, average_orders=0.0), []
+    customer_ids = np.asarray(customer_ids, dtype=np.int64)
+    orders = np.asarray(orders, dtype=np.float64)
+    revenue = np.asarray(revenue, dtype=np.float64)
+    median, p90, p99 = np.percentile(revenue, [50, 90, 99]).tolist()
+    summary = dict(
+        customers=len(customer_ids),
+        revenue=round(float(revenue.sum()), 2),
+        mean=round(float(revenue.mean()), 2),
+        median=round(median, 2),
+        p90=round(p90, 2),
+        p99=round(p99, 2),
+        average_orders=round(float(orders.mean()), 2),
+    )
+    top = min(top, len(customer_ids))
+    if top == 0:
+        return summary, []
+    best = np.argpartition(-revenue, top - 1)[:top]
+    best = best[np.lexsort((customer_ids[best], -revenue[best]))]
+    return summary, customer_ids[best].tolist()
+
+def _customer_value(record: CustomerSalesRecord):
+    return CustomerValue(average_ticket=_ticket(record.revenue, record.orders), **asdict(record))
+
+def _top_customers(rows, ranked_ids):
+    by_id = {record.customer_id: record for record in records(rows, CustomerSalesRecord)}
+    return [_customer_value(by_id[customer_id]) for customer_id in ranked_ids if customer_id in by_id]
+
+
+class AnalyticsManager:
+    @staticmethod
+    @db_errors
+    def refresh_rollups(db_connection, batch_size: int = ANALYTICS_REFRESH_BATCH):
+        # Cuántos pedidos de la cola se sumaron; 0 si la cola está vacía o si otro worker la está procesando
+        with db_connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (ROLLUP_LOCK_ID,))
+            if not cursor.fetchone()[0]:
+                db_connection.rollback()
+                return 0
+            cursor.execute(REFRESH_ROLLUPS, {"batch_size": batch_size, "timezone": ANALYTICS_TIMEZONE})
+            folded = cursor.fetchone()[0]
+        db_connection.commit()
+        return folded
+
+    @staticmethod
+    @db_errors
+    def rebuild_rollups(db_connection):
+        with db_connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (ROLLUP_LOCK_ID,))
+            cursor.execute(TRUNCATE_ROLLUPS)
+            cursor.execute(REBUILD_ROLLUPS, {"timezone": ANALYTICS_TIMEZONE})
+            rebuilt = cursor.fetchone()[0]
+        db_connection.commit()
+        return rebuilt
+
+    @staticmethod
+    @db_errors
+    def get_revenue_by_period(db_connection, period: str = "day", start: date = None, end: date = None):
+        _check_period(period)
+        with db_connection.cursor() as cursor:
+            cursor.execute(DAILY_REVENUE, {"start": start, "end": end})
+            day_numbers, orders, revenue = cursor.fetchone()
+        return revenue_by_period(day_numbers, orders, revenue, period)
+
+    @staticmethod
+    @db_errors
+    def get_average_ticket(db_connection, start: date = None, end: date = None):
+        with db_connection.cursor() as cursor:
+            cursor.execute(TOTAL_REVENUE, {"start": start, "end": end})
+            orders, revenue = cursor.fetchone()
+        return AverageTicket(orders=orders, revenue=round(revenue, 2), average_ticket=_ticket(revenue, orders))
+
+    @staticmethod
+    @db_errors
+    def get_top_items(db_connection, ranking: str = "quantity", start: date = None, end: date = None, limit: int = 10):
+        _check_ranking(ranking)
+        with db_connection.cursor() as cursor:
+            cursor.execute(TOP_ITEMS[ranking], dict(_top_items_range(start, end), limit=limit))
+            return records(cursor.fetchall(), ItemSalesRecord)
+
+    @staticmethod
+    @db_errors
+    def get_lifetime_value_summary(db_connection, top: int = 10):
+        with db_connection.cursor() as cursor:
+            cursor.execute(CUSTOMER_VALUES)
+            customer_ids, orders, revenue = cursor.fetchone()
+            summary, ranked_ids = lifetime_value_summary(customer_ids, orders, revenue, top)
+            cursor.execute(TOP_CUSTOMERS, (ranked_ids,))
+            rows = cursor.fetchall()
+        return LifetimeValueSummary(top=_top_customers(rows, ranked_ids), **summary)
+
+    @staticmethod
+    @db_errors
+    def get_customer_lifetime_value(db_connection, customer_id: int):
+        with db_connection.cursor() as cursor:
+            cursor.execute(CUSTOMER_VALUE, (customer_id,))
+            record = record_or_none(cursor.fetchone(), CustomerSalesRecord)
+        if record is None:
+            raise HTTPException(status_code=404, detail="Client not found")
+        return _customer_value(record)
+
+
+class AsyncAnalyticsManager:
+    @staticmethod
+    @db_errors
+    async def refresh_rollups(db_connection, batch_size: int = ANALYTICS_REFRESH_BATCH):
+        async with db_connection.cursor() as cursor:
+            await cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (ROLLUP_LOCK_ID,))
+            if not (await cursor.fetchone())[0]:
+                await db_connection.rollback()
+                return 0
+            await cursor.execute(REFRESH_ROLLUPS, {"batch_size": batch_size, "timezone": ANALYTICS_TIMEZONE})
+            folded = (await cursor.fetchone())[0]
+        await db_connection.commit()
+        return folded
+
+    @staticmethod
+    @db_errors
+    async def rebuild_rollups(db_connection):
+        async with db_connection.cursor() as cursor:
+            await cursor.execute("SELECT pg_advisory_xact_lock(%s)", (ROLLUP_LOCK_ID,))
+            await cursor.execute(TRUNCATE_ROLLUPS)
+            await cursor.execute(REBUILD_ROLLUPS, {"timezone": ANALYTICS_TIMEZONE})
+            rebuilt = (await cursor.fetchone())[0]
+        await db_connection.commit()
+        return rebuilt
+
+    @staticmethod
+    @db_errors
+    async def get_revenue_by_period(db_connection, period: str = "day", start: date = None, end: date = None):
+        _check_period(period)
+        async with db_connection.cursor() as cursor:
+            await cursor.execute(DAILY_REVENUE, {"start": start, "end": end})
+            day_numbers, orders, revenue = await cursor.fetchone()
+        return revenue_by_period(day_numbers, orders, revenue, period)
+
+    @staticmethod
+    @db_errors
+    async def get_average_ticket(db_connection, start: date = None, end: date = None):
+        async with db_connection.cursor() as cursor:
+            await cursor.execute(TOTAL_REVENUE, {"start": start, "end": end})
+            orders, revenue = await cursor.fetchone()
+        return AverageTicket(orders=orders, revenue=round(revenue, 2), average_ticket=_ticket(revenue, orders))
+
+    @staticmethod
+    @db_errors
+    async def get_top_items(db_connection, ranking: str = "quantity", start: date = None, end: date = None, limit: int = 10):
+        _check_ranking(ranking)
+        async with db_connection.cursor() as cursor:
+            await cursor.execute(TOP_ITEMS[ranking], dict(_top_items_range(start, end), limit=limit))
+            return records(await cursor.fetchall(), ItemSalesRecord)
+
+    @staticmethod
+    @db_errors
+    async def get_lifetime_value_summary(db_connection, top: int = 10):
+        async with db_connection.cursor() as cursor:
+            await cursor.execute(CUSTOMER_VALUES)
+            customer_ids, orders, revenue = await cursor.fetchone()
+            summary, ranked_ids = lifetime_value_summary(customer_ids, orders, revenue, top)
+            await cursor.execute(TOP_CUSTOMERS, (ranked_ids,))
+            rows = await cursor.fetchall()
+        return LifetimeValueSummary(top=_top_customers(rows, ranked_ids), **summary)
+
+    @staticmethod
+    @db_errors
+    async def get_customer_lifetime_value(db_connection, customer_id: int):
+        async with db_connection.cursor() as cursor:
+            await cursor.execute(CUSTOMER_VALUE, (customer_id,))
+            record = record_or_none(await cursor.fetchone(), CustomerSalesRecord)
+        if record is None:
+            raise HTTPException(status_code=404, detail="Client not found")
+        return _customer_value(record)
+
+
+class RollupRefresher:
+    # Cada ANALYTICS_REFRESH_INTERVAL suma la cola a los rollups, lote tras lote hasta vaciarla
+    def __init__(self, refresh, interval: float = ANALYTICS_REFRESH_INTERVAL, batch_size: int = ANALYTICS_REFRESH_BATCH, connection=db_connection):
+        self.refresh = refresh
+        self.interval = interval
+        self.batch_size = batch_size
+        self.connection = connection
+        self._task = None
+        self._stats = {"runs": 0, "folded": 0, "errors": 0, "last_folded": 0, "last_run_seconds": 0.0, "last_run_at": 0.0}
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                self._stats["errors"] += 1
+                print(f"Error in RollupRefresher: {e}")
+
+    async def run_once(self):
+        started = time.perf_counter()
+        total = 0
+        async with self.connection() as conn:
+            while True:
+                folded = await run_db(self.refresh, conn, self.batch_size)
+                total += folded
+                if folded < self.batch_size:
+                    break
+        self._stats["runs"] += 1
+        self._stats["folded"] += total
+        self._stats["last_folded"] = total
+        self._stats["last_run_seconds"] = time.perf_counter() - started
+        self._stats["last_run_at"] = time.time()
+        return total
+
+    def stats(self):
+        return {"enabled": self._task is not None, "interval": self.interval, **self._stats}
+
+
+def refresh_until_drained(conn, batch_size: int = ANALYTICS_REFRESH_BATCH):
+    total = 0
+    while True:
+        folded = AnalyticsManager.refresh_rollups(conn, batch_size)
+        total += folded
+        if folded < batch_size:
+            return total
+
+
+def main():
+    if "--refresh" not in sys.argv and "--rebuild" not in sys.argv:
+        print("Usage: python analytics.py --refresh | --rebuild")
+        return
+    conn = connect(DATABASE_URL)
+    try:
+        started = time.perf_counter()
+        if "--rebuild" in sys.argv:
+            print(f"Rebuilt the sales rollups from {AnalyticsManager.rebuild_rollups(conn)} delivered orders in {time.perf_counter() - started:.1f}s")
+            return
+        folded = refresh_until_drained(conn)
+        print(f"Folded {folded} orders into the sales rollups in {time.perf_counter() - started:.1f}s")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
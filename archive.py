@@ -0,0 +1,222 @@
+# Archivo del historial de pedidos. Los pedidos entregados hace más de ARCHIVE_AFTER_DAYS pasan de orders y
+# orderdetails a orders_archive y orderdetails_archive, así las tablas calientes solo guardan lo abierto y lo reciente.
+# OrderArchiver (una tarea por worker, y solo un worker a la vez) mueve lotes de ARCHIVE_BATCH_SIZE pedidos: cada lote
+# es una sola sentencia en su propia transacción que bloquea únicamente las filas del lote (SKIP LOCKED) y nunca
+# espera un lock más de ARCHIVE_LOCK_TIMEOUT_MS. Las lecturas por cliente y por pedido pasan por las vistas
+# orders_history y orderdetails_history, que juntan ambas tablas.
+#
+#   python archive.py            archiva todo lo pendiente
+#   python archive.py --status   muestra cuántos pedidos hay en cada tabla y cuántos faltan por archivar
+import asyncio
+import os
+import sys
+import time
+from psycopg2 import connect
+from database import DATABASE_URL, db_connection, run_db
+from queries import db_errors
+from orders import DELIVERED_STATUS
+
+ARCHIVE_AFTER_DAYS = float(os.environ.get("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "1000"))
+# Segundos entre corridas; 0 desactiva la tarea (el CLI sigue funcionando)
+ARCHIVE_INTERVAL = float(os.environ.get("ARCHIVE_INTERVAL", "3600"))
+# Pausa entre lotes para que las escrituras normales no compitan con el archivo durante toda la corrida
+ARCHIVE_BATCH_PAUSE = float(os.environ.get("ARCHIVE_BATCH_PAUSE", "0.1"))
+ARCHIVE_LOCK_TIMEOUT_MS = int(os.environ.get("ARCHIVE_LOCK_TIMEOUT_MS", "500"))
+
+ARCHIVE_LOCK_ID = 7267003
+
+# set_config(..., true) dura solo la transacción del lote: con restaurant.archiving_orders el trigger del feed no
+# publica el DELETE como una baja
+START_BATCH = """
+    SELECT pg_try_advisory_xact_lock(%(lock_id)s),
+           set_config('lock_timeout', %(lock_timeout)s, true),
+           set_config('restaurant.archiving_orders', 'on', true)
+"""
+
+# Un lote en una sentencia: las líneas se copian del snapshot del inicio y el DELETE del pedido las borra en cascada.
+# Los pedidos que analytics.py aún no suma a los rollups se quedan hasta la siguiente corrida. El estado va escrito en
+# la consulta (no como parámetro) para que el plan genérico de psycopg 3 también recorra orders_archivable_idx en orden
+# de delivered_at, y el DELETE busca cada pedido del lote por su llave en vez de cruzar el lote con orders entera.
+ARCHIVE_ORDERS = f"""
+    WITH batch AS (
+        SELECT order_id FROM orders
+        WHERE order_status = '{DELIVERED_STATUS}'
+          AND delivered_at < now() - %(after_days)s * interval '1 day'
+          AND NOT EXISTS (SELECT 1 FROM sales_rollup_queue WHERE sales_rollup_queue.order_id = orders.order_id)
+        ORDER BY delivered_at
+        LIMIT %(batch_size)s
+        FOR UPDATE SKIP LOCKED
+    ), lines AS (
+        INSERT INTO orderdetails_archive (detail_id, order_id, item_id, quantity, unit_price)
+        SELECT orderdetails.detail_id, orderdetails.order_id, orderdetails.item_id, orderdetails.quantity, orderdetails.unit_price
+        FROM batch
+        JOIN orderdetails ON orderdetails.order_id = batch.order_id
+    ), moved AS (
+        DELETE FROM orders
+        WHERE orders.order_id = ANY(ARRAY(SELECT order_id FROM batch))
+        RETURNING orders.order_id, orders.customer_id, orders.order_status, orders.total_price, orders.delivered_at
+    )
+    INSERT INTO orders_archive (order_id, customer_id, order_status, total_price, delivered_at)
+    SELECT order_id, customer_id, order_status, total_price, delivered_at FROM moved
+"""
+
+ARCHIVE_STATUS = """
+    SELECT
+        (SELECT count(*) FROM orders),
+        (SELECT count(*) FROM orders
+         WHERE order_status = %(delivered)s AND delivered_at < now() - %(after_days)s * interval '1 day'),
+        (SELECT count(*) FROM orders_archive)
+"""
+
+
+def _batch_params():
+    return {"lock_id": ARCHIVE_LOCK_ID, "lock_timeout": f"{ARCHIVE_LOCK_TIMEOUT_MS}ms"}
+
+def _archive_params(batch_size: int, after_days: float):
+    return {"after_days": after_days, "batch_size": batch_size}
+
+
+class ArchiveManager:
+    @staticmethod
+    @db_errors
+    def archive_orders(db_connection, batch_size: int = ARCHIVE_BATCH_SIZE, after_days: float = ARCHIVE_AFTER_DAYS):
+        # Cuántos pedidos se archivaron; 0 si no queda nada o si otro worker está archivando
+        with db_connection.cursor() as cursor:
+            cursor.execute(START_BATCH, _batch_params())
+            if not cursor.fetchone()[0]:
+                db_connection.rollback()
+                return 0
+            cursor.execute(ARCHIVE_ORDERS, _archive_params(batch_size, after_days))
+            archived = cursor.rowcount
+        db_connection.commit()
+        return archived
+
+    @staticmethod
+    @db_errors
+    def archive_status(db_connection, after_days: float = ARCHIVE_AFTER_DAYS):
+        with db_connection.cursor() as cursor:
+            cursor.execute(ARCHIVE_STATUS, {"delivered": DELIVERED_STATUS, "after_days": after_days})
+            hot, pending, archived = cursor.fetchone()
+        db_connection.rollback()
+        return {"hot_orders": hot, "pending_orders": pending, "archived_orders": archived}
+
+
+class AsyncArchiveManager:
+    @staticmethod
+    @db_errors
+    async def archive_orders(db_connection, batch_size: int = ARCHIVE_BATCH_SIZE, after_days: float = ARCHIVE_AFTER_DAYS):
+        async with db_connection.cursor() as cursor:
+            await cursor.execute(START_BATCH, _batch_params())
+            if not (await cursor.fetchone())[0]:
+                await db_connection.rollback()
+                return 0
+            await cursor.execute(ARCHIVE_ORDERS, _archive_params(batch_size, after_days))
+            archived = cursor.rowcount
+        await db_connection.commit()
+        return archived
+
+    @staticmethod
+    @db_errors
+    async def archive_status(db_connection, after_days: float = ARCHIVE_AFTER_DAYS):
+        async with db_connection.cursor() as cursor:
+            await cursor.execute(ARCHIVE_STATUS, {"delivered": DELIVERED_STATUS, "after_days": after_days})
+            hot, pending, archived = await cursor.fetchone()
+        await db_connection.rollback()
+        return {"hot_orders": hot, "pending_orders": pending, "archived_orders": archived}
+
+
+class OrderArchiver:
+    # Cada ARCHIVE_INTERVAL archiva lote tras lote hasta que no queda nada. Cada lote toma y suelta su conexión, así
+    # que una corrida larga no se queda con un lugar del pool durante las pausas.
+    def __init__(
+        self, archive, interval: float = ARCHIVE_INTERVAL, batch_size: int = ARCHIVE_BATCH_SIZE,
+        pause: float = ARCHIVE_BATCH_PAUSE, connection=db_connection,
+    ):
+        self.archive = archive
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.connection = connection
+        self._task = None
+        self._stats = {
+            "runs": 0, "archived": 0, "errors": 0, "last_archived": 0, "last_run_seconds": 0.0, "last_run_at": 0.0,
+            "max_batch_seconds": 0.0,
+        }
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                self._stats["errors"] += 1
+                print(f"Error in OrderArchiver: {e}")
+
+    async def run_once(self):
+        started = time.perf_counter()
+        total = 0
+        while True:
+            batch_started = time.perf_counter()
+            async with self.connection() as conn:
+                archived = await run_db(self.archive, conn, self.batch_size)
+            self._stats["max_batch_seconds"] = max(self._stats["max_batch_seconds"], time.perf_counter() - batch_started)
+            total += archived
+            if archived < self.batch_size:
+                break
+            await asyncio.sleep(self.pause)
+        self._stats["runs"] += 1
+        self._stats["archived"] += total
+        self._stats["last_archived"] = total
+        self._stats["last_run_seconds"] = time.perf_counter() - started
+        self._stats["last_run_at"] = time.time()
+        return total
+
+    def stats(self):
+        return {"enabled": self._task is not None, "interval": self.interval, "after_days": ARCHIVE_AFTER_DAYS, **self._stats}
+
+
+def archive_until_drained(conn, batch_size: int = ARCHIVE_BATCH_SIZE, after_days: float = ARCHIVE_AFTER_DAYS, pause: float = 0):
+    total = 0
+    while True:
+        archived = ArchiveManager.archive_orders(conn, batch_size, after_days)
+        total += archived
+        if archived < batch_size:
+            return total
+        time.sleep(pause)
+
+
+def main():
+    conn = connect(DATABASE_URL)
+    try:
+        if "--status" in sys.argv:
+            for name, count in ArchiveManager.archive_status(conn).items():
+                print(f"{name:<18}{count:>12}")
+            return
+        started = time.perf_counter()
+        archived = archive_until_drained(conn, pause=ARCHIVE_BATCH_PAUSE)
+        print(f"Archived {archived} orders delivered more than {ARCHIVE_AFTER_DAYS:g} days ago in {time.perf_counter() - started:.1f}s")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
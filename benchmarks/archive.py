@@ -0,0 +1,153 @@
+# Archivo del historial sobre una base sintética grande: mide las lecturas por cliente y por pedido y un recorrido
+# completo de orders con todo el historial en las tablas calientes, archiva por lotes (la duración de cada lote es el
+# tiempo que retiene sus locks) y vuelve a medir lo mismo con el historial en orders_archive/orderdetails_archive.
+# Siempre empieza con el historial completo en orders: si ya hay pedidos archivados, vuelve a cargar los datos.
+#
+#   python -m benchmarks.archive --dsn postgres://localhost/restaurant_bench --orders 2000000 --after-days 90
+import argparse
+import time
+from orders import OrderManager
+from archive import ArchiveManager
+from benchmarks.datagen import add_arguments, analyze, connect_and_migrate, seed_from_args, table_counts
+from benchmarks.results import summarize, save_results, print_table
+
+TABLES = ["orders", "orderdetails", "orders_archive", "orderdetails_archive"]
+
+# (nombre, llamada, muestra que recorre)
+READS = [
+    ("by_customer (all)", lambda c, customer_id: OrderManager.get_orders_by_customer_id(c, customer_id), "customers"),
+    ("by_customer (limit 20)", lambda c, customer_id: OrderManager.get_orders_by_customer_id(c, customer_id, 20), "customers"),
+    ("details (archivable order)", OrderManager.get_order_details, "old_orders"),
+    ("details (open order)", OrderManager.get_order_details, "open_orders"),
+]
+
+
+def archived_count(db_connection):
+    with db_connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM orders_archive")
+        count = cursor.fetchone()[0]
+    db_connection.rollback()
+    return count
+
+
+def sample(db_connection, size: int, after_days: float):
+    # Los pedidos viejos son los que el archivo va a mover; los abiertos se quedan en orders
+    with db_connection.cursor() as cursor:
+        cursor.execute("SELECT id FROM client WHERE EXISTS (SELECT 1 FROM orders WHERE customer_id = id) ORDER BY random() LIMIT %s", (size,))
+        customers = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            """
+            SELECT order_id FROM orders
+            WHERE order_status = 'Entregado' AND delivered_at < now() - %s * interval '1 day'
+            ORDER BY random() LIMIT %s
+            """,
+            (after_days, size),
+        )
+        old_orders = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT order_id FROM orders WHERE order_status <> 'Entregado' ORDER BY random() LIMIT %s", (size,))
+        open_orders = [row[0] for row in cursor.fetchall()]
+    db_connection.rollback()
+    return {"customers": customers, "old_orders": old_orders, "open_orders": open_orders}
+
+
+def time_read(db_connection, call, ids, warmup: int):
+    for key in ids[:warmup]:
+        call(db_connection, key)
+        db_connection.rollback()
+    latencies = []
+    started = time.perf_counter()
+    for key in ids:
+        call_started = time.perf_counter()
+        call(db_connection, key)
+        latencies.append(time.perf_counter() - call_started)
+        db_connection.rollback()
+    return summarize(latencies, 0, time.perf_counter() - started)
+
+
+def time_scan(db_connection, runs: int):
+    # El stream de /orders/all_info/stream: recorre orders completa, como cualquier consulta sin índice sobre orders
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(runs):
+        call_started = time.perf_counter()
+        for _ in OrderManager.stream_all_order_info(db_connection):
+            pass
+        latencies.append(time.perf_counter() - call_started)
+        db_connection.rollback()
+    return summarize(latencies, 0, time.perf_counter() - started)
+
+
+def measure(db_connection, samples: dict, args):
+    results = {name: time_read(db_connection, call, samples[key], args.warmup) for name, call, key in READS}
+    results["full scan of orders"] = time_scan(db_connection, args.scans)
+    return results
+
+
+def table_sizes(db_connection):
+    with db_connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relname, reltuples::bigint, pg_total_relation_size(oid) FROM pg_class WHERE relname = ANY(%s)", (TABLES,)
+        )
+        sizes = {name: {"rows": rows, "bytes": size} for name, rows, size in cursor.fetchall()}
+    db_connection.rollback()
+    return sizes
+
+
+def archive_all(db_connection, batch_size: int, after_days: float):
+    durations = []
+    started = time.perf_counter()
+    while True:
+        batch_started = time.perf_counter()
+        archived = ArchiveManager.archive_orders(db_connection, batch_size, after_days)
+        durations.append(time.perf_counter() - batch_started)
+        if archived < batch_size:
+            break
+    elapsed = time.perf_counter() - started
+    return {"batches": summarize(durations, 0, elapsed), "archived": archived_count(db_connection), "elapsed": elapsed}
+
+
+def print_sizes(before: dict, after: dict):
+    print(f"  {'table':<24}{'rows before':>14}{'rows after':>14}{'MB before':>12}{'MB after':>12}")
+    for name in TABLES:
+        b, a = before.get(name, {"rows": 0, "bytes": 0}), after.get(name, {"rows": 0, "bytes": 0})
+        print(f"  {name:<24}{max(b['rows'], 0):>14}{max(a['rows'], 0):>14}{b['bytes'] / 2**20:>12.1f}{a['bytes'] / 2**20:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure order reads and scans before and after archiving delivered history")
+    add_arguments(parser)
+    parser.add_argument("--seed", action="store_true", help="(Re)load synthetic data before running")
+    parser.add_argument("--after-days", type=float, default=90, help="Archive orders delivered more than this many days ago")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--sample", type=int, default=500, help="Customers and orders read in each phase")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--scans", type=int, default=3, help="Full scans of orders in each phase")
+    parser.add_argument("--output", help="Save results as JSON")
+    args = parser.parse_args()
+
+    conn = connect_and_migrate(args.dsn)
+    try:
+        if args.seed or table_counts(conn)["orders"] == 0 or archived_count(conn):
+            seed_from_args(conn, args)
+        samples = sample(conn, args.sample, args.after_days)
+        sizes_before = table_sizes(conn)
+        before = measure(conn, samples, args)
+        archiving = archive_all(conn, args.batch_size, args.after_days)
+        # Lo que autovacuum haría con las filas que salieron de orders, antes de volver a medir
+        analyze(conn)
+        sizes_after = table_sizes(conn)
+        after = measure(conn, samples, args)
+    finally:
+        conn.close()
+
+    print_table("All history in orders", before)
+    print_table(f"Orders delivered more than {args.after_days:g} days ago archived", after)
+    print_table(f"Archive batches ({archiving['archived']} orders in {archiving['elapsed']:.1f}s)", {"archive_orders": archiving["batches"]})
+    print_sizes(sizes_before, sizes_after)
+    if args.output:
+        results = {"before": before, "after": after, "archive": archiving, "sizes": {"before": sizes_before, "after": sizes_after}}
+        save_results(args.output, "archive", results, dict(vars(args), dsn=None))
+
+
+if __name__ == "__main__":
+    main()
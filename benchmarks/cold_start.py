@@ -0,0 +1,112 @@
+# Arranque en frío: levanta serve.py, mide el tiempo desde el spawn hasta la primera respuesta 200 de cada ruta y
+# cuánto tarda en salir tras SIGTERM. Compara el arranque completo (sentencias preparadas y menú en caché) con uno
+# sin preparar nada, en cada modo de base de datos.
+#
+#   python -m benchmarks.cold_start --dsn postgres://localhost/restaurant_bench --workers 2 --runs 5
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+import httpx
+from benchmarks.datagen import BENCH_DATABASE_URL
+from benchmarks.results import save_results
+
+PATHS = ["/menu/all_info", "/menu/1", "/clients/1", "/orders/1/details"]
+
+VARIANTS = {
+    "warm_start": {"STARTUP_PRIME_CACHES": "1", "DB_PREPARE_STATEMENTS": "1"},
+    "bare_start": {"STARTUP_PRIME_CACHES": "0", "DB_PREPARE_STATEMENTS": "0"},
+}
+
+
+def wait_for_first_success(client: httpx.Client, base_url: str, path: str, started: float, timeout: float):
+    # Sondea cada 10 ms; el tiempo cuenta desde el spawn del proceso
+    while time.perf_counter() - started < timeout:
+        try:
+            if client.get(base_url + path).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"{path} did not answer 200 within {timeout}s")
+
+
+def first_request_latencies(client: httpx.Client, base_url: str, paths):
+    # Primera petición de cada ruta en el worker que respondió el sondeo (misma conexión keep-alive): aquí se nota el
+    # menú en caché y el PREPARE
+    latencies = {}
+    for path in paths:
+        started = time.perf_counter()
+        client.get(base_url + path)
+        latencies[path] = (time.perf_counter() - started) * 1000
+    return latencies
+
+
+def run_once(args, mode: str, variant: dict):
+    env = dict(os.environ, DB_MODE=mode, **variant)
+    if args.dsn:
+        env["DATABASE_URL"] = args.dsn
+    base_url = f"http://127.0.0.1:{args.port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(args.port), "--workers", str(args.workers)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(timeout=args.timeout) as client:
+            ready = wait_for_first_success(client, base_url, PATHS[0], started, args.timeout)
+            latencies = first_request_latencies(client, base_url, PATHS[1:])
+    finally:
+        stopping = time.perf_counter()
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+    return {"first_success_s": ready, "first_request_ms": latencies, "shutdown_s": time.perf_counter() - stopping}
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else 0.0
+
+
+def summarize_runs(runs):
+    return {
+        "runs": len(runs),
+        "first_success_s": _median([r["first_success_s"] for r in runs]),
+        "shutdown_s": _median([r["shutdown_s"] for r in runs]),
+        "first_request_ms": {path: _median([r["first_request_ms"][path] for r in runs]) for path in PATHS[1:]},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start time to first successful request")
+    parser.add_argument("--dsn", default=BENCH_DATABASE_URL, help="DATABASE_URL for the spawned servers (or BENCH_DATABASE_URL)")
+    parser.add_argument("--modes", nargs="+", default=["sync", "async"], choices=["sync", "async"])
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="Save results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.modes:
+        for name in args.variants:
+            runs = [run_once(args, mode, VARIANTS[name]) for _ in range(args.runs)]
+            results[f"{mode} / {name}"] = summarize_runs(runs)
+
+    header = "".join(f"{path:>20}" for path in PATHS[1:])
+    print(f"  {'mode / variant':<24}{'first 200 s':>12}{'shutdown s':>12}{header}   (first request ms)")
+    for name, r in results.items():
+        latencies = "".join(f"{r['first_request_ms'][path]:>20.2f}" for path in PATHS[1:])
+        print(f"  {name:<24}{r['first_success_s']:>12.2f}{r['shutdown_s']:>12.2f}{latencies}")
+    if args.output:
+        save_results(args.output, "cold_start", {"cold_start": results}, dict(vars(args), dsn=None))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# Generador de datos sintéticos. Carga todo del lado del servidor con generate_series, así que millones de filas
+# tardan segundos. BORRA el contenido de menu, client, orders y orderdetails (y su archivo) antes de cargar.
+#
+#   python -m benchmarks.datagen --dsn postgres://localhost/restaurant_bench --orders 1000000
+import argparse
+import os
+import time
+from psycopg2 import connect
+from migrations import migrate
+from analytics import AnalyticsManager
+
+BENCH_DATABASE_URL = os.environ.get("BENCH_DATABASE_URL")
+
+DEFAULT_COUNTS = {
+    "clients": 50000,
+    "menu_items": 300,
+    "orders": 500000,
+    "details_per_order": 3,
+}
+
+
+def seed(db_connection, clients: int, menu_items: int, orders: int, details_per_order: int, random_seed: float = 0.42):
+    timings = {}
+    with db_connection.cursor() as cursor:
+        cursor.execute("SELECT setseed(%s)", (random_seed,))
+        cursor.execute("TRUNCATE orderdetails_archive, orders_archive, orderdetails, orders, client, menu RESTART IDENTITY CASCADE")
+        # Sin esto cada pedido sintético mandaría su NOTIFY al feed de cocina
+        cursor.execute("ALTER TABLE orders DISABLE TRIGGER orders_notify_changed, DISABLE TRIGGER orders_notify_updated")
+
+        started = time.perf_counter()
+        cursor.execute(
+            """
+            INSERT INTO menu (name, price)
+            SELECT 'Item ' || i, round((2 + random() * 28)::numeric, 2)
+            FROM generate_series(1, %s) AS i
+            """,
+            (menu_items,),
+        )
+        timings["menu"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        cursor.execute(
+            """
+            INSERT INTO client (name, address, phone_number, clerkid)
+            SELECT 'Client ' || i, i || ' Main Street', lpad(i::text, 10, '0'), 'user_' || md5(i::text)
+            FROM generate_series(1, %s) AS i
+            """,
+            (clients,),
+        )
+        timings["client"] = time.perf_counter() - started
+
+        # La mayoría del historial está entregado, como en producción, repartido en el último año
+        started = time.perf_counter()
+        cursor.execute(
+            """
+            INSERT INTO orders (customer_id, order_status, delivered_at)
+            SELECT
+                1 + floor(random() * %s)::int,
+                CASE
+                    WHEN r < 0.05 THEN 'En cola'
+                    WHEN r < 0.10 THEN 'En proceso'
+                    ELSE 'Entregado'
+                END,
+                CASE WHEN r >= 0.10 THEN now() - random() * interval '365 days' END
+            FROM (SELECT random() AS r FROM generate_series(1, %s)) AS statuses
+            """,
+            (clients, orders),
+        )
+        timings["orders"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        cursor.execute(
+            """
+            INSERT INTO orderdetails (order_id, item_id, quantity, unit_price)
+            SELECT lines.order_id, menu.menu_id, lines.quantity, menu.price
+            FROM (
+                SELECT orders.order_id, 1 + floor(random() * %s)::int AS item_id, 1 + floor(random() * 4)::int AS quantity
+                FROM orders, generate_series(1, %s)
+            ) AS lines
+            JOIN menu ON menu.menu_id = lines.item_id
+            """,
+            (menu_items, details_per_order),
+        )
+        cursor.execute(
+            """
+            UPDATE orders SET total_price = computed.total_price
+            FROM (
+                SELECT order_id, SUM(unit_price * quantity) AS total_price
+                FROM orderdetails
+                GROUP BY order_id
+            ) AS computed
+            WHERE computed.order_id = orders.order_id
+            """
+        )
+        timings["orderdetails"] = time.perf_counter() - started
+        cursor.execute("ALTER TABLE orders ENABLE TRIGGER orders_notify_changed, ENABLE TRIGGER orders_notify_updated")
+    db_connection.commit()
+
+    started = time.perf_counter()
+    AnalyticsManager.rebuild_rollups(db_connection)
+    timings["rollups"] = time.perf_counter() - started
+
+    analyze(db_connection)
+    return timings
+
+
+def analyze(db_connection):
+    db_connection.autocommit = True
+    try:
+        with db_connection.cursor() as cursor:
+            cursor.execute("VACUUM ANALYZE menu, client, orders, orderdetails, orders_archive, orderdetails_archive")
+    finally:
+        db_connection.autocommit = False
+
+
+def table_counts(db_connection):
+    counts = {}
+    with db_connection.cursor() as cursor:
+        for table in ("menu", "client", "orders", "orderdetails"):
+            cursor.execute(f"SELECT count(*) FROM {table}")
+            counts[table] = cursor.fetchone()[0]
+    db_connection.rollback()
+    return counts
+
+
+def add_arguments(parser):
+    parser.add_argument("--dsn", default=BENCH_DATABASE_URL, help="Benchmark database (or BENCH_DATABASE_URL); never the production one")
+    parser.add_argument("--clients", type=int, default=DEFAULT_COUNTS["clients"])
+    parser.add_argument("--menu-items", type=int, default=DEFAULT_COUNTS["menu_items"])
+    parser.add_argument("--orders", type=int, default=DEFAULT_COUNTS["orders"])
+    parser.add_argument("--details-per-order", type=int, default=DEFAULT_COUNTS["details_per_order"])
+
+
+def connect_and_migrate(dsn):
+    if not dsn:
+        raise SystemExit("A benchmark database is required: pass --dsn or set BENCH_DATABASE_URL")
+    conn = connect(dsn)
+    migrate(conn)
+    return conn
+
+
+def seed_from_args(conn, args):
+    return seed(conn, args.clients, args.menu_items, args.orders, args.details_per_order)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load synthetic data into a benchmark database")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    conn = connect_and_migrate(args.dsn)
+    try:
+        timings = seed_from_args(conn, args)
+        for table, count in table_counts(conn).items():
+            print(f"{table:<14}{count:>12} rows  {timings.get(table, 0):8.2f}s")
+        print(f"{'rollups':<14}{'':>17}{timings['rollups']:8.2f}s")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# Compara el camino actual (cada add_items_to_order confirma su propia transacción) contra la cola de ingesta que
+# confirma por lotes. Reporta peticiones/s, commits/s y latencias con el mismo número de clientes concurrentes.
+#
+#   python -m benchmarks.ingest --dsn postgres://localhost/restaurant_bench --concurrency 64 --duration 10
+import argparse
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+import psycopg
+from anyio import to_thread
+from psycopg2 import connect
+from starlette.concurrency import run_in_threadpool
+from orders import OrderManager, AsyncOrderManager, OrderLine
+from ingest import IngestQueue
+from benchmarks.datagen import add_arguments, connect_and_migrate, seed_from_args, table_counts
+from benchmarks.results import summarize, save_results, print_table
+
+
+class _Clients:
+    # Un cliente virtual agrega productos, uno a la vez, a los pedidos abiertos del benchmark
+    def __init__(self, order_ids, menu_items: int, random_seed: int):
+        self.order_ids = order_ids
+        self.menu_items = menu_items
+        self.random_seed = random_seed
+        self.latencies = []
+        self.errors = 0
+
+    def next_write(self, rng):
+        return rng.choice(self.order_ids), rng.randint(1, self.menu_items), rng.randint(1, 3)
+
+    async def run(self, concurrency: int, duration: float, write):
+        deadline = time.perf_counter() + duration
+
+        async def client(n):
+            rng = random.Random(self.random_seed + n)
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    await write(n, *self.next_write(rng))
+                except Exception:
+                    self.errors += 1
+                    continue
+                self.latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client(n) for n in range(concurrency)))
+        return time.perf_counter() - started
+
+
+async def per_request_commits(mode, dsn, clients: _Clients, concurrency: int, duration: float):
+    # Una conexión por cliente, como con un pool del tamaño de la concurrencia
+    if mode == "async":
+        connections = [await psycopg.AsyncConnection.connect(dsn) for _ in range(concurrency)]
+
+        async def write(n, order_id, item_id, quantity):
+            await AsyncOrderManager.add_items_to_order(connections[n], order_id, item_id, quantity)
+    else:
+        connections = [connect(dsn) for _ in range(concurrency)]
+        # El threadpool de starlette deja 40 hilos por defecto; aquí cada cliente necesita el suyo
+        to_thread.current_default_thread_limiter().total_tokens = concurrency
+
+        async def write(n, order_id, item_id, quantity):
+            await run_in_threadpool(OrderManager.add_items_to_order, connections[n], order_id, item_id, quantity)
+
+    try:
+        elapsed = await clients.run(concurrency, duration, write)
+    finally:
+        for conn in connections:
+            if mode == "async":
+                await conn.close()
+            else:
+                conn.close()
+    return elapsed, len(clients.latencies)
+
+
+async def batched_commits(mode, dsn, clients: _Clients, concurrency: int, duration: float, batch_size: int, flush_ms: float):
+    # El escritor de la cola usa una sola conexión dedicada
+    if mode == "async":
+        conn = await psycopg.AsyncConnection.connect(dsn)
+        method = AsyncOrderManager.add_items_to_order
+    else:
+        conn = connect(dsn)
+        method = OrderManager.add_items_to_order
+
+    @asynccontextmanager
+    async def writer_connection():
+        yield conn
+
+    queue = IngestQueue(batch_size=batch_size, flush_ms=flush_ms, queue_size=concurrency * 4, enqueue_timeout=5, connection=writer_connection)
+    await queue.start()
+
+    async def write(n, order_id, item_id, quantity):
+        await queue.submit(None, method, order_id, item_id, quantity)
+
+    try:
+        elapsed = await clients.run(concurrency, duration, write)
+        await queue.stop()
+    finally:
+        if mode == "async":
+            await conn.close()
+        else:
+            conn.close()
+    return elapsed, queue.stats()["batches"]
+
+
+def create_orders(conn, count: int, customers: int):
+    return [
+        OrderManager.create_order_with_items(conn, random.randint(1, customers), [OrderLine(item_id=1, quantity=1)])["result"]["order_id"]
+        for _ in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Commits/s and latency of per-request commits versus the batched ingestion queue")
+    add_arguments(parser)
+    parser.add_argument("--modes", nargs="+", default=["sync", "async"], choices=["sync", "async"])
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--target-orders", type=int, default=200, help="Open orders the clients add items to")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--flush-ms", type=float, default=5)
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--output", help="Save results as JSON")
+    args = parser.parse_args()
+
+    conn = connect_and_migrate(args.dsn)
+    try:
+        counts = table_counts(conn)
+        if counts["orders"] == 0:
+            seed_from_args(conn, args)
+            counts = table_counts(conn)
+        order_ids = create_orders(conn, args.target_orders, counts["client"])
+
+        results = {}
+        for mode in args.modes:
+            clients = _Clients(order_ids, counts["menu"], args.random_seed)
+            elapsed, commits = asyncio.run(per_request_commits(mode, args.dsn, clients, args.concurrency, args.duration))
+            results[f"{mode} per-request"] = dict(summarize(clients.latencies, clients.errors, elapsed), commits_per_second=commits / elapsed)
+
+            clients = _Clients(order_ids, counts["menu"], args.random_seed)
+            elapsed, commits = asyncio.run(
+                batched_commits(mode, args.dsn, clients, args.concurrency, args.duration, args.batch_size, args.flush_ms)
+            )
+            results[f"{mode} batched"] = dict(summarize(clients.latencies, clients.errors, elapsed), commits_per_second=commits / elapsed)
+
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM orders WHERE order_id = ANY(%s)", (order_ids,))
+        conn.commit()
+    finally:
+        conn.close()
+
+    print_table(f"{args.concurrency} concurrent writers for {args.duration:.0f}s", results)
+    for name, result in results.items():
+        print(f"  {name:<48}{result['commits_per_second']:>10.1f} commits/s")
+    if args.output:
+        save_results(args.output, "ingest", results, dict(vars(args), dsn=None))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+# Benchmark de carga HTTP. El escenario "mix" reproduce el tráfico real (ver menú, crear pedidos, agregar productos,
+# avanzar estados en cocina); "reads" solo golpea las rutas de lectura. Reporta throughput y p50/p95/p99 por ruta.
+#
+#   python -m benchmarks.load --dsn postgres://localhost/restaurant_bench --modes sync async --output run.json
+#   python -m benchmarks.load --url http://localhost:8000   (contra un servidor ya levantado)
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict, deque
+import httpx
+from benchmarks.datagen import BENCH_DATABASE_URL, DEFAULT_COUNTS
+from benchmarks.results import summarize, save_results, print_table
+
+READ_PATHS = ["/menu/all_info", "/orders/all_info?limit=100", "/clients/all_info?limit=100"]
+
+# Peso relativo de cada acción del escenario "mix"
+MIX_WEIGHTS = {
+    "browse_menu": 45,
+    "customer_lookup": 15,
+    "create_order": 15,
+    "add_items": 15,
+    "advance_status": 10,
+}
+
+
+class LoadRecorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def request(self, client, method: str, route: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[f"{method} {route}"] += 1
+            return None
+        if response.status_code >= 400:
+            self.errors[f"{method} {route}"] += 1
+            return None
+        self.latencies[f"{method} {route}"].append(time.perf_counter() - started)
+        return response
+
+    def summary(self, elapsed: float):
+        routes = {
+            route: summarize(self.latencies.get(route, []), self.errors.get(route, 0), elapsed)
+            for route in sorted(self.latencies.keys() | self.errors.keys())
+        }
+        all_latencies = [latency for values in self.latencies.values() for latency in values]
+        return {"total": summarize(all_latencies, sum(self.errors.values()), elapsed), "routes": routes}
+
+
+class MixedUser:
+    # Un usuario virtual: recuerda sus pedidos abiertos para agregarles productos y avanzarlos en cocina
+    def __init__(self, recorder: LoadRecorder, clients: int, menu_items: int, rng: random.Random):
+        self.recorder = recorder
+        self.clients = clients
+        self.menu_items = menu_items
+        self.rng = rng
+        self.open_orders = deque(maxlen=20)
+        self.actions = list(MIX_WEIGHTS)
+        self.weights = [MIX_WEIGHTS[action] for action in self.actions]
+
+    async def step(self, client):
+        action = self.rng.choices(self.actions, self.weights)[0]
+        if action in ("add_items", "advance_status") and not self.open_orders:
+            action = "create_order"
+        await getattr(self, action)(client)
+
+    async def browse_menu(self, client):
+        await self.recorder.request(client, "GET", "/menu/all_info", "/menu/all_info")
+        item_id = self.rng.randint(1, self.menu_items)
+        await self.recorder.request(client, "GET", "/menu/{item_id}", f"/menu/{item_id}")
+
+    async def customer_lookup(self, client):
+        customer_id = self.rng.randint(1, self.clients)
+        # datagen usa 'user_' || md5(i) como clerkid
+        clerk_id = "user_" + hashlib.md5(str(customer_id).encode()).hexdigest()
+        await self.recorder.request(client, "GET", "/clients/by_clerk/{clerk_id}", f"/clients/by_clerk/{clerk_id}")
+        await self.recorder.request(client, "GET", "/orders/by_customer/{customer_id}", f"/orders/by_customer/{customer_id}")
+
+    async def create_order(self, client):
+        customer_id = self.rng.randint(1, self.clients)
+        response = await self.recorder.request(client, "POST", "/orders/add", "/orders/add", params={"customer_id": customer_id})
+        if response is not None:
+            self.open_orders.append(response.json()["result"]["order_id"])
+
+    async def add_items(self, client):
+        order_id = self.rng.choice(self.open_orders)
+        for _ in range(self.rng.randint(1, 3)):
+            params = {"item_id": self.rng.randint(1, self.menu_items), "quantity": self.rng.randint(1, 3)}
+            await self.recorder.request(client, "POST", "/orders/{order_id}/add_items", f"/orders/{order_id}/add_items", params=params)
+        await self.recorder.request(client, "GET", "/orders/{order_id}/total_price", f"/orders/{order_id}/total_price")
+
+    async def advance_status(self, client):
+        order_id = self.open_orders.popleft()
+        await self.recorder.request(client, "PUT", "/orders/{order_id}/change_status", f"/orders/{order_id}/change_status")
+        if self.rng.random() < 0.5:
+            self.open_orders.append(order_id)
+
+
+async def run_reads(base_url, paths, concurrency, duration):
+    recorder = LoadRecorder()
+    deadline = time.perf_counter() + duration
+
+    async def worker(worker_id, client):
+        i = worker_id
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            await recorder.request(client, "GET", path.split("?")[0], path)
+
+    return await _run_workers(base_url, concurrency, worker, recorder)
+
+
+async def run_mix(base_url, concurrency, duration, clients, menu_items, random_seed):
+    recorder = LoadRecorder()
+    deadline = time.perf_counter() + duration
+
+    async def worker(worker_id, client):
+        user = MixedUser(recorder, clients, menu_items, random.Random(random_seed + worker_id))
+        while time.perf_counter() < deadline:
+            await user.step(client)
+
+    return await _run_workers(base_url, concurrency, worker, recorder)
+
+
+async def _run_workers(base_url, concurrency, worker, recorder):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(n, client) for n in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return recorder.summary(elapsed)
+
+
+def run_scenario(base_url, args):
+    if args.scenario == "reads":
+        return asyncio.run(run_reads(base_url, args.paths, args.concurrency, args.duration))
+    return asyncio.run(run_mix(base_url, args.concurrency, args.duration, args.clients, args.menu_items, args.random_seed))
+
+
+def wait_until_ready(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(base_url + "/pool/stats", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not become ready")
+
+
+def run_mode(mode, args):
+    port = args.port
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, DB_MODE=mode)
+    if args.dsn:
+        env["DATABASE_URL"] = args.dsn
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        wait_until_ready(base_url)
+        return run_scenario(base_url, args)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load benchmark for the restaurant chain API")
+    parser.add_argument("--url", help="Run against an already running server instead of spawning one per mode")
+    parser.add_argument("--dsn", default=BENCH_DATABASE_URL, help="DATABASE_URL for the spawned servers (or BENCH_DATABASE_URL)")
+    parser.add_argument("--modes", nargs="+", default=["sync", "async"], choices=["sync", "async"])
+    parser.add_argument("--scenario", default="mix", choices=["mix", "reads"])
+    parser.add_argument("--paths", nargs="+", default=READ_PATHS, help="Paths for the reads scenario")
+    parser.add_argument("--clients", type=int, default=DEFAULT_COUNTS["clients"], help="Client ids to draw from (match datagen)")
+    parser.add_argument("--menu-items", type=int, default=DEFAULT_COUNTS["menu_items"], help="Menu ids to draw from (match datagen)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--output", help="Save results as JSON")
+    args = parser.parse_args()
+
+    if args.url:
+        results = {"server": run_scenario(args.url, args)}
+    else:
+        results = {mode: run_mode(mode, args) for mode in args.modes}
+
+    for name, result in results.items():
+        print_table(f"{name}: {result['total']['rps']:.1f} req/s, {result['total']['errors']} errors", result["routes"])
+    if args.output:
+        save_results(args.output, "load", results, dict(vars(args), dsn=None))
+
+
+if __name__ == "__main__":
+    main()
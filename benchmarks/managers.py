@@ -0,0 +1,82 @@
+# Micro-benchmarks de cada método de los managers contra la base sintética. Reutiliza los casos de query_plans;
+# las escrituras se deshacen después de cada iteración, así que la base no cambia entre corridas.
+#
+#   python -m benchmarks.managers --dsn postgres://localhost/restaurant_bench --iterations 200 --output managers.json
+import argparse
+import time
+from benchmarks.datagen import add_arguments, connect_and_migrate, seed_from_args, table_counts
+from benchmarks.query_plans import CASES, sample_ids
+from benchmarks.results import summarize, save_results, print_table
+
+
+class NoCommitConnection:
+    def __init__(self, raw):
+        self.raw = raw
+
+    def cursor(self, *args, **kwargs):
+        return self.raw.cursor(*args, **kwargs)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.raw.rollback()
+
+
+def run_case(raw_connection, case, sample: dict, iterations: int, warmup: int):
+    connection = NoCommitConnection(raw_connection)
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for i in range(warmup + iterations):
+        call_started = time.perf_counter()
+        try:
+            result = case.run(connection, sample)
+            if hasattr(result, "__next__"):
+                for _ in result:
+                    pass
+            failed = False
+        except Exception:
+            failed = True
+        finally:
+            raw_connection.rollback()
+        if i < warmup:
+            started = time.perf_counter()
+            continue
+        if failed:
+            errors += 1
+        else:
+            latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark every Manager method against a synthetic database")
+    add_arguments(parser)
+    parser.add_argument("--seed", action="store_true", help="(Re)load synthetic data before running")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--only", help="Run only cases whose name contains this text")
+    parser.add_argument("--output", help="Save results as JSON")
+    args = parser.parse_args()
+
+    conn = connect_and_migrate(args.dsn)
+    try:
+        if args.seed or table_counts(conn)["orders"] == 0:
+            seed_from_args(conn, args)
+        sample = sample_ids(conn)
+        results = {
+            case.name: run_case(conn, case, sample, args.iterations, args.warmup)
+            for case in CASES
+            if not args.only or args.only in case.name
+        }
+    finally:
+        conn.close()
+
+    print_table("Manager methods", results)
+    if args.output:
+        save_results(args.output, "managers", {"managers": results}, dict(vars(args), dsn=None))
+
+
+if __name__ == "__main__":
+    main()
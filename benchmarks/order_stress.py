@@ -0,0 +1,198 @@
+# Prueba de estrés de la máquina de estados de pedidos: muchos hilos avanzan, editan, reintentan con Idempotency-Key
+# y cancelan el mismo puñado de pedidos a la vez, llamando a OrderManager directamente (cada hilo con su conexión).
+# Al final verifica que ningún pedido avanzó dos veces desde el mismo estado, que cada llave de idempotencia produjo
+# una sola línea y que los totales guardados cuadran con sus líneas. Sale con 1 si algo no se cumple.
+#
+#   python -m benchmarks.order_stress --dsn postgres://localhost/restaurant_bench --workers 32 --hot-orders 10
+import argparse
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from fastapi import HTTPException
+from psycopg2 import connect
+from orders import OrderManager, OrderLine, ORDER_STATUS, MISMATCHED_ORDER_TOTALS
+from idempotency import call_once
+from benchmarks.datagen import add_arguments, connect_and_migrate, seed_from_args, table_counts
+from benchmarks.results import summarize, print_table
+
+ACTION_WEIGHTS = {
+    "advance": 25,
+    "add_items": 30,
+    "remove_item": 20,
+    "idempotent_add": 20,
+    "delete": 5,
+}
+
+
+class StressRun:
+    def __init__(self, order_ids, customers: int, menu_items: int, keys_per_order: int, random_seed: int):
+        # Cada posición es un pedido "caliente"; cuando se entrega o se cancela, el primer hilo que lo nota lo reemplaza
+        self.slots = list(order_ids)
+        self.order_ids = list(order_ids)
+        self.customers = customers
+        self.menu_items = menu_items
+        self.keys_per_order = keys_per_order
+        self.random_seed = random_seed
+        self.run_id = uuid.uuid4().hex[:8]
+        self.lock = threading.Lock()
+        self.added_lines = defaultdict(list)
+        self.advances = defaultdict(int)
+        self.key_results = defaultdict(set)
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+
+    def record(self, action: str, outcome: str, elapsed: float):
+        with self.lock:
+            self.latencies[action].append(elapsed)
+            self.outcomes[action][outcome] += 1
+
+    def worker(self, dsn: str, worker_id: int, deadline: float):
+        rng = random.Random(self.random_seed + worker_id)
+        actions = list(ACTION_WEIGHTS)
+        weights = [ACTION_WEIGHTS[action] for action in actions]
+        conn = connect(dsn)
+        try:
+            while time.perf_counter() < deadline:
+                action = rng.choices(actions, weights)[0]
+                slot = rng.randrange(len(self.slots))
+                order_id = self.slots[slot]
+                if order_id is None:
+                    continue
+                started = time.perf_counter()
+                try:
+                    outcome = getattr(self, action)(conn, rng, order_id)
+                except HTTPException as e:
+                    outcome = str(e.status_code)
+                    conn.rollback()
+                self.record(action, outcome, time.perf_counter() - started)
+                if outcome in ("gone", "delivered", "400", "404") and action != "remove_item":
+                    self.replace(conn, slot, order_id)
+        finally:
+            conn.close()
+
+    def replace(self, conn, slot: int, order_id: int):
+        with self.lock:
+            if self.slots[slot] != order_id:
+                return
+            self.slots[slot] = None
+        new_order_id = create_orders(conn, 1, self.customers)[0]
+        with self.lock:
+            self.slots[slot] = new_order_id
+            self.order_ids.append(new_order_id)
+
+    def advance(self, conn, rng, order_id):
+        # Como una terminal de cocina: avanza desde el estado que acaba de leer
+        with conn.cursor() as cursor:
+            ORDER_STATUS.execute(cursor, (order_id,))
+            row = cursor.fetchone()
+        conn.rollback()
+        if not row:
+            return "gone"
+        result = OrderManager.change_order_status(conn, order_id, row[0])
+        if result["result"]["message"] != "Order status changed successfully":
+            return "delivered"
+        with self.lock:
+            self.advances[(order_id, row[0])] += 1
+        return "ok"
+
+    def add_items(self, conn, rng, order_id):
+        result = OrderManager.add_items_to_order(conn, order_id, rng.randint(1, self.menu_items), rng.randint(1, 3))
+        with self.lock:
+            self.added_lines[order_id].append(result["result"]["detail_id"])
+        return "ok"
+
+    def remove_item(self, conn, rng, order_id):
+        with self.lock:
+            lines = self.added_lines[order_id]
+            detail_id = rng.choice(lines) if lines else None
+        if detail_id is None:
+            return "empty"
+        OrderManager.remove_item_from_order(conn, order_id, detail_id)
+        return "ok"
+
+    def idempotent_add(self, conn, rng, order_id):
+        # Pocas llaves por pedido, así que varios hilos mandan la misma petición a la vez
+        key = f"stress-{self.run_id}-{order_id}-{rng.randrange(self.keys_per_order)}"
+        result = call_once(conn, key, OrderManager.add_items_to_order, order_id, 1, 1)
+        with self.lock:
+            self.key_results[key].add(result["result"]["detail_id"])
+        return "ok"
+
+    def delete(self, conn, rng, order_id):
+        OrderManager.delete_order(conn, order_id)
+        return "ok"
+
+    def violations(self, conn):
+        problems = [f"order {order_id} advanced {count} times from {status}" for (order_id, status), count in self.advances.items() if count > 1]
+        problems.extend(f"key {key} produced lines {sorted(ids)}" for key, ids in self.key_results.items() if len(ids) > 1)
+        problems.extend(f"{action} returned {outcome} {count} times" for action, counts in self.outcomes.items() for outcome, count in counts.items() if outcome == "500")
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT * FROM ({MISMATCHED_ORDER_TOTALS}) AS mismatched WHERE order_id = ANY(%s)", (self.order_ids,))
+            problems.extend(f"order {order_id} stores total {stored} but its lines add up to {computed}" for order_id, stored, computed in cursor.fetchall())
+        conn.rollback()
+        return problems
+
+
+def create_orders(conn, count: int, customers: int):
+    return [
+        OrderManager.create_order_with_items(conn, random.randint(1, customers), [OrderLine(item_id=1, quantity=1)])["result"]["order_id"]
+        for _ in range(count)
+    ]
+
+
+def cleanup(conn, run: StressRun):
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM orders WHERE order_id = ANY(%s)", (run.order_ids,))
+        cursor.execute("DELETE FROM idempotency_keys WHERE key LIKE %s", (f"stress-{run.run_id}-%",))
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent stress test for order status transitions and line edits")
+    add_arguments(parser)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--hot-orders", type=int, default=10, help="Orders every worker fights over")
+    parser.add_argument("--keys-per-order", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="Keep the stress orders instead of deleting them")
+    args = parser.parse_args()
+
+    conn = connect_and_migrate(args.dsn)
+    try:
+        counts = table_counts(conn)
+        if counts["orders"] == 0:
+            seed_from_args(conn, args)
+            counts = table_counts(conn)
+        run = StressRun(create_orders(conn, args.hot_orders, counts["client"]), counts["client"], counts["menu"], args.keys_per_order, args.random_seed)
+
+        deadline = time.perf_counter() + args.duration
+        threads = [threading.Thread(target=run.worker, args=(args.dsn, n, deadline)) for n in range(args.workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        problems = run.violations(conn)
+        if not args.keep:
+            cleanup(conn, run)
+    finally:
+        conn.close()
+
+    rows = {action: summarize(latencies, run.outcomes[action].get("500", 0), elapsed) for action, latencies in run.latencies.items()}
+    print_table(f"{args.workers} workers on {args.hot_orders} orders for {elapsed:.1f}s", rows)
+    for action, counts in sorted(run.outcomes.items()):
+        print(f"{action:<16}" + "  ".join(f"{outcome}={count}" for outcome, count in sorted(counts.items())))
+    for problem in problems:
+        print(f"FAIL {problem}")
+    print("no invariant violations" if not problems else f"{len(problems)} invariant violations")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# Capa de datos (prepared.py + queries.py) contra el camino anterior de los managers: SQL sin preparar en cada llamada
+# y filas como dict (RealDictCursor). Mide la latencia por consulta de las lecturas puntuales y la memoria por fila
+# que retienen las páginas de lista (tracemalloc), con dos conexiones psycopg2 como las del modo sync.
+#
+#   python -m benchmarks.queries --dsn postgres://localhost/restaurant_bench --iterations 500 --rows 10000
+import argparse
+import time
+import tracemalloc
+from psycopg2 import connect, extensions
+from psycopg2.extras import RealDictCursor
+from prepared import prepare_connection
+from pagination import keyset_query
+from queries import records
+from menu import MENU_ITEM
+from client import CLIENT_BY_ID, CLIENT_BY_CLERK, CLIENT_COLUMNS, ClientRecord
+from orders import ORDER_ITEMS, ORDER_STATUS, CUSTOMER_ORDERS, ORDER_INFO_COLUMNS, OrderInfoRecord
+from benchmarks.datagen import add_arguments, connect_and_migrate, seed_from_args, table_counts
+from benchmarks.query_plans import sample_ids
+from benchmarks.results import summarize, save_results, print_table
+
+# (nombre, consulta preparada, parámetros a partir de sample_ids)
+LOOKUPS = [
+    ("menu_item", MENU_ITEM, lambda s: (s["menu_id"],)),
+    ("client_by_id", CLIENT_BY_ID, lambda s: (s["customer_id"],)),
+    ("client_by_clerk", CLIENT_BY_CLERK, lambda s: (s["clerkid"],)),
+    ("order_items", ORDER_ITEMS, lambda s: (s["order_id"],)),
+    ("order_status", ORDER_STATUS, lambda s: (s["order_id"],)),
+    ("customer_orders", CUSTOMER_ORDERS, lambda s: (s["customer_id"], None, None)),
+]
+
+# (nombre, SELECT, llave, registro)
+PAGES = [
+    ("orders page", f"SELECT {ORDER_INFO_COLUMNS} FROM orders", "order_id", OrderInfoRecord),
+    ("clients page", f"SELECT {CLIENT_COLUMNS} FROM client", "id", ClientRecord),
+]
+
+
+class BenchConnection(extensions.connection):
+    prepared = False
+
+
+def dict_lookup(conn, query, params):
+    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute(query.sql, params)
+        return cursor.fetchall()
+
+
+def record_lookup(conn, query, params):
+    with conn.cursor() as cursor:
+        return query.fetch_all(cursor, params)
+
+
+def dict_page(conn, select: str, key: str, record, rows: int):
+    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute(*keyset_query(select, key, rows))
+        return cursor.fetchall()
+
+
+def record_page(conn, select: str, key: str, record, rows: int):
+    with conn.cursor() as cursor:
+        cursor.execute(*keyset_query(select, key, rows))
+        return records(cursor.fetchall(), record)
+
+
+def time_lookup(conn, fetch, query, params, iterations: int, warmup: int):
+    for _ in range(warmup):
+        fetch(conn, query, params)
+        conn.rollback()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        fetch(conn, query, params)
+        latencies.append(time.perf_counter() - call_started)
+        conn.rollback()
+    return summarize(latencies, 0, time.perf_counter() - started)
+
+
+def bytes_per_row(conn, fetch, select: str, key: str, record, rows: int):
+    # Solo cuenta lo que sigue vivo al terminar: las tuplas intermedias de records() ya se liberaron
+    fetch(conn, select, key, record, rows)
+    conn.rollback()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        fetched = fetch(conn, select, key, record, rows)
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+        conn.rollback()
+    return {"rows": len(fetched), "bytes_per_row": retained / max(len(fetched), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare prepared queries and slotted records with plain SQL and dict rows")
+    add_arguments(parser)
+    parser.add_argument("--seed", action="store_true", help="(Re)load synthetic data before running")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=10000, help="Page size for the memory measurement")
+    parser.add_argument("--output", help="Save results as JSON")
+    args = parser.parse_args()
+
+    setup = connect_and_migrate(args.dsn)
+    try:
+        if args.seed or table_counts(setup)["orders"] == 0:
+            seed_from_args(setup, args)
+        sample = sample_ids(setup)
+    finally:
+        setup.close()
+
+    plain = connect(args.dsn, connection_factory=BenchConnection)
+    typed = connect(args.dsn, connection_factory=BenchConnection)
+    prepare_connection(typed)
+    if not typed.prepared:
+        raise SystemExit("Could not prepare the statements (is DB_PREPARE_STATEMENTS=0?)")
+    try:
+        latency = {}
+        for name, query, params in LOOKUPS:
+            latency[f"{name} / dict rows"] = time_lookup(plain, dict_lookup, query, params(sample), args.iterations, args.warmup)
+            latency[f"{name} / prepared records"] = time_lookup(typed, record_lookup, query, params(sample), args.iterations, args.warmup)
+        memory = {
+            name: {
+                "dict_rows": bytes_per_row(plain, dict_page, select, key, record, args.rows),
+                "records": bytes_per_row(typed, record_page, select, key, record, args.rows),
+            }
+            for name, select, key, record in PAGES
+        }
+    finally:
+        plain.close()
+        typed.close()
+
+    print_table("Per-query latency", latency)
+    print(f"  {'page':<24}{'rows':>8}{'dict bytes/row':>16}{'record bytes/row':>18}")
+    for name, r in memory.items():
+        print(f"  {name:<24}{r['records']['rows']:>8}{r['dict_rows']['bytes_per_row']:>16.0f}{r['records']['bytes_per_row']:>18.0f}")
+    if args.output:
+        save_results(args.output, "queries", {"latency": latency, "memory": memory}, dict(vars(args), dsn=None))
+
+
+if __name__ == "__main__":
+    main()
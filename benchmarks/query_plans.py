@@ -0,0 +1,235 @@
+# Regresión de planes de consulta: ejecuta los métodos de los managers sobre una base sintética grande, captura el
+# EXPLAIN de cada sentencia que mandan y falla si alguna hace Seq Scan sobre una tabla grande o pasa su presupuesto
+# de costo. Todo corre dentro de una transacción que se deshace al final de cada caso.
+#
+#   python -m benchmarks.query_plans --dsn postgres://localhost/restaurant_bench --seed
+import argparse
+import json
+import sys
+from psycopg2.extras import RealDictCursor
+from menu import MenuManager
+from orders import OrderManager, OrderLine
+from client import ClientManager
+from analytics import AnalyticsManager
+from archive import ArchiveManager
+from benchmarks.datagen import add_arguments, connect_and_migrate, seed_from_args, table_counts
+
+# Tablas con menos filas que esto pueden recorrerse completas sin que cuente como regresión
+MIN_ROWS_FOR_SEQ_SCAN = 10000
+DEFAULT_MAX_COST = 5000.0
+
+
+class _PlanCapturingCursor:
+    def __init__(self, connection, cursor):
+        self._connection = connection
+        self._cursor = cursor
+
+    def execute(self, query, params=None):
+        with self._connection.raw.cursor() as explain_cursor:
+            explain_cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            plan = explain_cursor.fetchone()[0]
+        self._connection.plans.append((" ".join(query.split()), plan[0]["Plan"]))
+        return self._cursor.execute(query, params)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class PlanCapturingConnection:
+    # Se hace pasar por la conexión de psycopg2 que reciben los managers; commit() no hace nada para poder deshacer todo
+    def __init__(self, raw):
+        self.raw = raw
+        self.plans = []
+
+    def cursor(self, *args, **kwargs):
+        return _PlanCapturingCursor(self, self.raw.cursor(*args, **kwargs))
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.raw.rollback()
+
+
+class PlanCase:
+    def __init__(self, name: str, run, max_cost: float = DEFAULT_MAX_COST, allow_seq_scan=()):
+        self.name = name
+        self.run = run
+        self.max_cost = max_cost
+        self.allow_seq_scan = set(allow_seq_scan)
+
+
+def _consume(rows):
+    for _ in rows:
+        pass
+
+
+CASES = [
+    PlanCase("MenuManager.get_menu_item", lambda c, s: MenuManager.get_menu_item(c, s["menu_id"])),
+    # Re-cotiza todas las líneas abiertas del producto, así que su costo crece con la popularidad del producto
+    PlanCase(
+        "MenuManager.update_menu_item",
+        lambda c, s: MenuManager.update_menu_item(c, s["menu_id"], "Renamed", 9.99),
+        max_cost=20000.0,
+    ),
+    PlanCase("OrderManager.get_all_order_info(page)", lambda c, s: OrderManager.get_all_order_info(c, 100, s["order_id"])),
+    PlanCase("OrderManager.get_order_details", lambda c, s: OrderManager.get_order_details(c, s["order_id"])),
+    PlanCase("OrderManager.read_order_total_price", lambda c, s: OrderManager.read_order_total_price(c, s["order_id"])),
+    PlanCase("OrderManager.get_orders_by_customer_id", lambda c, s: OrderManager.get_orders_by_customer_id(c, s["customer_id"])),
+    PlanCase(
+        "OrderManager.get_orders_by_customer_id(page)",
+        lambda c, s: OrderManager.get_orders_by_customer_id(c, s["customer_id"], 20, s["order_id"]),
+    ),
+    PlanCase(
+        "OrderManager.get_orders_with_details(ids)",
+        lambda c, s: OrderManager.get_orders_with_details(c, s["order_ids"], None, None, 100),
+    ),
+    PlanCase(
+        "OrderManager.get_orders_with_details(customer)",
+        lambda c, s: OrderManager.get_orders_with_details(c, None, None, s["customer_id"], 100),
+    ),
+    PlanCase(
+        "OrderManager.get_orders_with_details(status)",
+        lambda c, s: OrderManager.get_orders_with_details(c, None, "En cola", None, 100),
+        max_cost=20000.0,
+    ),
+    PlanCase("OrderManager.add_order", lambda c, s: OrderManager.add_order(c, s["customer_id"])),
+    PlanCase(
+        "OrderManager.create_order_with_items",
+        lambda c, s: OrderManager.create_order_with_items(c, s["customer_id"], [OrderLine(item_id=s["menu_id"], quantity=2)]),
+    ),
+    PlanCase("OrderManager.add_items_to_order", lambda c, s: OrderManager.add_items_to_order(c, s["open_order_id"], s["menu_id"], 1)),
+    PlanCase("OrderManager.remove_item_from_order", lambda c, s: OrderManager.remove_item_from_order(c, s["order_id"], s["detail_id"])),
+    PlanCase("OrderManager.change_order_status", lambda c, s: OrderManager.change_order_status(c, s["open_order_id"])),
+    PlanCase("OrderManager.delete_order", lambda c, s: OrderManager.delete_order(c, s["open_order_id"])),
+    PlanCase("ClientManager.get_all_clients(page)", lambda c, s: ClientManager.get_all_clients(c, 100, s["customer_id"])),
+    PlanCase("ClientManager.get_client_details", lambda c, s: ClientManager.get_client_details(c, s["customer_id"])),
+    PlanCase("ClientManager.get_client_details_by_clerk_id", lambda c, s: ClientManager.get_client_details_by_clerk_id(c, s["clerkid"])),
+    PlanCase(
+        "ClientManager.edit_client",
+        lambda c, s: ClientManager.edit_client(c, s["customer_id"], "Renamed", "Somewhere", "5550000000"),
+    ),
+    # Los rollups tienen una fila por día (o por día y producto), no por pedido
+    PlanCase("AnalyticsManager.get_revenue_by_period", lambda c, s: AnalyticsManager.get_revenue_by_period(c, "month")),
+    PlanCase("AnalyticsManager.get_top_items", lambda c, s: AnalyticsManager.get_top_items(c, "revenue", None, None, 10)),
+    PlanCase("AnalyticsManager.get_customer_lifetime_value", lambda c, s: AnalyticsManager.get_customer_lifetime_value(c, s["customer_id"])),
+    # Su costo crece con ANALYTICS_REFRESH_BATCH: suma hasta ese número de pedidos con sus líneas
+    PlanCase("AnalyticsManager.refresh_rollups", lambda c, s: AnalyticsManager.refresh_rollups(c), max_cost=50000.0),
+    # Toma los candidatos del índice parcial de entregados por delivered_at, no recorre orders
+    PlanCase("ArchiveManager.archive_orders", lambda c, s: ArchiveManager.archive_orders(c, 1000), max_cost=50000.0),
+]
+
+
+def sample_ids(db_connection):
+    with db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute(
+            """
+            SELECT orders.order_id, orders.customer_id, orderdetails.detail_id, orderdetails.item_id AS menu_id, client.clerkid
+            FROM orders
+            JOIN orderdetails ON orderdetails.order_id = orders.order_id
+            JOIN client ON client.id = orders.customer_id
+            WHERE orders.order_id >= (SELECT max(order_id) / 2 FROM orders) AND orders.order_status = 'En cola'
+            ORDER BY orders.order_id
+            LIMIT 1
+            """
+        )
+        sample = dict(cursor.fetchone())
+        cursor.execute("SELECT order_id FROM orders WHERE order_status = 'En cola' ORDER BY order_id DESC LIMIT 1")
+        sample["open_order_id"] = cursor.fetchone()["order_id"]
+        sample["order_ids"] = list(range(sample["order_id"], sample["order_id"] + 50))
+    db_connection.rollback()
+    return sample
+
+
+def large_tables(db_connection, min_rows: int):
+    with db_connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relname FROM pg_class WHERE relkind = 'r' AND relname = ANY(%s) AND reltuples >= %s",
+            (["menu", "client", "orders", "orderdetails", "orders_archive", "orderdetails_archive"], min_rows),
+        )
+        tables = {row[0] for row in cursor.fetchall()}
+    db_connection.rollback()
+    return tables
+
+
+def _walk(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _walk(child)
+
+
+def check_plan(case: PlanCase, query: str, plan: dict, large: set, max_cost: float):
+    problems = []
+    budget = case.max_cost if max_cost is None else max_cost
+    if plan["Total Cost"] > budget:
+        problems.append(f"cost {plan['Total Cost']:.0f} > budget {budget:.0f}")
+    for node in _walk(plan):
+        relation = node.get("Relation Name")
+        if node["Node Type"] == "Seq Scan" and relation in large and relation not in case.allow_seq_scan:
+            problems.append(f"Seq Scan on {relation}")
+    return problems
+
+
+def run_case(raw_connection, case: PlanCase, sample: dict, large: set, max_cost: float = None):
+    connection = PlanCapturingConnection(raw_connection)
+    problems = []
+    try:
+        result = case.run(connection, sample)
+        if hasattr(result, "__next__"):
+            _consume(result)
+    except Exception as e:
+        problems.append(f"raised {type(e).__name__}: {getattr(e, 'detail', e)}")
+    finally:
+        raw_connection.rollback()
+
+    statements = []
+    for query, plan in connection.plans:
+        statement_problems = check_plan(case, query, plan, large, max_cost)
+        statements.append({"query": query, "total_cost": plan["Total Cost"], "problems": statement_problems})
+        problems.extend(f"{p} in: {query[:120]}" for p in statement_problems)
+    return {"case": case.name, "ok": not problems, "problems": problems, "statements": statements}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail when a manager query plan regresses to a sequential scan or exceeds its cost budget")
+    add_arguments(parser)
+    parser.add_argument("--seed", action="store_true", help="(Re)load synthetic data before checking")
+    parser.add_argument("--min-rows", type=int, default=MIN_ROWS_FOR_SEQ_SCAN)
+    parser.add_argument("--max-cost", type=float, default=None, help="Override every case's cost budget")
+    parser.add_argument("--json", help="Write the full report to this file")
+    args = parser.parse_args()
+
+    conn = connect_and_migrate(args.dsn)
+    try:
+        if args.seed or table_counts(conn)["orders"] == 0:
+            seed_from_args(conn, args)
+        sample = sample_ids(conn)
+        large = large_tables(conn, args.min_rows)
+        results = [run_case(conn, case, sample, large, args.max_cost) for case in CASES]
+    finally:
+        conn.close()
+
+    for result in results:
+        print(f"{'ok  ' if result['ok'] else 'FAIL'} {result['case']}")
+        for problem in result["problems"]:
+            print(f"       {problem}")
+    if args.json:
+        with open(args.json, "w") as report:
+            json.dump(results, report, indent=2)
+
+    failed = [r for r in results if not r["ok"]]
+    print(f"{len(results) - len(failed)}/{len(results)} query plans within budget")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Resúmenes de latencia y resultados en JSON para comparar corridas
+#
+#   python -m benchmarks.results baseline.json candidate.json --threshold 10
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed": elapsed,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": (latencies[-1] * 1000) if latencies else 0.0,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def save_results(path, kind: str, results: dict, params: dict):
+    document = {
+        "kind": kind,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git_commit(),
+        "params": params,
+        "results": results,
+    }
+    with open(path, "w") as output:
+        json.dump(document, output, indent=2)
+
+
+def print_table(title: str, rows: dict):
+    print(title)
+    print(f"  {'name':<48}{'count':>8}{'errors':>8}{'per s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, r in rows.items():
+        print(
+            f"  {name:<48}{r['requests']:>8}{r['errors']:>8}{r['rps']:>10.1f}"
+            f"{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+        )
+
+
+def _flatten(results: dict, prefix=""):
+    # Aplana {"sync": {"routes": {...}}} a {"sync / GET /menu/all_info": resumen}
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and "p95_ms" in value:
+            flat[name] = value
+        elif isinstance(value, dict):
+            flat.update(_flatten(value, name + " / "))
+    return flat
+
+
+def compare(baseline: dict, candidate: dict, threshold: float):
+    old = _flatten(baseline["results"])
+    new = _flatten(candidate["results"])
+    regressions = []
+    print(f"  {'name':<60}{'p95 before':>12}{'p95 after':>12}{'change':>10}")
+    for name in sorted(old.keys() & new.keys()):
+        before, after = old[name]["p95_ms"], new[name]["p95_ms"]
+        change = ((after - before) / before * 100) if before else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"  {name:<60}{before:>12.2f}{after:>12.2f}{change:>9.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files and fail on p95 regressions")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Allowed p95 slowdown in percent")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    regressions = compare(baseline, candidate, args.threshold)
+    print(f"{len(regressions)} regression(s) above {args.threshold}%")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
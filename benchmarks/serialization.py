@@ -0,0 +1,134 @@
+# CPU por fila al serializar las respuestas de lista: el camino de response_model (FastAPI valida cada fila contra el
+# modelo, la vuelve a convertir a tipos JSON y la pasa por json.dumps) contra json_response (orjson directo sobre las
+# filas del cursor). Las filas se leen una sola vez; solo se mide la serialización, con time.process_time. También
+# compara los registros de queries.py con los mismos dataclasses con slots=True: CPU de orjson y bytes por instancia.
+#
+#   python -m benchmarks.serialization --dsn postgres://localhost/restaurant_bench --rows 1000 --iterations 50
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from dataclasses import fields, make_dataclass
+from typing import List
+from pydantic import TypeAdapter
+from menu import MenuManager, MenuItem
+from orders import OrderManager, OrderInfo, OrderWithDetails
+from client import ClientManager, ClientItem
+from pagination import json_response
+from benchmarks.datagen import add_arguments, connect_and_migrate, seed_from_args, table_counts
+from benchmarks.results import save_results
+
+# (ruta, modelo de la ruta, lectura de las filas con el manager síncrono)
+CASES = [
+    ("GET /menu/all_info?limit=", List[MenuItem], lambda c, n: MenuManager.get_all_menu_info(c, n)),
+    ("GET /orders/all_info?limit=", List[OrderInfo], lambda c, n: OrderManager.get_all_order_info(c, n)),
+    ("GET /clients/all_info?limit=", List[ClientItem], lambda c, n: ClientManager.get_all_clients(c, n)),
+    ("GET /orders/batch?limit=", List[OrderWithDetails], lambda c, n: OrderManager.get_orders_with_details(c, None, None, None, n)),
+]
+
+
+def response_model_path(adapter: TypeAdapter):
+    # Lo que hace FastAPI con response_model: validar (los registros por atributos), volver a tipos JSON y
+    # JSONResponse.render
+    def encode(rows):
+        content = adapter.dump_python(adapter.validate_python(rows, from_attributes=True), mode="json")
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+    return encode
+
+
+def fast_path(rows):
+    return json_response(rows).body
+
+
+def slotted_copy(rows):
+    # Los mismos valores en un dataclass idéntico pero con slots=True
+    record = type(rows[0])
+    names = [field.name for field in fields(record)]
+    slotted = make_dataclass(record.__name__, [(field.name, field.type) for field in fields(record)], slots=True)
+    return lambda: [slotted(*(getattr(row, name) for name in names)) for row in rows]
+
+
+def plain_copy(rows):
+    record = type(rows[0])
+    names = [field.name for field in fields(record)]
+    return lambda: [record(*(getattr(row, name) for name in names)) for row in rows]
+
+
+def bytes_per_row(build):
+    # Solo las instancias: los valores son los mismos objetos en ambas copias
+    tracemalloc.start()
+    copies = build()
+    size = tracemalloc.get_traced_memory()[0] - sys.getsizeof(copies)
+    tracemalloc.stop()
+    return size / max(len(copies), 1)
+
+
+def cpu_per_row(encode, rows, iterations: int):
+    encode(rows)
+    started = time.process_time()
+    for _ in range(iterations):
+        encode(rows)
+    return (time.process_time() - started) / (iterations * max(len(rows), 1))
+
+
+def run_case(conn, name: str, model, fetch, rows: int, iterations: int):
+    fetched = fetch(conn, rows)
+    conn.rollback()
+    adapter = TypeAdapter(model)
+    before = response_model_path(adapter)(fetched)
+    after = fast_path(fetched)
+    if json.loads(before) != json.loads(after):
+        raise SystemExit(f"{name}: json_response output differs from the response_model output")
+    response_model_us = cpu_per_row(response_model_path(adapter), fetched, iterations) * 1e6
+    json_response_us = cpu_per_row(fast_path, fetched, iterations) * 1e6
+    slotted = slotted_copy(fetched)
+    return {
+        "rows": len(fetched),
+        "response_model_us_per_row": response_model_us,
+        "json_response_us_per_row": json_response_us,
+        "speedup": response_model_us / json_response_us if json_response_us else 0.0,
+        "slots_json_response_us_per_row": cpu_per_row(fast_path, slotted(), iterations) * 1e6,
+        "record_bytes": bytes_per_row(plain_copy(fetched)),
+        "slots_record_bytes": bytes_per_row(slotted),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare CPU per row of response_model serialization and json_response")
+    add_arguments(parser)
+    parser.add_argument("--seed", action="store_true", help="(Re)load synthetic data before running")
+    parser.add_argument("--rows", type=int, default=1000, help="Page size of each list")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--output", help="Save results as JSON")
+    args = parser.parse_args()
+
+    conn = connect_and_migrate(args.dsn)
+    try:
+        if args.seed or table_counts(conn)["orders"] == 0:
+            seed_from_args(conn, args)
+        results = {
+            name + str(args.rows): run_case(conn, name, model, fetch, args.rows, args.iterations)
+            for name, model, fetch in CASES
+        }
+    finally:
+        conn.close()
+
+    print(f"  {'route':<36}{'rows':>8}{'response_model us/row':>24}{'json_response us/row':>24}{'speedup':>10}")
+    for name, r in results.items():
+        print(
+            f"  {name:<36}{r['rows']:>8}{r['response_model_us_per_row']:>24.2f}"
+            f"{r['json_response_us_per_row']:>24.2f}{r['speedup']:>9.1f}x"
+        )
+    print(f"\n  {'route':<36}{'record us/row':>16}{'slots us/row':>16}{'record bytes':>16}{'slots bytes':>16}")
+    for name, r in results.items():
+        print(
+            f"  {name:<36}{r['json_response_us_per_row']:>16.2f}{r['slots_json_response_us_per_row']:>16.2f}"
+            f"{r['record_bytes']:>16.0f}{r['slots_record_bytes']:>16.0f}"
+        )
+    if args.output:
+        save_results(args.output, "serialization", {"serialization": results}, dict(vars(args), dsn=None))
+
+
+if __name__ == "__main__":
+    main()
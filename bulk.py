@@ -0,0 +1,651 @@
+# Importación y exportación masiva con COPY. El archivo (CSV con encabezado o NDJSON) se lee como stream y se valida
+# por lotes de BULK_BATCH_SIZE filas: las que no pasan el modelo se reportan con su número de línea y las demás van por
+# COPY a una tabla temporal. Al final, en una sola transacción, se revisa contra la base (ids o clerkid repetidos,
+# clientes o productos inexistentes), se marcan las filas rechazadas y el resto se inserta con un INSERT ... SELECT.
+# Un pedido se importa completo o no se importa: si una de sus líneas falla se rechazan todas. Por HTTP el cuerpo se
+# guarda antes en un archivo temporal, así que la conexión y su transacción no esperan a que termine de subir.
+#
+#   python bulk.py import menu menu.csv
+#   python bulk.py import orders orders.ndjson --format ndjson --dry-run
+#   python bulk.py export clients --format csv --output clients.csv
+import argparse
+import asyncio
+import csv
+import inspect
+import io
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime
+from typing import List, Optional
+import anyio
+from anyio import from_thread, to_thread
+from psycopg2 import connect
+from fastapi import HTTPException
+from pydantic import AliasChoices, BaseModel, Field, ValidationError, field_validator, model_validator
+from cache import menu_cache, client_cache, MENU_CHANNEL, CLIENT_CHANNEL
+from database import DATABASE_URL
+from feed import ORDER_CHANNEL
+from orders import ORDER_STATUSES, DELIVERED_STATUS
+from queries import db_errors, stream_errors
+
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", "5000"))
+# Cuántos errores por fila se devuelven en el reporte (se cuentan todos)
+BULK_MAX_ERRORS = int(os.environ.get("BULK_MAX_ERRORS", "1000"))
+# Tamaño de los bloques que se mandan al cliente al exportar
+BULK_EXPORT_CHUNK = int(os.environ.get("BULK_EXPORT_CHUNK", str(64 * 1024)))
+# Cuánto del cuerpo de una importación se junta en memoria antes de escribirlo al archivo temporal
+BULK_SPOOL_CHUNK = int(os.environ.get("BULK_SPOOL_CHUNK", str(1024 * 1024)))
+
+FORMATS = ("csv", "ndjson")
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+class MenuRow(BaseModel):
+    menu_id: Optional[int] = Field(None, gt=0)
+    name: str = Field(min_length=1)
+    price: float = Field(ge=0)
+
+class ClientRow(BaseModel):
+    id: Optional[int] = Field(None, gt=0)
+    name: str = Field(min_length=1)
+    address: Optional[str] = None
+    phone_number: Optional[str] = None
+    clerkid: Optional[str] = None
+
+class OrderRow(BaseModel):
+    # Una fila por línea del pedido; order_ref agrupa las líneas (la exportación lo escribe como order_id)
+    order_ref: str = Field(min_length=1, validation_alias=AliasChoices("order_ref", "order_id"))
+    customer_id: int
+    order_status: str = "En cola"
+    delivered_at: Optional[datetime] = None
+    item_id: Optional[int] = None
+    quantity: Optional[int] = Field(None, gt=0)
+    unit_price: Optional[float] = Field(None, ge=0)
+
+    @field_validator("order_ref", mode="before")
+    @classmethod
+    def _ref_as_text(cls, value):
+        return str(value) if isinstance(value, int) else value
+
+    @field_validator("order_status")
+    @classmethod
+    def _known_status(cls, value):
+        if value not in ORDER_STATUSES:
+            raise ValueError(f"unknown order status {value}")
+        return value
+
+    @model_validator(mode="after")
+    def _item_and_quantity(self):
+        if (self.item_id is None) != (self.quantity is None):
+            raise ValueError("item_id and quantity go together")
+        return self
+
+class RowError(BaseModel):
+    line: int
+    error: str
+
+class ImportReport(BaseModel):
+    table: str
+    rows: int
+    imported: int
+    rejected: int
+    committed: bool
+    errors: List[RowError]
+
+
+class BulkTable:
+    # checks: (mensaje, SELECT que devuelve line y el valor culpable) que se corren contra import_rows
+    # key_locks: SELECT ... FOR KEY SHARE sobre las filas referenciadas, para que no se borren entre la revisión y el INSERT
+    # quiet_setting: variable que los triggers del canal respetan para no publicar fila por fila; al confirmar se manda
+    # solo payload por channel
+    def __init__(
+        self, name: str, model, columns, checks, inserts, export_query: str,
+        lock: str = None, group_column: str = None, channel: str = None, cache=None, key_locks=(),
+        payload: str = "", quiet_setting: str = None,
+    ):
+        self.name = name
+        self.model = model
+        self.columns = columns
+        self.checks = checks
+        self.inserts = inserts
+        self.export_query = export_query
+        self.lock = lock
+        self.group_column = group_column
+        self.channel = channel
+        self.cache = cache
+        self.key_locks = key_locks
+        self.payload = payload
+        self.quiet_setting = quiet_setting
+
+    @property
+    def create_staging(self):
+        columns = ", ".join(f"{name} {kind}" for name, kind in self.columns)
+        return f"CREATE TEMP TABLE import_rows (line INTEGER PRIMARY KEY, rejected BOOLEAN NOT NULL DEFAULT false, {columns}) ON COMMIT DROP"
+
+    @property
+    def copy_in(self):
+        return f"COPY import_rows (line, {', '.join(name for name, _ in self.columns)}) FROM STDIN"
+
+    def copy_out(self, fmt: str):
+        if fmt == "csv":
+            return f"COPY ({self.export_query}) TO STDOUT WITH (FORMAT csv, HEADER)"
+        # row_to_json ya escapa comillas y saltos de línea; con comillas y delimitador que nunca aparecen en JSON el
+        # modo CSV deja cada objeto tal cual, una línea por fila
+        return f"COPY (SELECT row_to_json(export) FROM ({self.export_query}) AS export) TO STDOUT WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')"
+
+
+def _duplicates(column: str):
+    return f"""
+        SELECT line, {column} FROM (
+            SELECT line, {column}, row_number() OVER (PARTITION BY {column} ORDER BY line) AS position
+            FROM import_rows WHERE {column} IS NOT NULL
+        ) AS numbered
+        WHERE position > 1
+    """
+
+def _existing(table: str, column: str, key: str):
+    return f"SELECT line, {column} FROM import_rows WHERE EXISTS (SELECT 1 FROM {table} WHERE {table}.{key} = import_rows.{column})"
+
+def _key_share(table: str, key: str, column: str):
+    # Siempre en orden de llave, para que dos importaciones con filas en común no se bloqueen en cruz
+    return f"SELECT 1 FROM {table} WHERE {key} IN (SELECT {column} FROM import_rows) ORDER BY {key} FOR KEY SHARE"
+
+def _insert_with_ids(table: str, key: str, columns):
+    # Las filas con id lo conservan (restaurar un respaldo); la secuencia se adelanta para que las demás no choquen
+    sequence = f"pg_get_serial_sequence('{table}', '{key}')"
+    names = ", ".join(columns)
+    return [
+        f"""
+        SELECT setval({sequence}, GREATEST(max({key}), pg_sequence_last_value({sequence}::regclass)))
+        FROM import_rows WHERE NOT rejected HAVING max({key}) IS NOT NULL
+        """,
+        f"""
+        INSERT INTO {table} ({key}, {names})
+        SELECT COALESCE({key}, nextval({sequence})), {names}
+        FROM import_rows WHERE NOT rejected ORDER BY line
+        """,
+    ]
+
+
+MENU = BulkTable(
+    "menu",
+    MenuRow,
+    [("menu_id", "INTEGER"), ("name", "TEXT"), ("price", "NUMERIC(10, 2)")],
+    [
+        ("menu_id {} already exists", _existing("menu", "menu_id", "menu_id")),
+        ("menu_id {} is repeated in the file", _duplicates("menu_id")),
+    ],
+    _insert_with_ids("menu", "menu_id", ["name", "price"]),
+    "SELECT menu_id, name, price FROM menu ORDER BY menu_id",
+    lock="menu",
+    channel=MENU_CHANNEL,
+    cache=menu_cache,
+)
+
+CLIENTS = BulkTable(
+    "client",
+    ClientRow,
+    [("id", "INTEGER"), ("name", "TEXT"), ("address", "TEXT"), ("phone_number", "TEXT"), ("clerkid", "TEXT")],
+    [
+        ("id {} already exists", _existing("client", "id", "id")),
+        ("id {} is repeated in the file", _duplicates("id")),
+        ("clerkid {} already exists", _existing("client", "clerkid", "clerkid")),
+        ("clerkid {} is repeated in the file", _duplicates("clerkid")),
+    ],
+    _insert_with_ids("client", "id", ["name", "address", "phone_number", "clerkid"]),
+    "SELECT id, name, address, phone_number, clerkid FROM client ORDER BY id",
+    lock="client",
+    channel=CLIENT_CHANNEL,
+    cache=client_cache,
+)
+
+# Cada order_ref recibe su order_id antes de insertar, para poder insertar pedidos y líneas con dos INSERT ... SELECT.
+# Los pedidos importados como entregados entran a la cola de analytics.py. La exportación incluye los archivados.
+ORDERS = BulkTable(
+    "orders",
+    OrderRow,
+    [
+        ("order_ref", "TEXT"), ("customer_id", "INTEGER"), ("order_status", "TEXT"), ("delivered_at", "TIMESTAMPTZ"),
+        ("item_id", "INTEGER"), ("quantity", "INTEGER"), ("unit_price", "NUMERIC(10, 2)"),
+    ],
+    [
+        ("customer {} not found", "SELECT line, customer_id FROM import_rows WHERE NOT EXISTS (SELECT 1 FROM client WHERE client.id = import_rows.customer_id)"),
+        ("menu item {} not found", "SELECT line, item_id FROM import_rows WHERE item_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM menu WHERE menu.menu_id = import_rows.item_id)"),
+        (
+            "order {} has lines with a different customer_id or order_status",
+            """
+            SELECT line, order_ref FROM import_rows
+            WHERE order_ref IN (SELECT order_ref FROM import_rows GROUP BY order_ref HAVING count(DISTINCT (customer_id, order_status)) > 1)
+            """,
+        ),
+    ],
+    [
+        """
+        UPDATE import_rows SET unit_price = menu.price
+        FROM menu
+        WHERE menu.menu_id = import_rows.item_id AND import_rows.unit_price IS NULL AND NOT import_rows.rejected
+        """,
+        """
+        CREATE TEMP TABLE import_orders ON COMMIT DROP AS
+        SELECT order_ref, nextval(pg_get_serial_sequence('orders', 'order_id'))::int AS order_id
+        FROM (SELECT order_ref, min(line) AS first_line FROM import_rows WHERE NOT rejected GROUP BY order_ref ORDER BY first_line) AS refs
+        """,
+        f"""
+        INSERT INTO orders (order_id, customer_id, order_status, delivered_at, total_price)
+        SELECT import_orders.order_id, min(import_rows.customer_id), min(import_rows.order_status),
+               CASE WHEN min(import_rows.order_status) = '{DELIVERED_STATUS}' THEN COALESCE(max(import_rows.delivered_at), now()) END,
+               COALESCE(sum(import_rows.unit_price * import_rows.quantity), 0)
+        FROM import_orders
+        JOIN import_rows ON import_rows.order_ref = import_orders.order_ref AND NOT import_rows.rejected
+        GROUP BY import_orders.order_id
+        """,
+        """
+        INSERT INTO orderdetails (order_id, item_id, quantity, unit_price)
+        SELECT import_orders.order_id, import_rows.item_id, import_rows.quantity, import_rows.unit_price
+        FROM import_orders
+        JOIN import_rows ON import_rows.order_ref = import_orders.order_ref AND NOT import_rows.rejected
+        WHERE import_rows.item_id IS NOT NULL
+        ORDER BY import_rows.line
+        """,
+        """
+        INSERT INTO sales_rollup_queue (order_id)
+        SELECT orders.order_id FROM import_orders JOIN orders ON orders.order_id = import_orders.order_id
+        WHERE orders.delivered_at IS NOT NULL
+        """,
+    ],
+    """
+    SELECT orders.order_id, orders.customer_id, orders.order_status,
+           to_char(orders.delivered_at AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS.US"Z"') AS delivered_at,
+           orderdetails.item_id, orderdetails.quantity, orderdetails.unit_price
+    FROM orders_history AS orders
+    LEFT JOIN orderdetails_history AS orderdetails ON orderdetails.order_id = orders.order_id
+    ORDER BY orders.order_id
+    """,
+    group_column="order_ref",
+    key_locks=[_key_share("client", "id", "customer_id"), _key_share("menu", "menu_id", "item_id")],
+    # Un pedido importado no es un pedido nuevo en cocina: las pantallas reciben un resync y recargan
+    channel=ORDER_CHANNEL,
+    payload=json.dumps({"event": "resync"}),
+    quiet_setting="restaurant.importing_orders",
+)
+
+TABLES = {"menu": MENU, "clients": CLIENTS, "orders": ORDERS}
+
+# Rechaza las demás filas de un grupo (pedido) con alguna fila rechazada, aquí o al validar en Python
+REJECT_GROUPS = """
+    UPDATE import_rows SET rejected = true
+    WHERE NOT rejected AND ({column} IN (SELECT {column} FROM import_rows WHERE rejected) OR {column} = ANY(%s))
+    RETURNING line, {column}
+"""
+
+MARK_REJECTED = "UPDATE import_rows SET rejected = true WHERE line = ANY(%s)"
+
+COUNT_ACCEPTED = "SELECT count(*) FROM import_rows WHERE NOT rejected"
+
+
+def _copy_value(value):
+    # Formato de texto de COPY
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+def copy_text(rows):
+    return "".join("\t".join(_copy_value(value) for value in row) + "\n" for row in rows)
+
+
+def read_rows(text, fmt: str):
+    # (número de línea, dict) por fila; en CSV un campo vacío cuenta como ausente
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, {key: value for key, value in row.items() if key is not None and value != ""}
+        return
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, e
+            continue
+        yield line_number, row if isinstance(row, dict) else ValueError("expected a JSON object")
+
+
+def _describe(error: Exception):
+    if isinstance(error, ValidationError):
+        first = error.errors()[0]
+        location = ".".join(str(part) for part in first["loc"])
+        return f"{location}: {first['msg']}" if location else first["msg"]
+    return str(error)
+
+
+class ImportRun:
+    # Estado de una importación: valida en Python por lotes y acumula los errores por fila
+    def __init__(self, table: BulkTable, batch_size: int = BULK_BATCH_SIZE):
+        self.table = table
+        self.batch_size = batch_size
+        self.rows = 0
+        self.rejected = 0
+        self.errors = []
+        self.rejected_groups = set()
+        self.rejected_lines = set()
+
+    def reject(self, line: int, message: str):
+        self.rejected += 1
+        if len(self.errors) < BULK_MAX_ERRORS:
+            self.errors.append(RowError(line=line, error=message))
+
+    def reject_staged(self, failed, message: str):
+        # Una fila que falla varias revisiones se reporta una sola vez
+        lines = []
+        for line, value in failed:
+            if line not in self.rejected_lines:
+                self.rejected_lines.add(line)
+                self.reject(line, message.format(value))
+                lines.append(line)
+        return lines
+
+    def batches(self, rows):
+        batch = []
+        names = [name for name, _ in self.table.columns]
+        for line, raw in rows:
+            self.rows += 1
+            try:
+                if isinstance(raw, Exception):
+                    raise raw
+                row = self.table.model.model_validate(raw)
+            except (ValidationError, ValueError) as e:
+                self.reject(line, _describe(e))
+                group = self.table.group_column
+                if group and isinstance(raw, dict):
+                    ref = raw.get(group, raw.get("order_id"))
+                    if ref is not None:
+                        self.rejected_groups.add(str(ref))
+                continue
+            batch.append((line, *(getattr(row, name) for name in names)))
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def report(self, imported: int, committed: bool):
+        self.errors.sort(key=lambda error: error.line)
+        return ImportReport(
+            table=self.table.name, rows=self.rows, imported=imported, rejected=self.rejected,
+            committed=committed, errors=self.errors,
+        )
+
+
+class BulkManager:
+    @staticmethod
+    @db_errors
+    def begin_import(db_connection, table: BulkTable):
+        with db_connection.cursor() as cursor:
+            cursor.execute(table.create_staging)
+
+    @staticmethod
+    @db_errors
+    def copy_rows(db_connection, table: BulkTable, rows):
+        with db_connection.cursor() as cursor:
+            cursor.copy_expert(table.copy_in, io.StringIO(copy_text(rows)))
+
+    @staticmethod
+    @db_errors
+    def finish_import(db_connection, run: ImportRun, abort_on_error: bool = False, dry_run: bool = False):
+        # Si algo falla, import_file deshace la transacción con abort_import
+        table = run.table
+        with db_connection.cursor() as cursor:
+            if table.lock:
+                # Nadie más escribe en la tabla entre la revisión y el INSERT (no bloquea las lecturas)
+                cursor.execute(f"LOCK TABLE {table.lock} IN SHARE ROW EXCLUSIVE MODE")
+            for statement in table.key_locks:
+                cursor.execute(statement)
+            for message, check in table.checks:
+                cursor.execute(check)
+                lines = run.reject_staged(cursor.fetchall(), message)
+                cursor.execute(MARK_REJECTED, (lines,))
+            if table.group_column:
+                cursor.execute(REJECT_GROUPS.format(column=table.group_column), (list(run.rejected_groups),))
+                run.reject_staged(cursor.fetchall(), table.group_column + " {} has rejected lines")
+            cursor.execute(COUNT_ACCEPTED)
+            imported = cursor.fetchone()[0]
+
+            if dry_run or (abort_on_error and run.rejected):
+                db_connection.rollback()
+                return run.report(imported if dry_run else 0, committed=False)
+
+            if table.quiet_setting:
+                cursor.execute("SELECT set_config(%s, 'on', true)", (table.quiet_setting,))
+            for statement in table.inserts:
+                cursor.execute(statement)
+            if table.channel:
+                cursor.execute("SELECT pg_notify(%s, %s)", (table.channel, table.payload))
+        db_connection.commit()
+        if table.cache is not None:
+            table.cache.clear()
+        return run.report(imported, committed=True)
+
+    @staticmethod
+    def abort_import(db_connection):
+        db_connection.rollback()
+
+    @staticmethod
+    @stream_errors
+    def export_rows(db_connection, table: BulkTable, fmt: str, output):
+        # output: objeto con write(); COPY escribe una fila por llamada
+        try:
+            with db_connection.cursor() as cursor:
+                cursor.copy_expert(table.copy_out(fmt), output)
+        finally:
+            db_connection.rollback()
+
+
+class AsyncBulkManager:
+    @staticmethod
+    @db_errors
+    async def begin_import(db_connection, table: BulkTable):
+        async with db_connection.cursor() as cursor:
+            await cursor.execute(table.create_staging)
+
+    @staticmethod
+    @db_errors
+    async def copy_rows(db_connection, table: BulkTable, rows):
+        async with db_connection.cursor() as cursor:
+            async with cursor.copy(table.copy_in) as copy:
+                await copy.write(copy_text(rows))
+
+    @staticmethod
+    @db_errors
+    async def finish_import(db_connection, run: ImportRun, abort_on_error: bool = False, dry_run: bool = False):
+        table = run.table
+        async with db_connection.cursor() as cursor:
+            if table.lock:
+                await cursor.execute(f"LOCK TABLE {table.lock} IN SHARE ROW EXCLUSIVE MODE")
+            for statement in table.key_locks:
+                await cursor.execute(statement)
+            for message, check in table.checks:
+                await cursor.execute(check)
+                lines = run.reject_staged(await cursor.fetchall(), message)
+                await cursor.execute(MARK_REJECTED, (lines,))
+            if table.group_column:
+                await cursor.execute(REJECT_GROUPS.format(column=table.group_column), (list(run.rejected_groups),))
+                run.reject_staged(await cursor.fetchall(), table.group_column + " {} has rejected lines")
+            await cursor.execute(COUNT_ACCEPTED)
+            imported = (await cursor.fetchone())[0]
+
+            if dry_run or (abort_on_error and run.rejected):
+                await db_connection.rollback()
+                return run.report(imported if dry_run else 0, committed=False)
+
+            if table.quiet_setting:
+                await cursor.execute("SELECT set_config(%s, 'on', true)", (table.quiet_setting,))
+            for statement in table.inserts:
+                await cursor.execute(statement)
+            if table.channel:
+                await cursor.execute("SELECT pg_notify(%s, %s)", (table.channel, table.payload))
+        await db_connection.commit()
+        if table.cache is not None:
+            table.cache.clear()
+        return run.report(imported, committed=True)
+
+    @staticmethod
+    async def abort_import(db_connection):
+        await db_connection.rollback()
+
+    @staticmethod
+    @db_errors
+    async def export_rows(db_connection, table: BulkTable, fmt: str):
+        try:
+            async with db_connection.cursor() as cursor:
+                async with cursor.copy(table.copy_out(fmt)) as copy:
+                    async for data in copy:
+                        yield bytes(data)
+        finally:
+            await db_connection.rollback()
+
+
+def _call(method, *args, **kwargs):
+    # import_file corre en un hilo; los managers async se ejecutan en el event loop que lo lanzó
+    if inspect.iscoroutinefunction(method):
+        return from_thread.run(lambda: method(*args, **kwargs))
+    return method(*args, **kwargs)
+
+
+def import_file(manager, db_connection, table: BulkTable, text, fmt: str, abort_on_error: bool = False, dry_run: bool = False, batch_size: int = BULK_BATCH_SIZE):
+    # text: archivo de texto (o stream del cuerpo de la petición) que se lee una sola vez, de principio a fin
+    run = ImportRun(table, batch_size)
+    _call(manager.begin_import, db_connection, table)
+    try:
+        for batch in run.batches(read_rows(text, fmt)):
+            _call(manager.copy_rows, db_connection, table, batch)
+        return _call(manager.finish_import, db_connection, run, abort_on_error, dry_run)
+    except BaseException:
+        _call(manager.abort_import, db_connection)
+        raise
+
+
+async def spool_body(chunks, chunk_size: int = BULK_SPOOL_CHUNK):
+    # Guarda el cuerpo completo de la petición en un archivo temporal (se borra al cerrarlo) y lo devuelve como texto
+    # listo para import_file; las escrituras a disco van en un hilo, de a chunk_size
+    spool = await to_thread.run_sync(tempfile.TemporaryFile)
+    try:
+        pending, size = [], 0
+        async for chunk in chunks:
+            pending.append(chunk)
+            size += len(chunk)
+            if size >= chunk_size:
+                await to_thread.run_sync(spool.write, b"".join(pending))
+                pending, size = [], 0
+        await to_thread.run_sync(spool.write, b"".join(pending))
+        await to_thread.run_sync(spool.seek, 0)
+    except BaseException:
+        spool.close()
+        raise
+    return io.TextIOWrapper(spool, encoding="utf-8-sig", newline="")
+
+
+class ChunkedWriter:
+    # Junta las filas que escribe COPY en bloques de BULK_EXPORT_CHUNK antes de mandarlas
+    def __init__(self, send, chunk_size: int = BULK_EXPORT_CHUNK):
+        self._send = send
+        self._chunk_size = chunk_size
+        self._buffer = []
+        self._size = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= self._chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            self._send(b"".join(self._buffer))
+            self._buffer = []
+            self._size = 0
+
+
+async def export_chunks(manager, db_connection, table: BulkTable, fmt: str, chunk_size: int = BULK_EXPORT_CHUNK):
+    # Bloques de ~chunk_size bytes para StreamingResponse. Con psycopg2 el COPY corre en un hilo y pasa los bloques por
+    # un canal de capacidad 1: si el cliente se desconecta el canal se cierra y el COPY se corta en el siguiente bloque.
+    if inspect.isasyncgenfunction(manager.export_rows):
+        pending, size = [], 0
+        async for data in manager.export_rows(db_connection, table, fmt):
+            pending.append(data)
+            size += len(data)
+            if size >= chunk_size:
+                yield b"".join(pending)
+                pending, size = [], 0
+        if pending:
+            yield b"".join(pending)
+        return
+
+    send, receive = anyio.create_memory_object_stream(1)
+
+    def copy():
+        writer = ChunkedWriter(lambda chunk: from_thread.run(send.send, chunk), chunk_size)
+        try:
+            manager.export_rows(db_connection, table, fmt, writer)
+            writer.flush()
+        except (anyio.BrokenResourceError, anyio.ClosedResourceError):
+            pass
+        finally:
+            from_thread.run_sync(send.close)
+
+    copying = asyncio.create_task(to_thread.run_sync(copy))
+    try:
+        async with receive:
+            async for chunk in receive:
+                yield chunk
+    finally:
+        await copying
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import and export with COPY")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="Load a CSV or NDJSON file")
+    importer.add_argument("table", choices=sorted(TABLES))
+    importer.add_argument("path")
+    importer.add_argument("--format", choices=FORMATS, default=None, help="Defaults to the file extension")
+    importer.add_argument("--dry-run", action="store_true", help="Validate everything and roll back")
+    importer.add_argument("--abort-on-error", action="store_true", help="Import nothing if any row is rejected")
+    importer.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    exporter = commands.add_parser("export", help="Write a table as CSV or NDJSON")
+    exporter.add_argument("table", choices=sorted(TABLES))
+    exporter.add_argument("--format", choices=FORMATS, default="csv")
+    exporter.add_argument("--output", help="File to write (stdout by default)")
+    args = parser.parse_args()
+
+    conn = connect(DATABASE_URL)
+    try:
+        table = TABLES[args.table]
+        if args.command == "export":
+            output = open(args.output, "w", newline="") if args.output else sys.stdout
+            try:
+                BulkManager.export_rows(conn, table, args.format, output)
+            finally:
+                if args.output:
+                    output.close()
+            return
+
+        fmt = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+        with open(args.path, encoding="utf-8-sig", newline="") as text:
+            report = import_file(BulkManager, conn, table, text, fmt, args.abort_on_error, args.dry_run, args.batch_size)
+    finally:
+        conn.close()
+
+    for error in report.errors:
+        print(f"line {error.line}: {error.error}")
+    outcome = "committed" if report.committed else "rolled back"
+    print(f"{report.table}: {report.rows} rows, {report.imported} imported, {report.rejected} rejected ({outcome})")
+    sys.exit(1 if report.rejected else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from fastapi.encoders import jsonable_encoder
+
+MENU_CACHE_TTL = float(os.environ.get("MENU_CACHE_TTL", "300"))
+MENU_CHANNEL = "menu_changed"
+CLIENT_CACHE_SIZE = int(os.environ.get("CLIENT_CACHE_SIZE", "10000"))
+CLIENT_CACHE_TTL = float(os.environ.get("CLIENT_CACHE_TTL", "60"))
+# Los IDs desconocidos (404) se guardan menos tiempo, para que un cliente recién dado de alta en otro worker aparezca pronto
+CLIENT_CACHE_NEGATIVE_TTL = float(os.environ.get("CLIENT_CACHE_NEGATIVE_TTL", "5"))
+CLIENT_CHANNEL = "client_changed"
+
+# Una entity-tag de If-None-Match, fuerte o débil (W/"..."); RFC 9110, sección 8.8.3
+ENTITY_TAG = re.compile(r'(?:W/)?"[^"]*"')
+
+
+class CacheEntry:
+    __slots__ = ("value", "body", "etag", "expires_at")
+
+    def __init__(self, value, ttl: float):
+        self.value = value
+        self.body = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest() + '"'
+        self.expires_at = time.monotonic() + ttl
+
+
+def etag_matches(if_none_match: str, etag: str):
+    # If-None-Match usa la comparación débil (RFC 9110, 13.1.2): "*" o cualquier etiqueta de la lista con el mismo valor,
+    # con o sin W/
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.removeprefix("W/") == opaque for tag in ENTITY_TAG.findall(if_none_match))
+
+
+class MenuCache:
+    ALL = "all"
+
+    def __init__(self, ttl: float = MENU_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        # llave -> (generación, tarea): los fallos de la misma llave comparten una sola carga, como en ClientCache
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > time.monotonic():
+                self.hits += 1
+                return entry
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def set(self, key, value, generation: int):
+        entry = CacheEntry(jsonable_encoder(value), self.ttl)
+        with self._lock:
+            # Si hubo una invalidación mientras se leía de la base de datos, no guardamos datos viejos
+            if generation == self._generation:
+                self._entries[key] = entry
+        return entry
+
+    async def get_or_load(self, key, load):
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        # Una carga empezada antes de la última invalidación puede traer datos viejos: no se comparte
+        generation = self.generation
+        loading = self._loading.get(key)
+        if loading is not None and loading[0] == generation:
+            self.coalesced += 1
+            return await asyncio.shield(loading[1])
+        task = asyncio.ensure_future(self._load(key, load, generation))
+        self._loading[key] = (generation, task)
+        return await asyncio.shield(task)
+
+    async def _load(self, key, load, generation: int):
+        try:
+            value = await load()
+        finally:
+            if self._loading.get(key, (None, None))[1] is asyncio.current_task():
+                del self._loading[key]
+        return self.set(key, value, generation)
+
+    def invalidate(self, item_id: int = None):
+        with self._lock:
+            self._generation += 1
+            if item_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(item_id, None)
+                self._entries.pop(self.ALL, None)
+
+    def clear(self):
+        self.invalidate()
+
+    def on_notify(self, payload: str):
+        try:
+            item_id = int(payload)
+        except (TypeError, ValueError):
+            item_id = None
+        self.invalidate(item_id)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "ttl": self.ttl}
+
+
+menu_cache = MenuCache()
+
+
+class ClientEntry:
+    __slots__ = ("value", "expires_at")
+
+    def __init__(self, value, ttl: float):
+        # value None: el cliente no existe (caché negativa)
+        self.value = value
+        self.expires_at = time.monotonic() + ttl
+
+
+class ClientCache:
+    # LRU acotado de identidades de cliente, por id y por clerkid. Las búsquedas que fallan a la vez para la misma
+    # llave comparten una sola consulta, así que un arranque en frío no manda una avalancha a la base de datos.
+    # Los clientes inexistentes van en su propio LRU, y _keys_by_client guarda con qué llaves está cada cliente, así que
+    # invalidar un cliente no recorre la caché.
+    BY_ID = "id"
+    BY_CLERK = "clerk"
+
+    def __init__(self, maxsize: int = CLIENT_CACHE_SIZE, ttl: float = CLIENT_CACHE_TTL, negative_ttl: float = CLIENT_CACHE_NEGATIVE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._negative = OrderedDict()
+        self._keys_by_client = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._stats = {"hits": 0, "negative_hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key):
+        with self._lock:
+            entries = self._entries if key in self._entries else self._negative
+            entry = entries.get(key)
+            if entry is not None and entry.expires_at > time.monotonic():
+                entries.move_to_end(key)
+                self._stats["hits" if entry.value is not None else "negative_hits"] += 1
+                return entry
+            self._drop(key)
+            return None
+
+    def _drop(self, key):
+        # Con el lock tomado
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._forget_key(entry, key)
+        self._negative.pop(key, None)
+
+    def _forget_key(self, entry, key):
+        keys = self._keys_by_client.get(entry.value.id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_client[entry.value.id]
+
+    def _evict(self, entries):
+        while len(entries) > self.maxsize:
+            key, entry = entries.popitem(last=False)
+            if entry.value is not None:
+                self._forget_key(entry, key)
+            self._stats["evictions"] += 1
+
+    def set(self, key, value, generation: int):
+        entry = ClientEntry(value, self.ttl if value is not None else self.negative_ttl)
+        with self._lock:
+            # Igual que en MenuCache: si hubo una invalidación durante la consulta, no se guarda
+            if generation == self._generation:
+                self._drop(key)
+                if value is None:
+                    self._negative[key] = entry
+                    self._evict(self._negative)
+                else:
+                    self._entries[key] = entry
+                    self._keys_by_client.setdefault(value.id, set()).add(key)
+                    self._evict(self._entries)
+        return entry
+
+    async def get_or_load(self, key, load):
+        # load() devuelve el ClientItem o None si no existe
+        entry = self.get(key)
+        if entry is not None:
+            return entry.value
+
+        # Una carga empezada antes de la última invalidación puede traer datos viejos: no se comparte
+        generation = self._generation
+        loading = self._loading.get(key)
+        if loading is not None and loading[0] == generation:
+            self._stats["coalesced"] += 1
+            return await asyncio.shield(loading[1])
+
+        self._stats["misses"] += 1
+        task = asyncio.ensure_future(self._load(key, load, generation))
+        self._loading[key] = (generation, task)
+        return await asyncio.shield(task)
+
+    async def _load(self, key, load, generation: int):
+        try:
+            value = await load()
+        finally:
+            # Si quien la inició se canceló, la consulta sigue para los demás y se limpia aquí
+            if self._loading.get(key, (None, None))[1] is asyncio.current_task():
+                del self._loading[key]
+        self.set(key, value, generation)
+        return value
+
+    def invalidate(self, client_id: int = None, clerkid: str = None):
+        with self._lock:
+            self._generation += 1
+            self._stats["invalidations"] += 1
+            if client_id is None and clerkid is None:
+                self._entries.clear()
+                self._negative.clear()
+                self._keys_by_client.clear()
+                return
+            # Las llaves del aviso más las que tenía el cliente (su clerkid anterior si lo cambió)
+            stale = {(self.BY_ID, client_id), (self.BY_CLERK, clerkid)} | self._keys_by_client.get(client_id, set())
+            for key in stale:
+                self._drop(key)
+
+    def clear(self):
+        self.invalidate()
+
+    def on_notify(self, payload: str):
+        try:
+            change = json.loads(payload)
+            self.invalidate(change["id"], change.get("clerkid"))
+        except (TypeError, ValueError, KeyError):
+            self.invalidate()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["negative_hits"] + self._stats["misses"] + self._stats["coalesced"]
+            served = self._stats["hits"] + self._stats["negative_hits"]
+            return {
+                "entries": len(self._entries),
+                "negative_entries": len(self._negative),
+                "maxsize": self.maxsize,
+                **self._stats,
+                "hit_rate": served / lookups if lookups else 0.0,
+                "ttl": self.ttl,
+                "negative_ttl": self.negative_ttl,
+            }
+
+
+client_cache = ClientCache()
@@ -1,8 +1,12 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import json
+from dataclasses import dataclass
 from fastapi import HTTPException
 from pydantic import BaseModel
+from pagination import keyset_query, STREAM_CHUNK_SIZE
+from prepared import prepared
+from queries import columns, records, db_errors
 from typing import Optional
+from cache import client_cache, CLIENT_CHANNEL
 
 class ClientItem(BaseModel):
     id: int
@@ -11,104 +15,209 @@ class ClientItem(BaseModel):
     phone_number: Optional[str] = None
     clerkid: Optional[str] = None
 
+@dataclass
+class ClientRecord:
+    id: int
+    name: str
+    address: Optional[str]
+    phone_number: Optional[str]
+    clerkid: Optional[str]
+
+CLIENT_COLUMNS = columns(ClientRecord)
+
+CLIENT_BY_ID = prepared("client_by_id", f"SELECT {CLIENT_COLUMNS} FROM client WHERE id = %s", "integer", record=ClientRecord)
+CLIENT_BY_CLERK = prepared("client_by_clerk", f"SELECT {CLIENT_COLUMNS} FROM client WHERE clerkid = %s", "text", record=ClientRecord)
+INSERT_CLIENT = prepared(
+    "insert_client",
+    "INSERT INTO client (name, address, phone_number, clerkid) VALUES (%s, %s, %s, %s) RETURNING id",
+    "text", "text", "text", "text",
+)
+UPDATE_CLIENT = prepared(
+    "update_client",
+    "UPDATE client SET name = %s, address = %s, phone_number = %s WHERE id = %s",
+    "text", "text", "text", "integer",
+)
+DELETE_CLIENT = prepared("delete_client", "DELETE FROM client WHERE id = %s RETURNING clerkid", "integer")
+NOTIFY_CLIENT = prepared("notify_client", f"SELECT pg_notify('{CLIENT_CHANNEL}', %s)", "text")
+
 class DeletedClientResponse(BaseModel):
     id: int
     message: str = "Client deleted successfully"
 
+def client_change(client_id: int, clerkid: Optional[str] = None):
+    # Payload del NOTIFY: los demás workers invalidan el id y el clerkid (también sus entradas negativas)
+    return json.dumps({"id": client_id, "clerkid": clerkid})
+
 class ClientManager:
     @staticmethod
-    def get_all_clients(db_connection):
-        try:
-            with db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("SELECT * FROM client")
-                clients = cursor.fetchall()
-            return clients
-        except psycopg2.Error as e:
-            print(f"Error in get_all_clients: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+    @db_errors
+    def get_all_clients(db_connection, limit: int = None, after: int = None):
+        with db_connection.cursor() as cursor:
+            cursor.execute(*keyset_query(f"SELECT {CLIENT_COLUMNS} FROM client", "id", limit, after))
+            return records(cursor.fetchall(), ClientRecord)
 
     @staticmethod
+    @db_errors
+    def stream_all_clients(db_connection, chunk_size: int = STREAM_CHUNK_SIZE):
+        # Cursor del lado del servidor: solo hay un bloque de filas en memoria a la vez
+        with db_connection.cursor(name="stream_all_clients") as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(f"SELECT {CLIENT_COLUMNS} FROM client ORDER BY id")
+            while True:
+                clients = cursor.fetchmany(chunk_size)
+                if not clients:
+                    break
+                yield records(clients, ClientRecord)
+
+    @staticmethod
+    @db_errors
     def add_client(
         db_connection, name: str, 
         address: Optional[str] = None, phone_number: Optional[str] = None, clerkid: Optional[str] = None
     ):
-        try:
-            with db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    "INSERT INTO client (name, address, phone_number, clerkid) VALUES (%s, %s, %s, %s) RETURNING id",
-                    (name, address, phone_number, clerkid),
-                )
-                new_client_id = cursor.fetchone()["id"]
-            db_connection.commit()
-
-            return ClientItem(id=new_client_id, name=name, address=address, phone_number=phone_number, clerkid=clerkid)
-        except psycopg2.Error as e:
-            print(f"Error in add_client: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+        with db_connection.cursor() as cursor:
+            new_client_id = INSERT_CLIENT.fetch_one(cursor, (name, address, phone_number, clerkid))[0]
+            NOTIFY_CLIENT.execute(cursor, (client_change(new_client_id, clerkid),))
+        db_connection.commit()
+        client_cache.invalidate(new_client_id, clerkid)
+
+        return ClientItem(id=new_client_id, name=name, address=address, phone_number=phone_number, clerkid=clerkid)
 
     @staticmethod
+    @db_errors
     def edit_client(
         db_connection, client_id: int, name: str, 
         address: Optional[str] = None, phone_number: Optional[str] = None
     ):
-        try:
-            with db_connection.cursor() as cursor:
-                cursor.execute(
-                    "UPDATE client SET name = %s, address = %s, phone_number = %s WHERE id = %s",
-                    (name, address, phone_number, client_id),
-                )
-            db_connection.commit()
-
-            return ClientItem(id=client_id, name=name, address=address, phone_number=phone_number)
-        except psycopg2.Error as e:
-            print(f"Error in edit_client: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+        with db_connection.cursor() as cursor:
+            UPDATE_CLIENT.execute(cursor, (name, address, phone_number, client_id))
+            NOTIFY_CLIENT.execute(cursor, (client_change(client_id),))
+        db_connection.commit()
+        client_cache.invalidate(client_id)
+
+        return ClientItem(id=client_id, name=name, address=address, phone_number=phone_number)
 
     @staticmethod
+    @db_errors
     def delete_client(db_connection, client_id: int):
-        try:
-            with db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("DELETE FROM client WHERE id = %s RETURNING id", (client_id,))
-                deleted_client = cursor.fetchone()
+        with db_connection.cursor() as cursor:
+            deleted_client = DELETE_CLIENT.fetch_one(cursor, (client_id,))
+            if deleted_client:
+                NOTIFY_CLIENT.execute(cursor, (client_change(client_id, deleted_client[0]),))
 
-            if not deleted_client:
-                raise HTTPException(status_code=404, detail="Client not found")
+        if not deleted_client:
+            raise HTTPException(status_code=404, detail="Client not found")
 
-            db_connection.commit()
+        db_connection.commit()
+        client_cache.invalidate(client_id, deleted_client[0])
 
-            return DeletedClientResponse(id=client_id)
-        except psycopg2.Error as e:
-            print(f"Error in delete_client: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+        return DeletedClientResponse(id=client_id)
 
     @staticmethod
+    @db_errors
     def get_client_details(db_connection, client_id: int):
-        try:
-            with db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("SELECT id, name, address, phone_number FROM client WHERE id = %s", (client_id,))
-                client_details = cursor.fetchone()
-
-            if not client_details:
-                raise HTTPException(status_code=404, detail="Client not found")
-
-            return ClientItem(**client_details)
-        except psycopg2.Error as e:
-            print(f"Error in get_client_details: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+        with db_connection.cursor() as cursor:
+            client_details = CLIENT_BY_ID.fetch_one(cursor, (client_id,))
+
+        if not client_details:
+            raise HTTPException(status_code=404, detail="Client not found")
+
+        return client_details
         
     @staticmethod
+    @db_errors
     def get_client_details_by_clerk_id(db_connection, clerk_id: str):
-        try:
-            with db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("SELECT id, name, address, phone_number, clerkid FROM client WHERE clerkid = %s", (clerk_id,))
-                client_details = cursor.fetchone()
+        with db_connection.cursor() as cursor:
+            client_details = CLIENT_BY_CLERK.fetch_one(cursor, (clerk_id,))
+
+        if not client_details:
+            raise HTTPException(status_code=404, detail="Client not found")
+
+        return client_details
+
+
+class AsyncClientManager:
+    @staticmethod
+    @db_errors
+    async def get_all_clients(db_connection, limit: int = None, after: int = None):
+        async with db_connection.cursor() as cursor:
+            await cursor.execute(*keyset_query(f"SELECT {CLIENT_COLUMNS} FROM client", "id", limit, after))
+            return records(await cursor.fetchall(), ClientRecord)
+
+    @staticmethod
+    @db_errors
+    async def stream_all_clients(db_connection, chunk_size: int = STREAM_CHUNK_SIZE):
+        async with db_connection.cursor(name="stream_all_clients") as cursor:
+            cursor.itersize = chunk_size
+            await cursor.execute(f"SELECT {CLIENT_COLUMNS} FROM client ORDER BY id")
+            while True:
+                clients = await cursor.fetchmany(chunk_size)
+                if not clients:
+                    break
+                yield records(clients, ClientRecord)
+
+    @staticmethod
+    @db_errors
+    async def add_client(
+        db_connection, name: str,
+        address: Optional[str] = None, phone_number: Optional[str] = None, clerkid: Optional[str] = None
+    ):
+        async with db_connection.cursor() as cursor:
+            new_client_id = (await INSERT_CLIENT.fetch_one_async(cursor, (name, address, phone_number, clerkid)))[0]
+            await NOTIFY_CLIENT.execute_async(cursor, (client_change(new_client_id, clerkid),))
+        await db_connection.commit()
+        client_cache.invalidate(new_client_id, clerkid)
+
+        return ClientItem(id=new_client_id, name=name, address=address, phone_number=phone_number, clerkid=clerkid)
+
+    @staticmethod
+    @db_errors
+    async def edit_client(
+        db_connection, client_id: int, name: str,
+        address: Optional[str] = None, phone_number: Optional[str] = None
+    ):
+        async with db_connection.cursor() as cursor:
+            await UPDATE_CLIENT.execute_async(cursor, (name, address, phone_number, client_id))
+            await NOTIFY_CLIENT.execute_async(cursor, (client_change(client_id),))
+        await db_connection.commit()
+        client_cache.invalidate(client_id)
+
+        return ClientItem(id=client_id, name=name, address=address, phone_number=phone_number)
 
-            if not client_details:
-                raise HTTPException(status_code=404, detail="Client not found")
+    @staticmethod
+    @db_errors
+    async def delete_client(db_connection, client_id: int):
+        async with db_connection.cursor() as cursor:
+            deleted_client = await DELETE_CLIENT.fetch_one_async(cursor, (client_id,))
+            if deleted_client:
+                await NOTIFY_CLIENT.execute_async(cursor, (client_change(client_id, deleted_client[0]),))
+
+        if not deleted_client:
+            raise HTTPException(status_code=404, detail="Client not found")
+
+        await db_connection.commit()
+        client_cache.invalidate(client_id, deleted_client[0])
 
-            return ClientItem(**client_details)
-        except psycopg2.Error as e:
-            print(f"Error in get_client_details_by_clerk_id: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+        return DeletedClientResponse(id=client_id)
+
+    @staticmethod
+    @db_errors
+    async def get_client_details(db_connection, client_id: int):
+        async with db_connection.cursor() as cursor:
+            client_details = await CLIENT_BY_ID.fetch_one_async(cursor, (client_id,))
+
+        if not client_details:
+            raise HTTPException(status_code=404, detail="Client not found")
+
+        return client_details
+
+    @staticmethod
+    @db_errors
+    async def get_client_details_by_clerk_id(db_connection, clerk_id: str):
+        async with db_connection.cursor() as cursor:
+            client_details = await CLIENT_BY_CLERK.fetch_one_async(cursor, (clerk_id,))
 
+        if not client_details:
+            raise HTTPException(status_code=404, detail="Client not found")
 
+        return client_details
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import os
+import threading
+
+ORDER_CHANNEL = "order_changed"
+FEED_QUEUE_SIZE = int(os.environ.get("FEED_QUEUE_SIZE", "256"))
+FEED_HEARTBEAT = float(os.environ.get("FEED_HEARTBEAT", "15"))
+
+
+class Subscription:
+    def __init__(self, customer_id: int = None, queue_size: int = FEED_QUEUE_SIZE):
+        self.customer_id = customer_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def matches(self, event: dict):
+        return self.customer_id is None or event.get("customer_id") == self.customer_id or event.get("event") == "resync"
+
+    def put(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Un cliente lento no frena a los demás: se descarta lo pendiente y se le pide recargar
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"event": "resync"})
+
+
+class OrderFeed:
+    # Reparte las notificaciones de order_changed (que llegan en el hilo del ChangeListener) a las suscripciones
+    # asyncio de este worker
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._loop = None
+
+    def bind(self, loop):
+        self._loop = loop
+
+    def subscribe(self, customer_id: int = None):
+        subscription = Subscription(customer_id)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def on_notify(self, payload: str):
+        self._publish(json.loads(payload))
+
+    def on_reset(self):
+        # Al reconectar el LISTEN pudimos perder eventos
+        self._publish({"event": "resync"})
+
+    def _publish(self, event: dict):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._dispatch, event)
+
+    def _dispatch(self, event: dict):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.matches(event):
+                subscription.put(event)
+
+    def stats(self):
+        with self._lock:
+            return {"subscribers": len(self._subscriptions)}
+
+
+async def server_sent_events(feed: OrderFeed, subscription: Subscription):
+    try:
+        yield "retry: 3000\n\n"
+        yield "event: ready\ndata: {}\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=FEED_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+    finally:
+        feed.unsubscribe(subscription)
+
+
+order_feed = OrderFeed()
@@ -0,0 +1,156 @@
+# Idempotency-Key para las escrituras: la llave se reclama en la misma transacción que la escritura, así que un
+# reintento (o la misma petición repetida en paralelo) devuelve la respuesta guardada en vez de volver a ejecutarse.
+#
+#   python idempotency.py --purge   borra las llaves vencidas de DATABASE_URL
+import hashlib
+import inspect
+import os
+import sys
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from psycopg2 import connect
+from psycopg2.extras import Json
+from psycopg.types.json import Jsonb
+from database import DATABASE_URL, run_db
+
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", "86400"))
+
+# Si la llave ya existe y no ha vencido, no se inserta nada. Si otra transacción la tiene reclamada y sin terminar,
+# el INSERT espera a que termine: al confirmar se devuelve su respuesta, si se deshace esta petición la reclama.
+CLAIM_KEY = """
+    INSERT INTO idempotency_keys (key, fingerprint) VALUES (%s, %s)
+    ON CONFLICT (key) DO UPDATE SET fingerprint = EXCLUDED.fingerprint, response = NULL, created_at = now()
+    WHERE idempotency_keys.created_at < now() - %s * interval '1 second'
+    RETURNING key
+"""
+
+STORED_RESPONSE = "SELECT fingerprint, response FROM idempotency_keys WHERE key = %s"
+
+SAVE_RESPONSE = "UPDATE idempotency_keys SET response = %s WHERE key = %s"
+
+PURGE_EXPIRED_KEYS = "DELETE FROM idempotency_keys WHERE created_at < now() - %s * interval '1 second'"
+
+
+def fingerprint(method, args):
+    # Por nombre de método (no de clase) para que workers sync y async reconozcan la misma petición
+    return hashlib.sha256(f"{method.__name__}{args!r}".encode()).hexdigest()
+
+
+def _replay(key: str, expected: str, stored):
+    stored_fingerprint, response = stored
+    if stored_fingerprint != expected:
+        raise HTTPException(status_code=422, detail=f"Idempotency-Key {key} was already used for a different request")
+    return response
+
+
+class DeferredTransaction:
+    # El manager hace commit/rollback como siempre; aquí se posponen para que quien lo llama (la llave de
+    # idempotencia, el escritor por lotes) decida cuándo termina la transacción
+    def __init__(self, connection):
+        self._connection = connection
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class AsyncDeferredTransaction(DeferredTransaction):
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+def run_with_key(db_connection, key: str, method, *args):
+    # Sin commit: la llave, la escritura y la respuesta quedan en la transacción de quien llama
+    expected = fingerprint(method, args)
+    with db_connection.cursor() as cursor:
+        cursor.execute(CLAIM_KEY, (key, expected, IDEMPOTENCY_TTL))
+        if not cursor.fetchone():
+            cursor.execute(STORED_RESPONSE, (key,))
+            return _replay(key, expected, cursor.fetchone())
+
+    result = method(DeferredTransaction(db_connection), *args)
+    with db_connection.cursor() as cursor:
+        cursor.execute(SAVE_RESPONSE, (Json(jsonable_encoder(result)), key))
+    return result
+
+
+async def run_with_key_async(db_connection, key: str, method, *args):
+    expected = fingerprint(method, args)
+    async with db_connection.cursor() as cursor:
+        await cursor.execute(CLAIM_KEY, (key, expected, IDEMPOTENCY_TTL))
+        if not await cursor.fetchone():
+            await cursor.execute(STORED_RESPONSE, (key,))
+            return _replay(key, expected, await cursor.fetchone())
+
+    result = await method(AsyncDeferredTransaction(db_connection), *args)
+    async with db_connection.cursor() as cursor:
+        await cursor.execute(SAVE_RESPONSE, (Jsonb(jsonable_encoder(result)), key))
+    return result
+
+
+def call_once(db_connection, key: str, method, *args):
+    try:
+        result = run_with_key(db_connection, key, method, *args)
+        db_connection.commit()
+        return result
+    except HTTPException:
+        db_connection.rollback()
+        raise
+    except Exception as e:
+        db_connection.rollback()
+        print(f"Error in call_once: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+async def call_once_async(db_connection, key: str, method, *args):
+    try:
+        result = await run_with_key_async(db_connection, key, method, *args)
+        await db_connection.commit()
+        return result
+    except HTTPException:
+        await db_connection.rollback()
+        raise
+    except Exception as e:
+        await db_connection.rollback()
+        print(f"Error in call_once_async: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+async def run_idempotent(key: str, method, db_connection, *args):
+    if key is None:
+        return await run_db(method, db_connection, *args)
+    if inspect.iscoroutinefunction(method):
+        return await call_once_async(db_connection, key, method, *args)
+    return await run_in_threadpool(call_once, db_connection, key, method, *args)
+
+
+def purge_expired_keys(db_connection, ttl: int = IDEMPOTENCY_TTL):
+    with db_connection.cursor() as cursor:
+        cursor.execute(PURGE_EXPIRED_KEYS, (ttl,))
+        purged = cursor.rowcount
+    db_connection.commit()
+    return purged
+
+
+def main():
+    if "--purge" not in sys.argv:
+        print("Usage: python idempotency.py --purge")
+        return
+    conn = connect(DATABASE_URL)
+    try:
+        print(f"Purged {purge_expired_keys(conn)} expired idempotency keys")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# Cola de escrituras de pedidos para las horas pico (INGEST_ENABLED=1). Las altas de pedidos y de productos se
+# encolan y un solo escritor por worker las confirma por lotes: hasta INGEST_BATCH_SIZE escrituras o INGEST_FLUSH_MS
+# desde la primera, en una sola transacción (un fsync por lote en vez de uno por petición). Cada escritura corre en su
+# propio SAVEPOINT, así que si una falla (pedido entregado, producto inexistente) las demás del lote siguen, y cada
+# petición recibe su propio resultado o error solo cuando su lote ya se confirmó.
+import asyncio
+import inspect
+import os
+import time
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from database import db_connection
+from idempotency import DeferredTransaction, AsyncDeferredTransaction, run_with_key, run_with_key_async
+
+INGEST_ENABLED = os.environ.get("INGEST_ENABLED", "0") == "1"
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "100"))
+INGEST_FLUSH_MS = float(os.environ.get("INGEST_FLUSH_MS", "5"))
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", "2000"))
+# Cuánto espera una petición por lugar en la cola llena antes de responder 503
+INGEST_ENQUEUE_TIMEOUT = float(os.environ.get("INGEST_ENQUEUE_TIMEOUT", "0.25"))
+
+
+class _Write:
+    __slots__ = ("key", "method", "args", "future")
+
+    def __init__(self, key, method, args, future):
+        self.key = key
+        self.method = method
+        self.args = args
+        self.future = future
+
+
+def _as_http_error(error: Exception):
+    if isinstance(error, HTTPException):
+        return error
+    print(f"Error in ingest write: {error}")
+    return HTTPException(status_code=500, detail="Internal Server Error")
+
+
+def write_batch(db_connection, writes):
+    outcomes = []
+    with db_connection.cursor() as cursor:
+        for write in writes:
+            cursor.execute("SAVEPOINT ingest_write")
+            try:
+                if write.key is None:
+                    result = write.method(DeferredTransaction(db_connection), *write.args)
+                else:
+                    result = run_with_key(db_connection, write.key, write.method, *write.args)
+                cursor.execute("RELEASE SAVEPOINT ingest_write")
+                outcomes.append((result, None))
+            except Exception as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT ingest_write")
+                outcomes.append((None, _as_http_error(e)))
+    db_connection.commit()
+    return outcomes
+
+
+async def write_batch_async(db_connection, writes):
+    outcomes = []
+    async with db_connection.cursor() as cursor:
+        for write in writes:
+            await cursor.execute("SAVEPOINT ingest_write")
+            try:
+                if write.key is None:
+                    result = await write.method(AsyncDeferredTransaction(db_connection), *write.args)
+                else:
+                    result = await run_with_key_async(db_connection, write.key, write.method, *write.args)
+                await cursor.execute("RELEASE SAVEPOINT ingest_write")
+                outcomes.append((result, None))
+            except Exception as e:
+                await cursor.execute("ROLLBACK TO SAVEPOINT ingest_write")
+                outcomes.append((None, _as_http_error(e)))
+    await db_connection.commit()
+    return outcomes
+
+
+class IngestQueue:
+    def __init__(
+        self,
+        batch_size: int = INGEST_BATCH_SIZE,
+        flush_ms: float = INGEST_FLUSH_MS,
+        queue_size: int = INGEST_QUEUE_SIZE,
+        enqueue_timeout: float = INGEST_ENQUEUE_TIMEOUT,
+        connection=db_connection,
+    ):
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.queue_size = queue_size
+        self.enqueue_timeout = enqueue_timeout
+        self.connection = connection
+        self._queue = None
+        self._writer = None
+        self._stats = {"submitted": 0, "rejected": 0, "batches": 0, "written": 0, "failed": 0, "flush_seconds": 0.0}
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._writer = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Termina de escribir lo que ya estaba en la cola antes de cerrar
+        if self._writer is None:
+            return
+        await self._queue.join()
+        self._writer.cancel()
+        try:
+            await self._writer
+        except asyncio.CancelledError:
+            pass
+        self._writer = None
+
+    async def submit(self, key: str, method, *args):
+        future = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(self._queue.put(_Write(key, method, args, future)), timeout=self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self._stats["rejected"] += 1
+            raise HTTPException(status_code=503, detail="Write queue is full, try again later", headers={"Retry-After": "1"})
+        self._stats["submitted"] += 1
+        return await future
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.flush_ms / 1000
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            started = time.perf_counter()
+            try:
+                outcomes = await self._write(batch)
+            except Exception as e:
+                # Falló el lote completo (por ejemplo, el commit): ninguna escritura quedó confirmada
+                error = _as_http_error(e)
+                outcomes = [(None, error)] * len(batch)
+            self._stats["flush_seconds"] += time.perf_counter() - started
+            self._stats["batches"] += 1
+            for write, (result, error) in zip(batch, outcomes):
+                if error is None:
+                    self._stats["written"] += 1
+                    if not write.future.done():
+                        write.future.set_result(result)
+                else:
+                    self._stats["failed"] += 1
+                    if not write.future.done():
+                        write.future.set_exception(error)
+                self._queue.task_done()
+
+    async def _write(self, batch):
+        async with self.connection() as conn:
+            # Un lote no mezcla managers sync y async: el modo lo fija DB_MODE para todo el worker
+            if inspect.iscoroutinefunction(batch[0].method):
+                return await write_batch_async(conn, batch)
+            return await run_in_threadpool(write_batch, conn, batch)
+
+    def stats(self):
+        batches = self._stats["batches"]
+        return {
+            "enabled": self._writer is not None,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            **self._stats,
+            "average_batch": self._stats["written"] / batches if batches else 0.0,
+        }
+
+
+ingest_queue = IngestQueue()
@@ -1,82 +1,189 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from dataclasses import dataclass
+from decimal import Decimal
 from fastapi import HTTPException
 from pydantic import BaseModel
+from pagination import keyset_query, STREAM_CHUNK_SIZE
+from prepared import prepared
+from queries import columns, records, db_errors
+from cache import menu_cache, MENU_CHANNEL
+from orders import REPRICED_STATUSES, REPRICE_OPEN_ORDER_LINES, REFRESH_ORDER_TOTALS
 
 class MenuItem(BaseModel):
     menu_id: int
     name: str
     price: float
 
+@dataclass
+class MenuRecord:
+    menu_id: int
+    name: str
+    price: Decimal
+
+MENU_COLUMNS = columns(MenuRecord)
+
+MENU_ITEM = prepared("menu_item", f"SELECT {MENU_COLUMNS} FROM menu WHERE menu_id = %s", "integer", record=MenuRecord)
+INSERT_MENU_ITEM = prepared("insert_menu_item", "INSERT INTO menu (name, price) VALUES (%s, %s) RETURNING menu_id", "text", "numeric")
+UPDATE_MENU_ITEM = prepared("update_menu_item", "UPDATE menu SET name = %s, price = %s WHERE menu_id = %s", "text", "numeric", "integer")
+DELETE_MENU_ITEM = prepared("delete_menu_item", "DELETE FROM menu WHERE menu_id = %s", "integer")
+NOTIFY_MENU = prepared("notify_menu", f"SELECT pg_notify('{MENU_CHANNEL}', %s)", "text")
+
 class MessageResponse(BaseModel):
     message: str
 
 class MenuManager:
     @staticmethod
-    def get_all_menu_info(db_connection):
-        try:
-            with db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("SELECT * FROM menu")
-                menu_items = cursor.fetchall()
-            return menu_items
-        except Exception as e:
-            print(f"Error in get_all_menu_info: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+    @db_errors
+    def get_all_menu_info(db_connection, limit: int = None, after: int = None):
+        with db_connection.cursor() as cursor:
+            cursor.execute(*keyset_query(f"SELECT {MENU_COLUMNS} FROM menu", "menu_id", limit, after))
+            return records(cursor.fetchall(), MenuRecord)
+
+    @staticmethod
+    @db_errors
+    def stream_all_menu_info(db_connection, chunk_size: int = STREAM_CHUNK_SIZE):
+        # Cursor del lado del servidor: solo hay un bloque de filas en memoria a la vez
+        with db_connection.cursor(name="stream_all_menu_info") as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(f"SELECT {MENU_COLUMNS} FROM menu ORDER BY menu_id")
+            while True:
+                menu_items = cursor.fetchmany(chunk_size)
+                if not menu_items:
+                    break
+                yield records(menu_items, MenuRecord)
 
     @staticmethod
+    @db_errors
     def get_menu_item(db_connection, item_id: int):
-        try:
-            with db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("SELECT * FROM menu WHERE menu_id = %s", (item_id,))
-                menu_item = cursor.fetchone()
+        with db_connection.cursor() as cursor:
+            menu_item = MENU_ITEM.fetch_one(cursor, (item_id,))
 
-            if not menu_item:
-                raise HTTPException(status_code=404, detail="Item not found")
+        if not menu_item:
+            raise HTTPException(status_code=404, detail="Item not found")
 
-            return menu_item
-        except Exception as e:
-            print(f"Error in get_menu_item: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+        return menu_item
 
     @staticmethod
+    @db_errors
     def add_menu_item(db_connection, nombre: str, precio: float):
-        try:
-            with db_connection.cursor() as cursor:
-                cursor.execute("INSERT INTO menu (name, price) VALUES (%s, %s) RETURNING menu_id", (nombre, precio))
-                new_menu_item_id = cursor.fetchone()[0]
-            db_connection.commit()
+        with db_connection.cursor() as cursor:
+            new_menu_item_id = INSERT_MENU_ITEM.fetch_one(cursor, (nombre, precio))[0]
+            NOTIFY_MENU.execute(cursor, (str(new_menu_item_id),))
+        db_connection.commit()
+        menu_cache.invalidate(new_menu_item_id)
 
-            return {"message": "Item added successfully", "item_id": new_menu_item_id}
-        except Exception as e:
-            print(f"Error in add_menu_item: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+        return {"message": "Item added successfully", "item_id": new_menu_item_id}
 
     @staticmethod
+    @db_errors
     def update_menu_item(db_connection, item_id: int, nombre: str, precio: float):
-        try:
-            with db_connection.cursor() as cursor:
-                cursor.execute("UPDATE menu SET name = %s, price = %s WHERE menu_id = %s", (nombre, precio, item_id))
-            db_connection.commit()
+        with db_connection.cursor() as cursor:
+            UPDATE_MENU_ITEM.execute(cursor, (nombre, precio, item_id))
+            updated = cursor.rowcount
+            if updated:
+                repriced = REPRICE_OPEN_ORDER_LINES.fetch_all(cursor, (precio, REPRICED_STATUSES, item_id, precio))
+                repriced_orders = list({row[0] for row in repriced})
+                if repriced_orders:
+                    REFRESH_ORDER_TOTALS.execute(cursor, (repriced_orders,))
+                NOTIFY_MENU.execute(cursor, (str(item_id),))
+        db_connection.commit()
+        menu_cache.invalidate(item_id)
 
-            if cursor.rowcount == 0:
-                raise HTTPException(status_code=404, detail="Item not found")
+        if updated == 0:
+            raise HTTPException(status_code=404, detail="Item not found")
 
-            return MessageResponse(message="Item updated successfully")
-        except Exception as e:
-            print(f"Error in update_menu_item: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+        return MessageResponse(message="Item updated successfully")
 
     @staticmethod
+    @db_errors
     def delete_menu_item(db_connection, item_id: int):
-        try:
-            with db_connection.cursor() as cursor:
-                cursor.execute("DELETE FROM menu WHERE menu_id = %s", (item_id,))
-            db_connection.commit()
-
-            if cursor.rowcount == 0:
-                raise HTTPException(status_code=404, detail="Item not found")
-
-            return MessageResponse(message="Item deleted successfully")
-        except Exception as e:
-            print(f"Error in delete_menu_item: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+        with db_connection.cursor() as cursor:
+            DELETE_MENU_ITEM.execute(cursor, (item_id,))
+            deleted = cursor.rowcount
+            if deleted:
+                NOTIFY_MENU.execute(cursor, (str(item_id),))
+        db_connection.commit()
+        menu_cache.invalidate(item_id)
+
+        if deleted == 0:
+            raise HTTPException(status_code=404, detail="Item not found")
+
+        return MessageResponse(message="Item deleted successfully")
+
+
+class AsyncMenuManager:
+    @staticmethod
+    @db_errors
+    async def get_all_menu_info(db_connection, limit: int = None, after: int = None):
+        async with db_connection.cursor() as cursor:
+            await cursor.execute(*keyset_query(f"SELECT {MENU_COLUMNS} FROM menu", "menu_id", limit, after))
+            return records(await cursor.fetchall(), MenuRecord)
+
+    @staticmethod
+    @db_errors
+    async def stream_all_menu_info(db_connection, chunk_size: int = STREAM_CHUNK_SIZE):
+        async with db_connection.cursor(name="stream_all_menu_info") as cursor:
+            cursor.itersize = chunk_size
+            await cursor.execute(f"SELECT {MENU_COLUMNS} FROM menu ORDER BY menu_id")
+            while True:
+                menu_items = await cursor.fetchmany(chunk_size)
+                if not menu_items:
+                    break
+                yield records(menu_items, MenuRecord)
+
+    @staticmethod
+    @db_errors
+    async def get_menu_item(db_connection, item_id: int):
+        async with db_connection.cursor() as cursor:
+            menu_item = await MENU_ITEM.fetch_one_async(cursor, (item_id,))
+
+        if not menu_item:
+            raise HTTPException(status_code=404, detail="Item not found")
+
+        return menu_item
+
+    @staticmethod
+    @db_errors
+    async def add_menu_item(db_connection, nombre: str, precio: float):
+        async with db_connection.cursor() as cursor:
+            new_menu_item_id = (await INSERT_MENU_ITEM.fetch_one_async(cursor, (nombre, precio)))[0]
+            await NOTIFY_MENU.execute_async(cursor, (str(new_menu_item_id),))
+        await db_connection.commit()
+        menu_cache.invalidate(new_menu_item_id)
+
+        return {"message": "Item added successfully", "item_id": new_menu_item_id}
+
+    @staticmethod
+    @db_errors
+    async def update_menu_item(db_connection, item_id: int, nombre: str, precio: float):
+        async with db_connection.cursor() as cursor:
+            await UPDATE_MENU_ITEM.execute_async(cursor, (nombre, precio, item_id))
+            updated = cursor.rowcount
+            if updated:
+                repriced = await REPRICE_OPEN_ORDER_LINES.fetch_all_async(cursor, (precio, REPRICED_STATUSES, item_id, precio))
+                repriced_orders = list({row[0] for row in repriced})
+                if repriced_orders:
+                    await REFRESH_ORDER_TOTALS.execute_async(cursor, (repriced_orders,))
+                await NOTIFY_MENU.execute_async(cursor, (str(item_id),))
+        await db_connection.commit()
+        menu_cache.invalidate(item_id)
+
+        if updated == 0:
+            raise HTTPException(status_code=404, detail="Item not found")
+
+        return MessageResponse(message="Item updated successfully")
+
+    @staticmethod
+    @db_errors
+    async def delete_menu_item(db_connection, item_id: int):
+        async with db_connection.cursor() as cursor:
+            await DELETE_MENU_ITEM.execute_async(cursor, (item_id,))
+            deleted = cursor.rowcount
+            if deleted:
+                await NOTIFY_MENU.execute_async(cursor, (str(item_id),))
+        await db_connection.commit()
+        menu_cache.invalidate(item_id)
+
+        if deleted == 0:
+            raise HTTPException(status_code=404, detail="Item not found")
+
+        return MessageResponse(message="Item deleted successfully")
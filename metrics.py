@@ -0,0 +1,259 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import psycopg
+from psycopg2 import extensions
+
+# Log de consultas lentas (0 = apagado) y profiler por petición
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "0"))
+PROFILER_ENABLED = os.environ.get("PROFILER_ENABLED", "0") == "1"
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_HEADER = b"x-profile"
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=HTTP_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value: float):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            counts = entry[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, labels, le)} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {_number(total)}")
+                lines.append(f"{self.name}_count{_labels(self.labels, labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, prefix: str, collect):
+        # collect() devuelve un dict de valores numéricos que se exponen como gauges <prefix>_<llave>
+        self.collectors.append((prefix, collect))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for prefix, collect in self.collectors:
+            for key, value in collect().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.add(Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status")))
+HTTP_LATENCY = registry.add(Histogram("http_request_duration_seconds", "HTTP request latency by route", ("method", "route")))
+DB_QUERY_LATENCY = registry.add(Histogram("db_query_duration_seconds", "Query latency by calling method", ("caller",), DB_BUCKETS))
+DB_QUERY_ROWS = registry.add(Counter("db_query_rows_total", "Rows returned or affected by calling method", ("caller",)))
+DB_POOL_WAIT = registry.add(Histogram("db_pool_wait_seconds", "Time spent waiting for a pooled connection", (), DB_BUCKETS))
+
+
+def _caller_name(frame):
+    # PreparedQuery ejecuta en nombre del manager: la consulta se cuenta al método que la llamó
+    while frame.f_back is not None and frame.f_globals.get("__name__") == "prepared":
+        frame = frame.f_back
+    code = frame.f_code
+    return getattr(code, "co_qualname", code.co_name)
+
+
+def record_query(caller: str, query, elapsed: float, rows: int, pool_wait: float):
+    DB_QUERY_LATENCY.observe((caller,), elapsed)
+    if rows and rows > 0:
+        DB_QUERY_ROWS.inc((caller,), rows)
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        text = " ".join(str(query).split())
+        print(f"Slow query {elapsed * 1000:.1f}ms in {caller} rows={rows} pool_wait={pool_wait * 1000:.1f}ms: {text[:500]}")
+
+
+_timed_cursor_classes = {}
+
+
+def _timed_cursor_class(base):
+    timed = _timed_cursor_classes.get(base)
+    if timed is None:
+        def execute(self, query, vars=None):
+            caller = _caller_name(sys._getframe(1))
+            started = time.perf_counter()
+            try:
+                return base.execute(self, query, vars)
+            finally:
+                record_query(caller, query, time.perf_counter() - started, self.rowcount, getattr(self.connection, "pool_wait", 0.0))
+
+        timed = _timed_cursor_classes[base] = type("Timed" + base.__name__, (base,), {"execute": execute})
+    return timed
+
+
+class InstrumentedConnection(extensions.connection):
+    # connection_factory de psycopg2: cada cursor, con el cursor_factory que pida el manager, mide sus execute()
+    pool_wait = 0.0
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get("cursor_factory") or self.cursor_factory or extensions.cursor
+        kwargs["cursor_factory"] = _timed_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+
+class _TimedAsyncExecute:
+    async def execute(self, query, params=None, **kwargs):
+        caller = _caller_name(sys._getframe(1))
+        started = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            record_query(caller, query, time.perf_counter() - started, self.rowcount, getattr(self.connection, "pool_wait", 0.0))
+
+
+class TimedAsyncCursor(_TimedAsyncExecute, psycopg.AsyncCursor):
+    pass
+
+
+class TimedAsyncServerCursor(_TimedAsyncExecute, psycopg.AsyncServerCursor):
+    pass
+
+
+async def instrument_async_connection(conn):
+    # configure del pool async de psycopg 3
+    conn.cursor_factory = TimedAsyncCursor
+    conn.server_cursor_factory = TimedAsyncServerCursor
+
+
+class _Profiler:
+    _lock = threading.Lock()
+
+    @classmethod
+    def start(cls, scope):
+        if not PROFILER_ENABLED:
+            return None
+        requested = any(name == PROFILE_HEADER and value not in (b"", b"0") for name, value in scope.get("headers", ()))
+        if not requested and not (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE):
+            return None
+        # cProfile solo admite un perfil activo a la vez; si hay otro en curso no se perfila esta petición
+        if not cls._lock.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            cls._lock.release()
+            return None
+        return profiler
+
+    @classmethod
+    def stop(cls, profiler, scope, elapsed: float):
+        try:
+            profiler.disable()
+        finally:
+            cls._lock.release()
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(25)
+        print(f"Profile for {scope.get('method')} {scope.get('path')} ({elapsed * 1000:.1f}ms):\n{output.getvalue()}")
+
+
+class MetricsMiddleware:
+    # Middleware ASGI puro (sin BaseHTTPMiddleware) para que medir cada petición cueste poco
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        profiler = _Profiler.start(scope)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            if profiler is not None:
+                _Profiler.stop(profiler, scope, elapsed)
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            HTTP_REQUESTS.inc((scope["method"], path, str(status[0])))
+            HTTP_LATENCY.observe((scope["method"], path), elapsed)
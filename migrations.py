@@ -0,0 +1,495 @@
+# Migraciones versionadas del esquema. Cada una se aplica una sola vez, en orden, dentro de su propia transacción
+# (salvo las marcadas transactional=False).
+#
+#   python migrations.py            aplica las migraciones pendientes sobre DATABASE_URL
+#   python migrations.py --status   muestra qué versiones están aplicadas
+import re
+import sys
+from collections import namedtuple
+from psycopg2 import connect
+from database import DATABASE_URL
+
+# Llave del advisory lock para que dos workers no migren a la vez
+MIGRATION_LOCK_ID = 7267001
+
+# transactional=False es para sentencias que no pueden ir en una transacción (CREATE INDEX CONCURRENTLY);
+# se ejecutan una por una en autocommit, así que deben ser idempotentes.
+Migration = namedtuple("Migration", "version name statements transactional", defaults=(True,))
+
+MIGRATIONS = [
+    Migration(
+        1,
+        "base_tables",
+        """
+        CREATE TABLE IF NOT EXISTS menu (
+            menu_id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            price NUMERIC(10, 2) NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS client (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            address TEXT,
+            phone_number TEXT,
+            clerkid TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS orders (
+            order_id SERIAL PRIMARY KEY,
+            customer_id INTEGER NOT NULL REFERENCES client (id),
+            order_status TEXT NOT NULL DEFAULT 'En cola'
+        );
+
+        CREATE TABLE IF NOT EXISTS orderdetails (
+            detail_id SERIAL PRIMARY KEY,
+            order_id INTEGER NOT NULL REFERENCES orders (order_id),
+            item_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL
+        );
+        """,
+    ),
+    Migration(
+        2,
+        "order_totals",
+        """
+        ALTER TABLE orderdetails ADD COLUMN IF NOT EXISTS unit_price NUMERIC(10, 2);
+
+        UPDATE orderdetails SET unit_price = menu.price
+        FROM menu
+        WHERE menu.menu_id = orderdetails.item_id AND orderdetails.unit_price IS NULL;
+
+        UPDATE orderdetails SET unit_price = 0 WHERE unit_price IS NULL;
+
+        ALTER TABLE orderdetails ALTER COLUMN unit_price SET NOT NULL;
+
+        ALTER TABLE orders ADD COLUMN IF NOT EXISTS total_price NUMERIC(12, 2) NOT NULL DEFAULT 0;
+
+        UPDATE orders SET total_price = computed.total_price
+        FROM (
+            SELECT order_id, SUM(unit_price * quantity) AS total_price
+            FROM orderdetails
+            GROUP BY order_id
+        ) AS computed
+        WHERE computed.order_id = orders.order_id;
+        """,
+    ),
+    Migration(
+        3,
+        "lookup_indexes",
+        [
+            # /orders/{id}/details, totales y /orders/batch
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS orderdetails_order_id_idx ON orderdetails (order_id)",
+            # Re-cotización de pedidos abiertos al cambiar un precio del menú
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS orderdetails_item_id_idx ON orderdetails (item_id)",
+            # /orders/by_customer y /orders/batch?customer_id=, ordenado por order_id para la paginación
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS orders_customer_id_idx ON orders (customer_id, order_id)",
+            # /orders/batch?status=
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS orders_order_status_idx ON orders (order_status, order_id)",
+            # /clients/by_clerk en cada login; falla si ya hay clerkid duplicados
+            "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS client_clerkid_key ON client (clerkid)",
+        ],
+        transactional=False,
+    ),
+    Migration(
+        4,
+        "order_change_feed",
+        """
+        -- Cada cambio de un pedido (alta, estado, total por líneas agregadas/quitadas, baja) se publica en el canal
+        -- order_changed; cada worker tiene una sola conexión LISTEN que lo reparte a las pantallas conectadas.
+        CREATE OR REPLACE FUNCTION notify_order_changed() RETURNS trigger AS $$
+        DECLARE
+            changed orders%ROWTYPE;
+            event TEXT;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                changed := OLD;
+                event := 'deleted';
+            ELSIF TG_OP = 'INSERT' THEN
+                changed := NEW;
+                event := 'created';
+            ELSIF OLD.order_status IS DISTINCT FROM NEW.order_status THEN
+                changed := NEW;
+                event := 'status_changed';
+            ELSE
+                changed := NEW;
+                event := 'items_changed';
+            END IF;
+
+            PERFORM pg_notify(
+                'order_changed',
+                json_build_object(
+                    'event', event,
+                    'order_id', changed.order_id,
+                    'customer_id', changed.customer_id,
+                    'order_status', changed.order_status,
+                    'total_price', changed.total_price
+                )::text
+            );
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS orders_notify_changed ON orders;
+        CREATE TRIGGER orders_notify_changed
+            AFTER INSERT OR DELETE ON orders
+            FOR EACH ROW EXECUTE FUNCTION notify_order_changed();
+
+        DROP TRIGGER IF EXISTS orders_notify_updated ON orders;
+        CREATE TRIGGER orders_notify_updated
+            AFTER UPDATE OF order_status, total_price ON orders
+            FOR EACH ROW
+            WHEN (OLD.order_status IS DISTINCT FROM NEW.order_status OR OLD.total_price IS DISTINCT FROM NEW.total_price)
+            EXECUTE FUNCTION notify_order_changed();
+        """,
+    ),
+    Migration(
+        5,
+        "order_state_machine",
+        [
+            # delete_order borra el pedido con un solo DELETE condicionado a su estado; las líneas caen en cascada
+            # (incluidas las que otra petición haya agregado mientras tanto). NOT VALID + VALIDATE para no bloquear
+            # las escrituras mientras se revisa la tabla completa.
+            """
+            ALTER TABLE orderdetails
+                DROP CONSTRAINT IF EXISTS orderdetails_order_id_fkey,
+                ADD CONSTRAINT orderdetails_order_id_fkey
+                    FOREIGN KEY (order_id) REFERENCES orders (order_id) ON DELETE CASCADE NOT VALID
+            """,
+            "ALTER TABLE orderdetails VALIDATE CONSTRAINT orderdetails_order_id_fkey",
+            # Respuestas de las escrituras enviadas con Idempotency-Key
+            """
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                response JSONB,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idempotency_keys_created_at_idx ON idempotency_keys (created_at)",
+        ],
+        transactional=False,
+    ),
+    Migration(
+        6,
+        "sales_rollups",
+        """
+        -- Antes no se guardaba cuándo se entregó un pedido: el historial ya entregado queda con la fecha de la migración
+        ALTER TABLE orders ADD COLUMN IF NOT EXISTS delivered_at TIMESTAMPTZ;
+
+        UPDATE orders SET delivered_at = now() WHERE order_status = 'Entregado' AND delivered_at IS NULL;
+
+        -- Pedidos entregados que analytics.py todavía no suma a los rollups
+        CREATE TABLE IF NOT EXISTS sales_rollup_queue (
+            order_id INTEGER PRIMARY KEY
+        );
+
+        CREATE TABLE IF NOT EXISTS sales_daily (
+            day DATE PRIMARY KEY,
+            orders BIGINT NOT NULL,
+            revenue NUMERIC(14, 2) NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS item_sales_daily (
+            day DATE NOT NULL,
+            item_id INTEGER NOT NULL,
+            orders BIGINT NOT NULL,
+            quantity BIGINT NOT NULL,
+            revenue NUMERIC(14, 2) NOT NULL,
+            PRIMARY KEY (day, item_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS customer_sales (
+            customer_id INTEGER PRIMARY KEY,
+            orders BIGINT NOT NULL,
+            revenue NUMERIC(14, 2) NOT NULL,
+            first_order_at TIMESTAMPTZ NOT NULL,
+            last_order_at TIMESTAMPTZ NOT NULL
+        );
+
+        INSERT INTO sales_rollup_queue (order_id)
+        SELECT order_id FROM orders WHERE order_status = 'Entregado'
+        ON CONFLICT DO NOTHING;
+        """,
+    ),
+    Migration(
+        7,
+        "rate_limit_buckets",
+        """
+        -- Token buckets compartidos por los workers (RATE_LIMIT_BACKEND=postgres). UNLOGGED: tras una caída se
+        -- pierden y todos los buckets vuelven llenos, que es lo mismo que pasa al reiniciar con el backend en memoria
+        CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+            key TEXT PRIMARY KEY,
+            tokens DOUBLE PRECISION NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL
+        );
+
+        -- Devuelve 0 si tomó un token, o los segundos que faltan para el siguiente
+        CREATE OR REPLACE FUNCTION take_rate_limit_token(bucket_key TEXT, rate DOUBLE PRECISION, burst DOUBLE PRECISION)
+        RETURNS DOUBLE PRECISION AS $$
+        DECLARE
+            available DOUBLE PRECISION;
+        BEGIN
+            INSERT INTO rate_limit_buckets (key, tokens, updated_at) VALUES (bucket_key, burst, clock_timestamp())
+            ON CONFLICT (key) DO NOTHING;
+            SELECT LEAST(burst, tokens + EXTRACT(EPOCH FROM clock_timestamp() - updated_at) * rate) INTO available
+            FROM rate_limit_buckets WHERE key = bucket_key
+            FOR UPDATE;
+            IF available >= 1 THEN
+                UPDATE rate_limit_buckets SET tokens = available - 1, updated_at = clock_timestamp() WHERE key = bucket_key;
+                RETURN 0;
+            END IF;
+            UPDATE rate_limit_buckets SET tokens = available, updated_at = clock_timestamp() WHERE key = bucket_key;
+            RETURN (1 - available) / rate;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE INDEX IF NOT EXISTS rate_limit_buckets_updated_at_idx ON rate_limit_buckets (updated_at);
+        """,
+    ),
+    Migration(
+        8,
+        "order_archive",
+        [
+            # Historial frío: archive.py mueve aquí los pedidos entregados hace más de ARCHIVE_AFTER_DAYS, con sus
+            # líneas. Conservan su order_id y detail_id, así que las rutas los siguen encontrando por el mismo id.
+            """
+            CREATE TABLE IF NOT EXISTS orders_archive (
+                order_id INTEGER PRIMARY KEY,
+                customer_id INTEGER NOT NULL REFERENCES client (id),
+                order_status TEXT NOT NULL,
+                total_price NUMERIC(12, 2) NOT NULL,
+                delivered_at TIMESTAMPTZ,
+                archived_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS orders_archive_customer_id_idx ON orders_archive (customer_id, order_id)",
+            """
+            CREATE TABLE IF NOT EXISTS orderdetails_archive (
+                detail_id INTEGER PRIMARY KEY,
+                order_id INTEGER NOT NULL REFERENCES orders_archive (order_id) ON DELETE CASCADE,
+                item_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL,
+                unit_price NUMERIC(10, 2) NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS orderdetails_archive_order_id_idx ON orderdetails_archive (order_id)",
+            # Lecturas sobre pedidos calientes y archivados. Las condiciones por order_id o customer_id bajan a los
+            # índices de cada tabla, y un ORDER BY order_id DESC LIMIT n se resuelve con un Merge Append de ambos.
+            """
+            CREATE OR REPLACE VIEW orders_history AS
+                SELECT order_id, customer_id, order_status, total_price, delivered_at FROM orders
+                UNION ALL
+                SELECT order_id, customer_id, order_status, total_price, delivered_at FROM orders_archive
+            """,
+            """
+            CREATE OR REPLACE VIEW orderdetails_history AS
+                SELECT detail_id, order_id, item_id, quantity, unit_price FROM orderdetails
+                UNION ALL
+                SELECT detail_id, order_id, item_id, quantity, unit_price FROM orderdetails_archive
+            """,
+            # Sacar un pedido de orders al archivarlo no es una baja: el feed de cocina no debe enterarse
+            """
+            DROP TRIGGER IF EXISTS orders_notify_changed ON orders;
+            CREATE TRIGGER orders_notify_changed
+                AFTER INSERT OR DELETE ON orders
+                FOR EACH ROW
+                WHEN (current_setting('restaurant.archiving_orders', true) IS DISTINCT FROM 'on')
+                EXECUTE FUNCTION notify_order_changed()
+            """,
+            # Candidatos a archivar, del más viejo al más nuevo, sin recorrer los pedidos abiertos
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS orders_archivable_idx ON orders (delivered_at) WHERE order_status = 'Entregado'",
+        ],
+        transactional=False,
+    ),
+    Migration(
+        9,
+        "order_line_change_feed",
+        """
+        -- Los cambios de estado y de total ya se publican desde orders. Una línea que no mueve el total (producto con
+        -- precio 0) no toca la fila del pedido, así que se publica desde orderdetails; las demás ya cambian el total y
+        -- no se publican dos veces. Las líneas que se borran en cascada con su pedido (baja o archivo) no publican nada.
+        CREATE OR REPLACE FUNCTION notify_order_lines_changed() RETURNS trigger AS $$
+        DECLARE
+            line orderdetails%ROWTYPE;
+            changed orders%ROWTYPE;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                line := OLD;
+            ELSE
+                line := NEW;
+            END IF;
+
+            SELECT * INTO changed FROM orders WHERE order_id = line.order_id;
+            IF NOT FOUND THEN
+                RETURN NULL;
+            END IF;
+
+            PERFORM pg_notify(
+                'order_changed',
+                json_build_object(
+                    'event', 'items_changed',
+                    'order_id', changed.order_id,
+                    'customer_id', changed.customer_id,
+                    'order_status', changed.order_status,
+                    'total_price', changed.total_price
+                )::text
+            );
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS orderdetails_notify_inserted ON orderdetails;
+        CREATE TRIGGER orderdetails_notify_inserted
+            AFTER INSERT ON orderdetails
+            FOR EACH ROW
+            WHEN (COALESCE(NEW.unit_price * NEW.quantity, 0) = 0)
+            EXECUTE FUNCTION notify_order_lines_changed();
+
+        DROP TRIGGER IF EXISTS orderdetails_notify_deleted ON orderdetails;
+        CREATE TRIGGER orderdetails_notify_deleted
+            AFTER DELETE ON orderdetails
+            FOR EACH ROW
+            WHEN (COALESCE(OLD.unit_price * OLD.quantity, 0) = 0
+                  AND current_setting('restaurant.archiving_orders', true) IS DISTINCT FROM 'on')
+            EXECUTE FUNCTION notify_order_lines_changed();
+        """,
+    ),
+    Migration(
+        10,
+        "rebuild_invalid_indexes",
+        [
+            # Las bases donde la versión 3 u 8 falló a medias quedaron con el índice inválido y la versión aplicada;
+            # _run_autocommit los vuelve a construir y en las demás cada sentencia no hace nada
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS orderdetails_order_id_idx ON orderdetails (order_id)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS orderdetails_item_id_idx ON orderdetails (item_id)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS orders_customer_id_idx ON orders (customer_id, order_id)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS orders_order_status_idx ON orders (order_status, order_id)",
+            "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS client_clerkid_key ON client (clerkid)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS orders_archivable_idx ON orders (delivered_at) WHERE order_status = 'Entregado'",
+        ],
+        transactional=False,
+    ),
+    Migration(
+        11,
+        "quiet_order_feed_on_import",
+        """
+        -- Una importación masiva de pedidos (bulk.py) pone restaurant.importing_orders durante su transacción: sus filas
+        -- no se publican una por una y al confirmar se manda un solo resync
+        DROP TRIGGER IF EXISTS orders_notify_changed ON orders;
+        CREATE TRIGGER orders_notify_changed
+            AFTER INSERT OR DELETE ON orders
+            FOR EACH ROW
+            WHEN (current_setting('restaurant.archiving_orders', true) IS DISTINCT FROM 'on'
+                  AND current_setting('restaurant.importing_orders', true) IS DISTINCT FROM 'on')
+            EXECUTE FUNCTION notify_order_changed();
+
+        DROP TRIGGER IF EXISTS orderdetails_notify_inserted ON orderdetails;
+        CREATE TRIGGER orderdetails_notify_inserted
+            AFTER INSERT ON orderdetails
+            FOR EACH ROW
+            WHEN (COALESCE(NEW.unit_price * NEW.quantity, 0) = 0
+                  AND current_setting('restaurant.importing_orders', true) IS DISTINCT FROM 'on')
+            EXECUTE FUNCTION notify_order_lines_changed();
+        """,
+    ),
+]
+
+
+def applied_versions(db_connection):
+    with db_connection.cursor() as cursor:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            """
+        )
+        cursor.execute("SELECT version FROM schema_migrations")
+        versions = {row[0] for row in cursor.fetchall()}
+    db_connection.commit()
+    return versions
+
+
+# Un CREATE INDEX CONCURRENTLY que falla (por ejemplo, con clerkid duplicados) deja el índice creado pero inválido, y
+# al reintentar IF NOT EXISTS lo daría por hecho: antes se borra el inválido y después se comprueba que quedó válido
+CONCURRENT_INDEX = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+
+INDEX_IS_VALID = """
+    SELECT pg_index.indisvalid FROM pg_index
+    JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+    WHERE pg_class.relname = %s AND pg_class.relnamespace = current_schema()::regnamespace
+"""
+
+
+def _index_is_valid(cursor, index_name: str):
+    # None si el índice no existe
+    cursor.execute(INDEX_IS_VALID, (index_name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _run_autocommit(db_connection, statements):
+    db_connection.commit()
+    db_connection.autocommit = True
+    try:
+        with db_connection.cursor() as cursor:
+            for statement in statements:
+                index = CONCURRENT_INDEX.search(statement)
+                if index and _index_is_valid(cursor, index.group(1)) is False:
+                    cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index.group(1)}")
+                cursor.execute(statement)
+                if index and not _index_is_valid(cursor, index.group(1)):
+                    raise RuntimeError(f"Index {index.group(1)} is not valid after: {statement}")
+    finally:
+        db_connection.autocommit = False
+
+
+def migrate(db_connection, migrations=MIGRATIONS):
+    applied = []
+    with db_connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    try:
+        done = applied_versions(db_connection)
+        for version, name, statements, transactional in migrations:
+            if version in done:
+                continue
+            try:
+                if transactional:
+                    with db_connection.cursor() as cursor:
+                        cursor.execute(statements)
+                else:
+                    _run_autocommit(db_connection, statements)
+                with db_connection.cursor() as cursor:
+                    cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                db_connection.commit()
+            except Exception as e:
+                db_connection.rollback()
+                print(f"Error in migration {version} ({name}): {e}")
+                raise
+            applied.append(version)
+    finally:
+        with db_connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        db_connection.commit()
+    return applied
+
+
+def main():
+    conn = connect(DATABASE_URL)
+    try:
+        if "--status" in sys.argv:
+            done = applied_versions(conn)
+            for version, name, _, _ in MIGRATIONS:
+                print(f"{version:>4}  {name:<30} {'applied' if version in done else 'pending'}")
+            return
+        applied = migrate(conn)
+        print(f"Applied migrations: {applied}" if applied else "Schema is up to date")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
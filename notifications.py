@@ -0,0 +1,63 @@
+import select
+import threading
+import psycopg2
+
+
+class ChangeListener(threading.Thread):
+    # Una sola conexión por worker escucha los canales NOTIFY y reparte cada payload a su handler.
+    # on_reset se llama al (re)conectar, porque las notificaciones perdidas mientras no había conexión no se reenvían.
+    def __init__(self, dsn: str, handlers: dict, on_reset=None, poll_interval: float = 1.0, reconnect_delay: float = 2.0):
+        super().__init__(name="change-listener", daemon=True)
+        self.dsn = dsn
+        self.handlers = dict(handlers)
+        self.on_reset = on_reset
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+        self._stop_event = threading.Event()
+        # Se marca al quedar escuchando: lo que se cargue en caché después ya no se pierde con el primer on_reset
+        self.listening = threading.Event()
+
+    def wait_until_listening(self, timeout: float = None):
+        return self.listening.wait(timeout)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    for channel in self.handlers:
+                        cursor.execute(f'LISTEN "{channel}"')
+                self._reset()
+                self.listening.set()
+                self._listen(conn)
+            except Exception as e:
+                print(f"Error in ChangeListener: {e}")
+                self._reset()
+                self._stop_event.wait(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _listen(self, conn):
+        while not self._stop_event.is_set():
+            if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                handler = self.handlers.get(notify.channel)
+                if handler is None:
+                    continue
+                try:
+                    handler(notify.payload)
+                except Exception as e:
+                    print(f"Error handling notification on {notify.channel}: {e}")
+
+    def _reset(self):
+        if self.on_reset is not None:
+            self.on_reset()
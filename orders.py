@@ -1,182 +1,641 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import json
+from dataclasses import dataclass
+from decimal import Decimal
 from fastapi import HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from pagination import keyset_query, STREAM_CHUNK_SIZE
+from prepared import prepared
+from queries import columns, records, db_errors
 
 class OrderItem(BaseModel):
     detail_id: int
     order_id: int
     item_id: int
     quantity: int
+    unit_price: Optional[float] = None
 
 class OrderInfo(BaseModel):
     order_id: int
     customer_id: int
     order_status: str
+    total_price: Optional[float] = None
+
+# Registros con los mismos campos que OrderItem y OrderInfo: las listas se serializan directo de ellos, sin pasar
+# por el modelo
+@dataclass
+class OrderItemRecord:
+    detail_id: int
+    order_id: int
+    item_id: int
+    quantity: int
+    unit_price: Optional[Decimal]
+
+@dataclass
+class OrderInfoRecord:
+    order_id: int
+    customer_id: int
+    order_status: str
+    total_price: Optional[Decimal]
+
+ORDER_ITEM_COLUMNS = columns(OrderItemRecord)
+ORDER_INFO_COLUMNS = columns(OrderInfoRecord)
+
+# Las lecturas por pedido y por cliente van sobre orders_history y orderdetails_history, que suman a las tablas
+# calientes el historial que archive.py movió a orders_archive y orderdetails_archive
+ORDER_ITEMS = prepared(
+    "order_items", f"SELECT {ORDER_ITEM_COLUMNS} FROM orderdetails_history WHERE order_id = %s", "integer", record=OrderItemRecord
+)
+ORDER_TOTAL_PRICE = prepared("order_total_price", "SELECT total_price FROM orders_history WHERE order_id = %s", "integer")
+# Más recientes primero; before pagina hacia atrás (NULL: desde el último pedido) y un LIMIT NULL no limita
+CUSTOMER_ORDERS = prepared(
+    "customer_orders",
+    f"""
+    SELECT {ORDER_INFO_COLUMNS} FROM orders_history
+    WHERE customer_id = %s AND order_id < COALESCE(%s, 2147483647)
+    ORDER BY order_id DESC
+    LIMIT %s
+    """,
+    "integer", "integer", "bigint",
+    record=OrderInfoRecord,
+)
+
+class OrderLineDetail(BaseModel):
+    detail_id: int
+    item_id: int
+    name: Optional[str] = None
+    price: Optional[float] = None
+    quantity: int
+
+class OrderWithDetails(BaseModel):
+    order_id: int
+    customer_id: int
+    order_status: str
+    items: List[OrderLineDetail]
+    total_price: float
+
+class OrderTotalMismatch(BaseModel):
+    order_id: int
+    stored_total: float
+    computed_total: float
+
+# items llega ya decodificado del json_agg de ORDERS_WITH_DETAILS
+@dataclass
+class OrderDetailsRecord:
+    order_id: int
+    customer_id: int
+    order_status: str
+    items: list
+    total_price: Decimal
+
+@dataclass
+class OrderTotalMismatchRecord:
+    order_id: int
+    stored_total: Decimal
+    computed_total: Decimal
+
+class OrderLine(BaseModel):
+    item_id: int
+    quantity: int = Field(gt=0)
+
+class OrderCreate(BaseModel):
+    customer_id: int
+    items: List[OrderLine] = Field(min_length=1)
+
+def _missing_items(items: List[OrderLine], prices: dict):
+    return sorted({line.item_id for line in items if line.item_id not in prices})
+
+def _order_total(items: List[OrderLine], prices: dict):
+    return sum(prices[line.item_id] * line.quantity for line in items)
+
+def _order_lines(order_id: int, items: List[OrderLine], prices: dict):
+    return (
+        order_id,
+        [line.item_id for line in items],
+        [line.quantity for line in items],
+        [prices[line.item_id] for line in items],
+    )
+
+CUSTOMER_EXISTS = prepared("customer_exists", "SELECT 1 FROM client WHERE id = %s", "integer")
+INSERT_ORDER = prepared(
+    "insert_order", "INSERT INTO orders (customer_id, order_status) VALUES (%s, %s) RETURNING order_id", "integer", "text"
+)
+MENU_PRICES = prepared("menu_prices", "SELECT menu_id, price FROM menu WHERE menu_id = ANY(%s)", "integer[]")
+CREATE_ORDER = prepared(
+    "create_order",
+    "INSERT INTO orders (customer_id, order_status, total_price) SELECT id, %s, %s FROM client WHERE id = %s RETURNING order_id",
+    "text", "numeric", "integer",
+)
+
+# Inserta todas las líneas del pedido en un solo INSERT a partir de tres arreglos
+INSERT_ORDER_LINES = prepared("insert_order_lines", """
+    INSERT INTO orderdetails (order_id, item_id, quantity, unit_price)
+    SELECT %s, line.item_id, line.quantity, line.unit_price
+    FROM unnest(%s::int[], %s::int[], %s::numeric[]) AS line(item_id, quantity, unit_price)
+""", "integer", "integer[]", "integer[]", "numeric[]")
+
+# Máquina de estados del pedido: cada estado solo avanza al siguiente. Los productos se pueden agregar o quitar, y
+# el pedido cancelar, mientras no se haya entregado.
+ORDER_TRANSITIONS = {"En cola": "En proceso", "En proceso": "Entregado"}
+ORDER_STATUSES = ["En cola", "En proceso", "Entregado"]
+OPEN_STATUSES = ["En cola", "En proceso"]
+DELIVERED_STATUS = "Entregado"
+
+# Cada escritura es una sola sentencia condicionada al estado actual (compare-and-set): si otra terminal cambió el
+# pedido antes, la fila ya no cumple el WHERE y no se toca nada. Solo cuando no se afecta ninguna fila se consulta
+# ORDER_STATUS para explicar por qué (un pedido archivado responde como cualquier otro entregado).
+ORDER_STATUS = prepared("order_status", "SELECT order_status FROM orders_history WHERE order_id = %s", "integer")
+
+# Al entregarse, el pedido queda con su delivered_at y entra a la cola de analytics.py en la misma transacción
+ADVANCE_ORDER_STATUS = """
+    WITH advanced AS (
+        UPDATE orders SET
+            order_status = %(transitions)s::jsonb ->> order_status,
+            delivered_at = CASE WHEN %(transitions)s::jsonb ->> order_status = %(delivered)s THEN now() ELSE delivered_at END
+        WHERE order_id = %(order_id)s AND order_status = ANY(%(statuses)s)
+        RETURNING order_id, order_status
+    ), sold AS (
+        INSERT INTO sales_rollup_queue (order_id)
+        SELECT order_id FROM advanced WHERE order_status = %(delivered)s
+        ON CONFLICT DO NOTHING
+    )
+    SELECT order_status FROM advanced
+"""
+
+DELETE_OPEN_ORDER = prepared(
+    "delete_open_order", "DELETE FROM orders WHERE order_id = %s AND order_status = ANY(%s) RETURNING order_id", "integer", "text[]"
+)
+
+# orders.total_price es la suma de unit_price * quantity de sus líneas y se mantiene en cada escritura.
+# unit_price guarda el precio del menú al momento de agregar la línea. El UPDATE del total bloquea la fila del
+# pedido y verifica su estado antes de insertar la línea.
+ADD_ORDER_LINE = prepared("add_order_line", """
+    WITH line AS (
+        SELECT menu_id, price FROM menu WHERE menu_id = %s
+    ), opened AS (
+        UPDATE orders SET total_price = orders.total_price + line.price * %s
+        FROM line
+        WHERE orders.order_id = %s AND orders.order_status = ANY(%s)
+        RETURNING orders.order_id, line.menu_id, line.price
+    )
+    INSERT INTO orderdetails (order_id, item_id, quantity, unit_price)
+    SELECT order_id, menu_id, %s, price FROM opened
+    RETURNING detail_id
+""", "integer", "integer", "integer", "text[]", "integer")
+
+ORDER_AND_MENU_ITEM = prepared(
+    "order_and_menu_item",
+    "SELECT (SELECT order_status FROM orders_history WHERE order_id = %s), EXISTS (SELECT 1 FROM menu WHERE menu_id = %s)",
+    "integer", "integer",
+)
+
+# El pedido se bloquea primero; si dos peticiones quitan la misma línea, el DELETE de la segunda ya no la encuentra
+# y el total no se descuenta dos veces.
+REMOVE_ORDER_LINE = prepared("remove_order_line", """
+    WITH locked AS (
+        SELECT order_id FROM orders WHERE order_id = %s AND order_status = ANY(%s) FOR NO KEY UPDATE
+    ), removed AS (
+        DELETE FROM orderdetails USING locked
+        WHERE orderdetails.order_id = locked.order_id AND orderdetails.detail_id = %s
+        RETURNING orderdetails.order_id, orderdetails.unit_price * orderdetails.quantity AS amount
+    )
+    UPDATE orders SET total_price = orders.total_price - removed.amount
+    FROM removed
+    WHERE orders.order_id = removed.order_id
+    RETURNING orders.order_id
+""", "integer", "text[]", "integer")
+
+
+def _status_filter(from_status: str = None):
+    if from_status is None:
+        return list(ORDER_TRANSITIONS)
+    if from_status not in ORDER_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Unknown order status: {from_status}")
+    # Un estado final no tiene a dónde avanzar: no debe coincidir con ninguna fila
+    return [from_status] if from_status in ORDER_TRANSITIONS else []
+
+def _advance_params(order_id: int, from_status: str = None):
+    return {
+        "transitions": json.dumps(ORDER_TRANSITIONS),
+        "delivered": DELIVERED_STATUS,
+        "order_id": order_id,
+        "statuses": _status_filter(from_status),
+    }
+
+def _raise_for_state(current_status: str, action: str):
+    if current_status is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    raise HTTPException(status_code=400, detail=f"Cannot {action} order in the current state: {current_status}")
+
+def _advance_failed(current_status: str, from_status: str = None):
+    if current_status is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if from_status is not None and from_status != current_status:
+        raise HTTPException(status_code=409, detail=f"Order status is {current_status}, expected {from_status}")
+    return {"result": {"message": "Order has already been delivered", "order_status": current_status}}
+
+MISMATCHED_ORDER_TOTALS = """
+    SELECT orders.order_id, orders.total_price AS stored_total, COALESCE(computed.total_price, 0) AS computed_total
+    FROM orders
+    LEFT JOIN (
+        SELECT order_id, SUM(unit_price * quantity) AS total_price
+        FROM orderdetails
+        GROUP BY order_id
+    ) AS computed ON computed.order_id = orders.order_id
+    WHERE orders.total_price <> COALESCE(computed.total_price, 0)
+"""
+
+REBUILD_ORDER_TOTALS = f"""
+    UPDATE orders SET total_price = mismatched.computed_total
+    FROM ({MISMATCHED_ORDER_TOTALS}) AS mismatched
+    WHERE orders.order_id = mismatched.order_id
+"""
+
+# Política de precios: cuando cambia el precio de un producto del menú, solo se re-cotizan las líneas de
+# pedidos que siguen "En cola". Los pedidos "En proceso" o "Entregado" conservan el precio con que se pidieron.
+REPRICED_STATUSES = ["En cola"]
+
+REPRICE_OPEN_ORDER_LINES = prepared("reprice_open_order_lines", """
+    UPDATE orderdetails SET unit_price = %s
+    FROM orders
+    WHERE orders.order_id = orderdetails.order_id
+      AND orders.order_status = ANY(%s)
+      AND orderdetails.item_id = %s
+      AND orderdetails.unit_price <> %s
+    RETURNING orderdetails.order_id
+""", "numeric", "text[]", "integer", "numeric")
+
+REFRESH_ORDER_TOTALS = prepared("refresh_order_totals", """
+    UPDATE orders SET total_price = COALESCE(
+        (SELECT SUM(unit_price * quantity) FROM orderdetails WHERE orderdetails.order_id = orders.order_id), 0
+    )
+    WHERE order_id = ANY(%s)
+""", "integer[]")
+
+def _batch_filters(order_ids: List[int] = None, status: str = None, customer_id: int = None):
+    conditions = []
+    params = []
+    if order_ids:
+        conditions.append("order_id = ANY(%s)")
+        params.append(list(order_ids))
+    if status is not None:
+        conditions.append("order_status = %s")
+        params.append(status)
+    if customer_id is not None:
+        conditions.append("customer_id = %s")
+        params.append(customer_id)
+    return " AND ".join(conditions) or None, params
+
+# Pedidos con sus líneas, nombre/precio del menú y total en una sola consulta agregada. Con order_ids o customer_id
+# se lee de orders_history y orderdetails_history, como las demás lecturas por pedido y por cliente; solo por status
+# queda en las tablas calientes: es lo que recargan las pantallas de cocina y un pedido archivado ya está entregado.
+ORDERS_WITH_DETAILS = """
+    WITH selected AS ({selected})
+    SELECT
+        selected.order_id,
+        selected.customer_id,
+        selected.order_status,
+        COALESCE(
+            json_agg(
+                json_build_object(
+                    'detail_id', orderdetails.detail_id,
+                    'item_id', orderdetails.item_id,
+                    'name', menu.name,
+                    'price', orderdetails.unit_price,
+                    'quantity', orderdetails.quantity
+                ) ORDER BY orderdetails.detail_id
+            ) FILTER (WHERE orderdetails.detail_id IS NOT NULL),
+            '[]'
+        ) AS items,
+        selected.total_price
+    FROM selected
+    LEFT JOIN {orderdetails} AS orderdetails ON orderdetails.order_id = selected.order_id
+    LEFT JOIN menu ON menu.menu_id = orderdetails.item_id
+    GROUP BY selected.order_id, selected.customer_id, selected.order_status, selected.total_price
+    ORDER BY selected.order_id
+"""
+
+def orders_with_details_query(order_ids: List[int] = None, status: str = None, customer_id: int = None, limit: int = None, after: int = None):
+    where, params = _batch_filters(order_ids, status, customer_id)
+    history = order_ids is not None or customer_id is not None
+    orders, orderdetails = ("orders_history", "orderdetails_history") if history else ("orders", "orderdetails")
+    selected, params = keyset_query(f"SELECT {ORDER_INFO_COLUMNS} FROM {orders}", "order_id", limit, after, where, params)
+    return ORDERS_WITH_DETAILS.format(selected=selected, orderdetails=orderdetails), params
 
 class OrderManager:
     @staticmethod
-    def get_all_order_info(db_connection):
-        try:
-            with db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("SELECT * FROM orders")
-                orders = cursor.fetchall()
-            return orders
-        except Exception as e:
-            print(f"Error in get_all_order_info: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+    @db_errors
+    def get_all_order_info(db_connection, limit: int = None, after: int = None):
+        with db_connection.cursor() as cursor:
+            cursor.execute(*keyset_query(f"SELECT {ORDER_INFO_COLUMNS} FROM orders", "order_id", limit, after))
+            return records(cursor.fetchall(), OrderInfoRecord)
+
+    @staticmethod
+    @db_errors
+    def stream_all_order_info(db_connection, chunk_size: int = STREAM_CHUNK_SIZE):
+        # Cursor del lado del servidor: solo hay un bloque de filas en memoria a la vez
+        with db_connection.cursor(name="stream_all_order_info") as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(f"SELECT {ORDER_INFO_COLUMNS} FROM orders ORDER BY order_id")
+            while True:
+                orders = cursor.fetchmany(chunk_size)
+                if not orders:
+                    break
+                yield records(orders, OrderInfoRecord)
 
     @staticmethod
+    @db_errors
     def get_order_details(db_connection, order_id: int):
-        try:
-            with db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("SELECT * FROM orderdetails WHERE order_id = %s", (order_id,))
-                order_details = cursor.fetchall()
-            return order_details
-        except Exception as e:
-            print(f"Error in get_order_details: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+        with db_connection.cursor() as cursor:
+            return ORDER_ITEMS.fetch_all(cursor, (order_id,))
 
     @staticmethod
+    @db_errors
     def read_order_total_price(db_connection, order_id: int):
-        try:
-            with db_connection.cursor() as cursor:
-                cursor.execute(
-                    """
-                    SELECT SUM(menu.price * orderdetails.quantity) AS total_price
-                    FROM orders
-                    JOIN orderdetails ON orders.order_id = orderdetails.order_id
-                    JOIN menu ON orderdetails.item_id = menu.menu_id
-                    WHERE orders.order_id = %s
-                    """,
-                    (order_id,),
-                )
-                result = cursor.fetchone()
-                total_price = result["total_price"] if result["total_price"] is not None else 0
-            return {"order_id": order_id, "total_price": total_price}
-        except Exception as e:
-            print(f"Error in read_order_total_price: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+        with db_connection.cursor() as cursor:
+            result = ORDER_TOTAL_PRICE.fetch_one(cursor, (order_id,))
+        return {"order_id": order_id, "total_price": result[0] if result else 0}
 
     @staticmethod
-    def add_order(db_connection, customer_id: int):
-        try:
-            with db_connection.cursor() as cursor:
-                cursor.execute("SELECT * FROM client WHERE id = %s", (customer_id,))
-                customer_exists = cursor.fetchone()
+    @db_errors
+    def verify_order_totals(db_connection, limit: int = 100):
+        with db_connection.cursor() as cursor:
+            cursor.execute(MISMATCHED_ORDER_TOTALS + " ORDER BY orders.order_id LIMIT %s", (limit,))
+            return records(cursor.fetchall(), OrderTotalMismatchRecord)
 
-                if not customer_exists:
-                    raise HTTPException(status_code=404, detail="Customer not found")
+    @staticmethod
+    @db_errors
+    def rebuild_order_totals(db_connection):
+        with db_connection.cursor() as cursor:
+            cursor.execute(REBUILD_ORDER_TOTALS)
+            rebuilt = cursor.rowcount
+        db_connection.commit()
 
-                cursor.execute("INSERT INTO orders (customer_id, order_status) VALUES (%s, %s) RETURNING order_id", (customer_id, "En cola"))
-                new_order_id = cursor.fetchone()[0]
-                db_connection.commit()
+        return {"result": {"message": "Order totals rebuilt successfully", "orders_fixed": rebuilt}}
 
-                return {"result": {"message": "Order added successfully", "order_id": new_order_id}}
-        except HTTPException as http_error:
-            # Re-raise HTTPException to be handled by FastAPI
-            raise http_error
-        except Exception as e:
-            print(f"Error in add_order: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+    @staticmethod
+    @db_errors
+    def get_orders_with_details(
+        db_connection, order_ids: List[int] = None, status: str = None,
+        customer_id: int = None, limit: int = None, after: int = None
+    ):
+        with db_connection.cursor() as cursor:
+            cursor.execute(*orders_with_details_query(order_ids, status, customer_id, limit, after))
+            return records(cursor.fetchall(), OrderDetailsRecord)
+
+    @staticmethod
+    @db_errors
+    def add_order(db_connection, customer_id: int):
+        with db_connection.cursor() as cursor:
+            if not CUSTOMER_EXISTS.fetch_one(cursor, (customer_id,)):
+                raise HTTPException(status_code=404, detail="Customer not found")
+
+            new_order_id = INSERT_ORDER.fetch_one(cursor, (customer_id, "En cola"))[0]
+            db_connection.commit()
+
+            return {"result": {"message": "Order added successfully", "order_id": new_order_id}}
 
     @staticmethod
-    def change_order_status(db_connection, order_id: int):
-        try:
-            with db_connection.cursor() as cursor:
-                cursor.execute("SELECT order_status FROM orders WHERE order_id = %s", (order_id,))
-                current_status_tuple = cursor.fetchone()
+    @db_errors
+    def create_order_with_items(db_connection, customer_id: int, items: List[OrderLine]):
+        with db_connection.cursor() as cursor:
+            prices = dict(MENU_PRICES.fetch_all(cursor, (list({line.item_id for line in items}),)))
 
-                if not current_status_tuple:
-                    raise HTTPException(status_code=404, detail="Order not found")
+            missing = _missing_items(items, prices)
+            if missing:
+                raise HTTPException(status_code=404, detail=f"Menu items not found: {missing}")
 
-                current_status = current_status_tuple[0]  # Access the first (and only) element in the tuple
+            total_price = _order_total(items, prices)
+            new_order = CREATE_ORDER.fetch_one(cursor, ("En cola", total_price, customer_id))
 
-                if current_status == "En cola":
-                    new_status = "En proceso"
-                elif current_status == "En proceso":
-                    new_status = "Entregado"
-                else:
-                    return {"result": {"message": "Order has already been delivered"}}
+            if not new_order:
+                raise HTTPException(status_code=404, detail="Customer not found")
 
-                cursor.execute("UPDATE orders SET order_status = %s WHERE order_id = %s", (new_status, order_id))
-                db_connection.commit()
+            new_order_id = new_order[0]
+            INSERT_ORDER_LINES.execute(cursor, _order_lines(new_order_id, items, prices))
+        db_connection.commit()
 
-            return {"result": {"message": "Order status changed successfully"}}
-        except psycopg2.Error as db_error:
-            print(f"Database error in change_order_status: {db_error}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
-        except Exception as e:
-            print(f"Error in change_order_status: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+        return {"result": {"message": "Order created successfully", "order_id": new_order_id, "total_price": total_price}}
 
+    @staticmethod
+    @db_errors
+    def change_order_status(db_connection, order_id: int, from_status: str = None):
+        with db_connection.cursor() as cursor:
+            cursor.execute(ADVANCE_ORDER_STATUS, _advance_params(order_id, from_status))
+            advanced = cursor.fetchone()
 
+            if not advanced:
+                current = ORDER_STATUS.fetch_one(cursor, (order_id,))
+                db_connection.rollback()
+                return _advance_failed(current and current[0], from_status)
+        db_connection.commit()
+
+        return {"result": {"message": "Order status changed successfully", "order_status": advanced[0]}}
 
     @staticmethod
+    @db_errors
     def add_items_to_order(db_connection, order_id: int, item_id: int, quantity: int):
-        try:
-            with db_connection.cursor() as cursor:
-                cursor.execute("SELECT * FROM menu WHERE menu_id = %s", (item_id,))
-                menu_item = cursor.fetchone()
+        with db_connection.cursor() as cursor:
+            added = ADD_ORDER_LINE.fetch_one(cursor, (item_id, quantity, order_id, OPEN_STATUSES, quantity))
 
-                if not menu_item:
+            if not added:
+                current_status, item_exists = ORDER_AND_MENU_ITEM.fetch_one(cursor, (order_id, item_id))
+                db_connection.rollback()
+                if not item_exists:
                     raise HTTPException(status_code=404, detail="Menu item not found")
+                _raise_for_state(current_status, "add items to")
+        db_connection.commit()
 
-                cursor.execute("INSERT INTO orderdetails (order_id, item_id, quantity) VALUES (%s, %s, %s)", (order_id, item_id, quantity))
-            db_connection.commit()
-
-            return {"result": {"message": "Items added to order successfully"}}
-        except Exception as e:
-            print(f"Error: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+        return {"result": {"message": "Items added to order successfully", "detail_id": added[0]}}
 
     @staticmethod
+    @db_errors
     def delete_order(db_connection, order_id: int):
-        try:
-            with db_connection.cursor() as cursor:
-                cursor.execute("SELECT order_status FROM orders WHERE order_id = %s", (order_id,))
-                order_status_result = cursor.fetchone()
+        with db_connection.cursor() as cursor:
+            # Las líneas se borran por el ON DELETE CASCADE de orderdetails
+            if not DELETE_OPEN_ORDER.fetch_one(cursor, (order_id, OPEN_STATUSES)):
+                current = ORDER_STATUS.fetch_one(cursor, (order_id,))
+                db_connection.rollback()
+                _raise_for_state(current and current[0], "delete")
+        db_connection.commit()
 
-                print(f"order_status_result: {order_status_result}")  # Add this line for debugging
+        return {"result": {"message": "Order and details deleted successfully"}}
 
-                if not order_status_result:
-                    raise HTTPException(status_code=404, detail="Order not found")
+    @staticmethod
+    @db_errors
+    def remove_item_from_order(db_connection, order_id: int, detail_id: int):
+        with db_connection.cursor() as cursor:
+            if not REMOVE_ORDER_LINE.fetch_one(cursor, (order_id, OPEN_STATUSES, detail_id)):
+                current = ORDER_STATUS.fetch_one(cursor, (order_id,))
+                db_connection.rollback()
+                if current and current[0] in OPEN_STATUSES:
+                    raise HTTPException(status_code=404, detail="Order item not found")
+                _raise_for_state(current and current[0], "remove items from")
+        db_connection.commit()
 
-                order_status = order_status_result[0] if order_status_result else None  # Access the first (and only) element in the tuple if it exists
+        return {"result": {"message": "Item removed from order successfully"}}
 
-                if order_status not in ["En cola", "En proceso"]:
-                    raise HTTPException(status_code=400, detail=f"Cannot delete order in the current state: {order_status}")
+    @staticmethod
+    @db_errors
+    def get_orders_by_customer_id(db_connection, customer_id: int, limit: int = None, before: int = None):
+        with db_connection.cursor() as cursor:
+            return CUSTOMER_ORDERS.fetch_all(cursor, (customer_id, before, limit))
 
-                cursor.execute("DELETE FROM orderdetails WHERE order_id = %s", (order_id,))
-                cursor.execute("DELETE FROM orders WHERE order_id = %s", (order_id,))
-            db_connection.commit()
 
-            return {"result": {"message": "Order and details deleted successfully"}}
-        except Exception as e:
-            print(f"Error in delete_order: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+class AsyncOrderManager:
+    @staticmethod
+    @db_errors
+    async def get_all_order_info(db_connection, limit: int = None, after: int = None):
+        async with db_connection.cursor() as cursor:
+            await cursor.execute(*keyset_query(f"SELECT {ORDER_INFO_COLUMNS} FROM orders", "order_id", limit, after))
+            return records(await cursor.fetchall(), OrderInfoRecord)
 
+    @staticmethod
+    @db_errors
+    async def stream_all_order_info(db_connection, chunk_size: int = STREAM_CHUNK_SIZE):
+        async with db_connection.cursor(name="stream_all_order_info") as cursor:
+            cursor.itersize = chunk_size
+            await cursor.execute(f"SELECT {ORDER_INFO_COLUMNS} FROM orders ORDER BY order_id")
+            while True:
+                orders = await cursor.fetchmany(chunk_size)
+                if not orders:
+                    break
+                yield records(orders, OrderInfoRecord)
 
     @staticmethod
-    def remove_item_from_order(db_connection, order_id: int, detail_id: int):
-        try:
-            with db_connection.cursor() as cursor:
-                cursor.execute("DELETE FROM orderdetails WHERE order_id = %s AND detail_id = %s", (order_id, detail_id))
-            db_connection.commit()
+    @db_errors
+    async def get_order_details(db_connection, order_id: int):
+        async with db_connection.cursor() as cursor:
+            return await ORDER_ITEMS.fetch_all_async(cursor, (order_id,))
+
+    @staticmethod
+    @db_errors
+    async def read_order_total_price(db_connection, order_id: int):
+        async with db_connection.cursor() as cursor:
+            result = await ORDER_TOTAL_PRICE.fetch_one_async(cursor, (order_id,))
+        return {"order_id": order_id, "total_price": result[0] if result else 0}
+
+    @staticmethod
+    @db_errors
+    async def verify_order_totals(db_connection, limit: int = 100):
+        async with db_connection.cursor() as cursor:
+            await cursor.execute(MISMATCHED_ORDER_TOTALS + " ORDER BY orders.order_id LIMIT %s", (limit,))
+            return records(await cursor.fetchall(), OrderTotalMismatchRecord)
+
+    @staticmethod
+    @db_errors
+    async def rebuild_order_totals(db_connection):
+        async with db_connection.cursor() as cursor:
+            await cursor.execute(REBUILD_ORDER_TOTALS)
+            rebuilt = cursor.rowcount
+        await db_connection.commit()
+
+        return {"result": {"message": "Order totals rebuilt successfully", "orders_fixed": rebuilt}}
+
+    @staticmethod
+    @db_errors
+    async def get_orders_with_details(
+        db_connection, order_ids: List[int] = None, status: str = None,
+        customer_id: int = None, limit: int = None, after: int = None
+    ):
+        async with db_connection.cursor() as cursor:
+            await cursor.execute(*orders_with_details_query(order_ids, status, customer_id, limit, after))
+            return records(await cursor.fetchall(), OrderDetailsRecord)
+
+    @staticmethod
+    @db_errors
+    async def add_order(db_connection, customer_id: int):
+        async with db_connection.cursor() as cursor:
+            if not await CUSTOMER_EXISTS.fetch_one_async(cursor, (customer_id,)):
+                raise HTTPException(status_code=404, detail="Customer not found")
+
+            new_order_id = (await INSERT_ORDER.fetch_one_async(cursor, (customer_id, "En cola")))[0]
+            await db_connection.commit()
 
-            return {"result": {"message": "Item removed from order successfully"}}
-        except Exception as e:
-            print(f"Error: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
-
-    # Inside OrderManager class
-    @staticmethod
-    def get_orders_by_customer_id(db_connection, customer_id: int):
-        try:
-            with db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("SELECT * FROM orders WHERE customer_id = %s", (customer_id,))
-                orders = cursor.fetchall()
-            return orders
-        except Exception as e:
-            print(f"Error in get_orders_by_customer_id: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
\ No newline at end of file
+            return {"result": {"message": "Order added successfully", "order_id": new_order_id}}
+
+    @staticmethod
+    @db_errors
+    async def create_order_with_items(db_connection, customer_id: int, items: List[OrderLine]):
+        async with db_connection.cursor() as cursor:
+            prices = dict(await MENU_PRICES.fetch_all_async(cursor, (list({line.item_id for line in items}),)))
+
+            missing = _missing_items(items, prices)
+            if missing:
+                raise HTTPException(status_code=404, detail=f"Menu items not found: {missing}")
+
+            total_price = _order_total(items, prices)
+            new_order = await CREATE_ORDER.fetch_one_async(cursor, ("En cola", total_price, customer_id))
+
+            if not new_order:
+                raise HTTPException(status_code=404, detail="Customer not found")
+
+            new_order_id = new_order[0]
+            await INSERT_ORDER_LINES.execute_async(cursor, _order_lines(new_order_id, items, prices))
+        await db_connection.commit()
+
+        return {"result": {"message": "Order created successfully", "order_id": new_order_id, "total_price": total_price}}
+
+    @staticmethod
+    @db_errors
+    async def change_order_status(db_connection, order_id: int, from_status: str = None):
+        async with db_connection.cursor() as cursor:
+            await cursor.execute(ADVANCE_ORDER_STATUS, _advance_params(order_id, from_status))
+            advanced = await cursor.fetchone()
+
+            if not advanced:
+                current = await ORDER_STATUS.fetch_one_async(cursor, (order_id,))
+                await db_connection.rollback()
+                return _advance_failed(current and current[0], from_status)
+        await db_connection.commit()
+
+        return {"result": {"message": "Order status changed successfully", "order_status": advanced[0]}}
+
+    @staticmethod
+    @db_errors
+    async def add_items_to_order(db_connection, order_id: int, item_id: int, quantity: int):
+        async with db_connection.cursor() as cursor:
+            added = await ADD_ORDER_LINE.fetch_one_async(cursor, (item_id, quantity, order_id, OPEN_STATUSES, quantity))
+
+            if not added:
+                current_status, item_exists = await ORDER_AND_MENU_ITEM.fetch_one_async(cursor, (order_id, item_id))
+                await db_connection.rollback()
+                if not item_exists:
+                    raise HTTPException(status_code=404, detail="Menu item not found")
+                _raise_for_state(current_status, "add items to")
+        await db_connection.commit()
+
+        return {"result": {"message": "Items added to order successfully", "detail_id": added[0]}}
+
+    @staticmethod
+    @db_errors
+    async def delete_order(db_connection, order_id: int):
+        async with db_connection.cursor() as cursor:
+            # Las líneas se borran por el ON DELETE CASCADE de orderdetails
+            if not await DELETE_OPEN_ORDER.fetch_one_async(cursor, (order_id, OPEN_STATUSES)):
+                current = await ORDER_STATUS.fetch_one_async(cursor, (order_id,))
+                await db_connection.rollback()
+                _raise_for_state(current and current[0], "delete")
+        await db_connection.commit()
+
+        return {"result": {"message": "Order and details deleted successfully"}}
+
+    @staticmethod
+    @db_errors
+    async def remove_item_from_order(db_connection, order_id: int, detail_id: int):
+        async with db_connection.cursor() as cursor:
+            if not await REMOVE_ORDER_LINE.fetch_one_async(cursor, (order_id, OPEN_STATUSES, detail_id)):
+                current = await ORDER_STATUS.fetch_one_async(cursor, (order_id,))
+                await db_connection.rollback()
+                if current and current[0] in OPEN_STATUSES:
+                    raise HTTPException(status_code=404, detail="Order item not found")
+                _raise_for_state(current and current[0], "remove items from")
+        await db_connection.commit()
+
+        return {"result": {"message": "Item removed from order successfully"}}
+
+    @staticmethod
+    @db_errors
+    async def get_orders_by_customer_id(db_connection, customer_id: int, limit: int = None, before: int = None):
+        async with db_connection.cursor() as cursor:
+            return await CUSTOMER_ORDERS.fetch_all_async(cursor, (customer_id, before, limit))
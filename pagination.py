@@ -0,0 +1,69 @@
+import os
+from decimal import Decimal
+import orjson
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", "1000"))
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", "1000"))
+
+
+def keyset_query(select: str, key: str, limit: int = None, after=None, where: str = None, params=()):
+    # Paginación por llave: WHERE key > after ORDER BY key LIMIT n, estable aunque se inserten filas
+    conditions = [where] if where else []
+    params = list(params)
+    if after is not None:
+        conditions.append(f"{key} > %s")
+        params.append(after)
+    query = select
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += f" ORDER BY {key}"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, tuple(params)
+
+
+def set_next_cursor(response: Response, rows, key: str, limit: int = None, header: str = "X-Next-After"):
+    # X-Next-Before en las listas que van de la más reciente a la más vieja
+    if limit is not None and len(rows) == limit:
+        response.headers[header] = str(getattr(rows[-1], key))
+
+
+def _default(value):
+    # Lo que orjson no serializa solo; NUMERIC llega como Decimal y los modelos lo declaran float
+    if isinstance(value, Decimal):
+        return float(value)
+    return jsonable_encoder(value)
+
+
+def dumps(value):
+    return orjson.dumps(value, default=_default, option=orjson.OPT_UTC_Z)
+
+
+def json_response(value, status_code: int = 200):
+    # Los registros ya tienen exactamente los campos del response_model de la ruta (ver *Record en los managers), así
+    # que se serializan directo sin validar un modelo por fila; el esquema de OpenAPI sigue saliendo del response_model
+    return Response(content=dumps(value), status_code=status_code, media_type="application/json")
+
+
+def encode_ndjson(chunk):
+    return b"".join(dumps(row) + b"\n" for row in chunk)
+
+
+class JsonArrayEncoder:
+    def __init__(self):
+        self.first = True
+
+    def __call__(self, chunk):
+        if not chunk:
+            return b""
+        body = b",".join(dumps(row) for row in chunk)
+        if self.first:
+            self.first = False
+            return b"[" + body
+        return b"," + body
+
+    def close(self):
+        return b"[]" if self.first else b"]"
@@ -0,0 +1,112 @@
+# Sentencias preparadas para las consultas más frecuentes de los managers. Cada conexión de los pools las prepara una
+# sola vez al conectarse (PREPARE), así que esas lecturas ya no pasan por el parser ni por el planner en cada petición.
+# Las conexiones que no salen de los pools (CLI, benchmarks) o que no pudieron prepararlas ejecutan el SQL normal.
+# Con record, fetch_one/fetch_all devuelven registros de queries.py en vez de tuplas.
+#
+#   DB_PREPARE_STATEMENTS=0 uvicorn main:app   desactiva las sentencias preparadas
+import os
+import re
+from psycopg import sql
+from queries import records, record_or_none
+
+PREPARE_STATEMENTS = os.environ.get("DB_PREPARE_STATEMENTS", "1") == "1"
+
+_PLACEHOLDER = re.compile(r"%s")
+
+
+class PreparedQuery:
+    __slots__ = ("name", "sql", "types", "record")
+
+    def __init__(self, name: str, query: str, types, record=None):
+        self.name = name
+        self.sql = query
+        self.types = tuple(types)
+        self.record = record
+
+    @property
+    def prepare_sql(self):
+        numbers = iter(range(1, len(self.types) + 1))
+        body = _PLACEHOLDER.sub(lambda _: f"${next(numbers)}", self.sql)
+        return f"PREPARE {self.name} ({', '.join(self.types)}) AS {body}"
+
+    @property
+    def execute_sql(self):
+        return f"EXECUTE {self.name} ({', '.join(['%s'] * len(self.types))})"
+
+    def execute(self, cursor, params):
+        # psycopg2 interpola los parámetros del lado del cliente, así que EXECUTE nombre (%s) funciona tal cual
+        if getattr(cursor.connection, "prepared", False):
+            cursor.execute(self.execute_sql, params)
+        else:
+            cursor.execute(self.sql, params)
+
+    async def execute_async(self, cursor, params):
+        # psycopg 3 manda los parámetros aparte y EXECUTE no los acepta: se componen como literales
+        if getattr(cursor.connection, "prepared", False):
+            placeholders = sql.SQL(", ").join(sql.Literal(param) for param in params)
+            await cursor.execute(sql.SQL("EXECUTE {} ({})").format(sql.Identifier(self.name), placeholders))
+        else:
+            await cursor.execute(self.sql, params)
+
+    def _decode_one(self, row):
+        return row if self.record is None else record_or_none(row, self.record)
+
+    def _decode_all(self, rows):
+        return rows if self.record is None else records(rows, self.record)
+
+    def fetch_one(self, cursor, params):
+        self.execute(cursor, params)
+        return self._decode_one(cursor.fetchone())
+
+    def fetch_all(self, cursor, params):
+        self.execute(cursor, params)
+        return self._decode_all(cursor.fetchall())
+
+    async def fetch_one_async(self, cursor, params):
+        await self.execute_async(cursor, params)
+        return self._decode_one(await cursor.fetchone())
+
+    async def fetch_all_async(self, cursor, params):
+        await self.execute_async(cursor, params)
+        return self._decode_all(await cursor.fetchall())
+
+
+PREPARED_QUERIES = {}
+
+
+def prepared(name: str, query: str, *types, record=None):
+    query = PreparedQuery(name, query, types, record)
+    PREPARED_QUERIES[name] = query
+    return query
+
+
+def prepare_connection(db_connection):
+    # Una base sin migrar (o una tabla que cambió) no debe impedir conectarse: la conexión queda sin preparar
+    if not PREPARE_STATEMENTS:
+        return
+    try:
+        with db_connection.cursor() as cursor:
+            for query in PREPARED_QUERIES.values():
+                cursor.execute(query.prepare_sql)
+        db_connection.commit()
+        db_connection.prepared = True
+    except Exception as e:
+        db_connection.rollback()
+        print(f"Error in prepare_connection: {e}")
+
+
+async def prepare_async_connection(db_connection):
+    if not PREPARE_STATEMENTS:
+        return
+    # psycopg 3 prepara solo las consultas que se repiten y, en cada ROLLBACK de una conexión con alguna de esas,
+    # manda DEALLOCATE ALL, que también borraría las de aquí: la conexión quedaría marcada como preparada sin estarlo
+    db_connection.prepare_threshold = None
+    try:
+        async with db_connection.cursor() as cursor:
+            for query in PREPARED_QUERIES.values():
+                await cursor.execute(query.prepare_sql)
+        await db_connection.commit()
+        db_connection.prepared = True
+    except Exception as e:
+        await db_connection.rollback()
+        print(f"Error in prepare_async_connection: {e}")
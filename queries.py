@@ -0,0 +1,116 @@
+# Capa de datos compartida por los managers (menú, pedidos, clientes, analítica, archivo e importaciones, y sus
+# versiones async):
+#   - cada lectura trae una lista explícita de columnas, derivada del registro que la decodifica (columns)
+#   - las filas llegan como tuplas y se convierten en registros (records / record_or_none): dataclasses que pesan menos
+#     de la mitad que un dict por fila y que orjson serializa directo. Sin __slots__: con orjson 3.8 en Python 3.11,
+#     benchmarks/serialization.py (1000 filas) mide 1.0 us/fila en /orders/all_info con los registros actuales contra
+#     2.3 us/fila con slots=True (0.2 contra 1.0 en /clients/all_info) y un ahorro de 40 a 120 bytes por fila, que
+#     no compensa en respuestas que se serializan y se descartan enseguida
+#   - db_errors reemplaza el try/print/HTTPException de cada método y traduce los errores de la base siempre igual
+#
+#   python -m benchmarks.queries --dsn postgres://localhost/restaurant_bench --rows 10000
+import functools
+import inspect
+from dataclasses import fields
+from fastapi import HTTPException
+
+# SQLSTATE -> (status, detail). Cualquier otro error de la base o del código es un 500.
+DB_ERROR_STATUS = {
+    "23505": (409, "Conflict with an existing record"),  # unique_violation
+    "23503": (409, "Conflict with a related record"),  # foreign_key_violation
+    "40001": (503, "Service Unavailable"),  # serialization_failure
+    "40P01": (503, "Service Unavailable"),  # deadlock_detected
+    "55P03": (503, "Service Unavailable"),  # lock_not_available
+    "57014": (503, "Service Unavailable"),  # query_canceled (statement_timeout)
+}
+RETRY_AFTER_SECONDS = 1
+
+
+def columns(record):
+    return ", ".join(field.name for field in fields(record))
+
+
+def records(rows, record):
+    return [record(*row) for row in rows]
+
+
+def record_or_none(row, record):
+    return None if row is None else record(*row)
+
+
+def _sqlstate(error):
+    # psycopg 3 lo expone como sqlstate y psycopg2 como pgcode
+    return getattr(error, "sqlstate", None) or getattr(error, "pgcode", None)
+
+
+def http_error(operation: str, error: Exception):
+    print(f"Error in {operation}: {error}")
+    status_code, detail = DB_ERROR_STATUS.get(_sqlstate(error), (500, "Internal Server Error"))
+    headers = {"Retry-After": str(RETRY_AFTER_SECONDS)} if status_code == 503 else None
+    return HTTPException(status_code=status_code, detail=detail, headers=headers)
+
+
+def stream_errors(method):
+    # Para los streams que escriben en un objeto en vez de ser generadores (COPY de psycopg2): igual que los streams de
+    # db_errors, el error solo se registra y se vuelve a lanzar
+    operation = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except Exception as e:
+            print(f"Error in {operation}: {e}")
+            raise
+    return wrapper
+
+
+def db_errors(method):
+    # Las HTTPException del propio método pasan tal cual. En los streams la respuesta ya empezó: el error solo se
+    # registra y se vuelve a lanzar para que se corte la conexión.
+    operation = method.__name__
+
+    if inspect.isasyncgenfunction(method):
+        @functools.wraps(method)
+        async def stream_wrapper(*args, **kwargs):
+            chunks = method(*args, **kwargs)
+            try:
+                async for chunk in chunks:
+                    yield chunk
+            except Exception as e:
+                print(f"Error in {operation}: {e}")
+                raise
+            finally:
+                await chunks.aclose()
+        return stream_wrapper
+
+    if inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def sync_stream_wrapper(*args, **kwargs):
+            try:
+                yield from method(*args, **kwargs)
+            except Exception as e:
+                print(f"Error in {operation}: {e}")
+                raise
+        return sync_stream_wrapper
+
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(*args, **kwargs):
+            try:
+                return await method(*args, **kwargs)
+            except HTTPException:
+                raise
+            except Exception as e:
+                raise http_error(operation, e) from e
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise http_error(operation, e) from e
+    return wrapper
@@ -0,0 +1,246 @@
+# Ruteo de lecturas a réplicas. Un hilo por worker revisa cada REPLICA_CHECK_INTERVAL que cada réplica siga en
+# recovery y qué tan atrasada va respecto al WAL del primario; las que fallan o pasan REPLICA_MAX_LAG_SECONDS /
+# REPLICA_MAX_LAG_BYTES salen de la rotación hasta que se pongan al día. Después de una escritura exitosa el cliente
+# recibe una cookie que lo fija al primario READ_PIN_SECONDS, para que lea lo que acaba de escribir.
+#
+# Para probar en local con dos instancias:
+#   pg_basebackup -h localhost -p 5432 -D /tmp/replica -R -X stream && pg_ctl -D /tmp/replica -o "-p 5433" start
+#   DATABASE_REPLICA_URLS=postgres://localhost:5433/restaurant READ_PIN_COOKIE_SECURE=0 uvicorn main:app
+#   SELECT pg_wal_replay_pause();   (en la réplica) la saca de rotación al pasar REPLICA_MAX_LAG_SECONDS
+import itertools
+import os
+import threading
+import time
+from collections import deque
+import psycopg2
+from psycopg2.extensions import parse_dsn
+
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_MAX_LAG_BYTES = int(os.environ.get("REPLICA_MAX_LAG_BYTES", str(16 * 1024 * 1024)))
+REPLICA_CHECK_INTERVAL = float(os.environ.get("REPLICA_CHECK_INTERVAL", "1"))
+READ_PIN_SECONDS = float(os.environ.get("READ_PIN_SECONDS", "5"))
+# El front está en otro dominio, así que la cookie tiene que ser SameSite=None; Secure (0 para probar sobre http)
+READ_PIN_COOKIE_SECURE = os.environ.get("READ_PIN_COOKIE_SECURE", "1") == "1"
+READ_PIN_COOKIE = "db_primary_until"
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+REPLICA_STATUS = """
+    SELECT pg_is_in_recovery(), pg_last_wal_replay_lsn()::text
+"""
+
+
+def parse_lsn(lsn: str):
+    high, low = lsn.split("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+def describe_dsn(dsn: str):
+    # Para stats y logs, sin la contraseña
+    params = parse_dsn(dsn)
+    return f"{params.get('host', 'localhost')}:{params.get('port', '5432')}/{params.get('dbname', '')}"
+
+
+class ReplicaStatus:
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.name = describe_dsn(dsn)
+        self.healthy = False
+        self.reason = "not checked yet"
+        self.lag_bytes = None
+        self.lag_seconds = None
+        self.checked_at = None
+        self.conn = None
+
+
+class ReplicaRouter:
+    def __init__(
+        self, primary_dsn: str, replica_dsns, max_lag_seconds: float = REPLICA_MAX_LAG_SECONDS,
+        max_lag_bytes: int = REPLICA_MAX_LAG_BYTES, check_interval: float = REPLICA_CHECK_INTERVAL
+    ):
+        self.primary_dsn = primary_dsn
+        self.replicas = [ReplicaStatus(dsn) for dsn in replica_dsns]
+        self.max_lag_seconds = max_lag_seconds
+        self.max_lag_bytes = max_lag_bytes
+        self.check_interval = check_interval
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._primary_conn = None
+        # (momento, LSN del primario) de los últimos chequeos, para estimar hace cuánto se atrasó cada réplica
+        self._primary_samples = deque()
+        self._reads = {"primary": 0, "replica": 0, "pinned": 0}
+
+    @property
+    def enabled(self):
+        return bool(self.replicas)
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop_event.clear()
+        self.check()
+        self._thread = threading.Thread(target=self._run, name="replica-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for connection in [self._primary_conn] + [replica.conn for replica in self.replicas]:
+            if connection is not None:
+                connection.close()
+        self._primary_conn = None
+        for replica in self.replicas:
+            replica.conn = None
+
+    def pinned(self, cookies):
+        try:
+            return float(cookies.get(READ_PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def choose(self, cookies):
+        # Índice de la réplica que debe atender la lectura, o None para el primario
+        if not self.enabled:
+            return None
+        if self.pinned(cookies):
+            self._count("pinned")
+            return None
+        healthy = [index for index, replica in enumerate(self.replicas) if replica.healthy]
+        if not healthy:
+            self._count("primary")
+            return None
+        self._count("replica")
+        return healthy[next(self._turn) % len(healthy)]
+
+    def mark_down(self, index: int, reason: str):
+        replica = self.replicas[index]
+        with self._lock:
+            replica.healthy = False
+            replica.reason = reason
+        print(f"Replica {replica.name} taken out of rotation: {reason}")
+
+    def _count(self, target: str):
+        with self._lock:
+            self._reads[target] += 1
+
+    def _run(self):
+        while not self._stop_event.wait(self.check_interval):
+            self.check()
+
+    def check(self):
+        now = time.monotonic()
+        try:
+            primary_lsn = self._primary_lsn()
+        except Exception as e:
+            # Sin primario no se puede medir el atraso; las réplicas conservan su último estado
+            print(f"Error in ReplicaRouter.check: {e}")
+            return
+        self._primary_samples.append((now, primary_lsn))
+        while self._primary_samples and now - self._primary_samples[0][0] > self.max_lag_seconds * 2 + self.check_interval:
+            self._primary_samples.popleft()
+
+        for replica in self.replicas:
+            healthy, reason, lag_bytes, lag_seconds = self._check_replica(replica, primary_lsn, now)
+            with self._lock:
+                if healthy != replica.healthy:
+                    print(f"Replica {replica.name} {'back in rotation' if healthy else 'taken out of rotation: ' + reason}")
+                replica.healthy = healthy
+                replica.reason = reason
+                replica.lag_bytes = lag_bytes
+                replica.lag_seconds = lag_seconds
+                replica.checked_at = time.time()
+
+    def _primary_lsn(self):
+        if self._primary_conn is None or self._primary_conn.closed:
+            self._primary_conn = self._connect(self.primary_dsn)
+        try:
+            with self._primary_conn.cursor() as cursor:
+                cursor.execute("SELECT pg_current_wal_lsn()::text")
+                return parse_lsn(cursor.fetchone()[0])
+        except Exception:
+            self._primary_conn.close()
+            raise
+
+    def _check_replica(self, replica: ReplicaStatus, primary_lsn: int, now: float):
+        try:
+            if replica.conn is None or replica.conn.closed:
+                replica.conn = self._connect(replica.dsn)
+            with replica.conn.cursor() as cursor:
+                cursor.execute(REPLICA_STATUS)
+                in_recovery, replay_lsn = cursor.fetchone()
+        except Exception as e:
+            if replica.conn is not None:
+                replica.conn.close()
+            return False, f"unreachable: {str(e).strip()}", None, None
+
+        if not in_recovery or replay_lsn is None:
+            return False, "not a streaming replica (not in recovery)", None, None
+
+        replay_lsn = parse_lsn(replay_lsn)
+        lag_bytes = max(primary_lsn - replay_lsn, 0)
+        # Atraso en tiempo: desde el chequeo más antiguo cuyo LSN del primario la réplica todavía no ha aplicado
+        behind = [sampled_at for sampled_at, lsn in self._primary_samples if lsn > replay_lsn]
+        lag_seconds = now - behind[0] if behind else 0.0
+
+        if lag_bytes > self.max_lag_bytes:
+            return False, f"lagging {lag_bytes} bytes", lag_bytes, lag_seconds
+        if lag_seconds > self.max_lag_seconds:
+            return False, f"lagging {lag_seconds:.1f}s", lag_bytes, lag_seconds
+        return True, "ok", lag_bytes, lag_seconds
+
+    @staticmethod
+    def _connect(dsn: str):
+        conn = psycopg2.connect(dsn, connect_timeout=max(int(REPLICA_CHECK_INTERVAL * 2), 2))
+        conn.autocommit = True
+        return conn
+
+    def stats(self):
+        with self._lock:
+            return {
+                "replicas": len(self.replicas),
+                "healthy": sum(replica.healthy for replica in self.replicas),
+                "reads_primary": self._reads["primary"],
+                "reads_replica": self._reads["replica"],
+                "reads_pinned": self._reads["pinned"],
+                "max_lag_seconds": max((r.lag_seconds or 0.0 for r in self.replicas), default=0.0),
+                "max_lag_bytes": max((r.lag_bytes or 0 for r in self.replicas), default=0),
+            }
+
+    def describe(self):
+        with self._lock:
+            return [
+                {
+                    "name": replica.name,
+                    "healthy": replica.healthy,
+                    "reason": replica.reason,
+                    "lag_bytes": replica.lag_bytes,
+                    "lag_seconds": replica.lag_seconds,
+                    "checked_at": replica.checked_at,
+                }
+                for replica in self.replicas
+            ]
+
+
+class ReadYourWritesMiddleware:
+    # Después de una escritura exitosa fija al cliente al primario por READ_PIN_SECONDS
+    def __init__(self, app, pin_seconds: float = READ_PIN_SECONDS, secure: bool = READ_PIN_COOKIE_SECURE):
+        self.app = app
+        self.pin_seconds = pin_seconds
+        self.attributes = "; Path=/; HttpOnly" + ("; SameSite=None; Secure" if secure else "; SameSite=Lax")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_pin(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                cookie = f"{READ_PIN_COOKIE}={time.time() + self.pin_seconds:.3f}; Max-Age={int(self.pin_seconds) or 1}{self.attributes}"
+                message["headers"] = list(message.get("headers", [])) + [(b"set-cookie", cookie.encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_with_pin)
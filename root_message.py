@@ -14,22 +14,51 @@ class RootMessage:
                 <p><b>List of all our Endpoints:</b></p>
                 <ul>
                     <li>/menu/all_info</li>
+                    <li>/menu/all_info/stream</li>
                     <li>/menu/{item_id}</li>
                     <li>/menu/add</li>
                     <li>/menu/{item_id}/edit</li>
                     <li>/menu/{item_id}/delete</li>
+                    <li>/menu/cache/stats</li>
                     <li>/orders/all_info</li>
+                    <li>/orders/all_info/stream</li>
+                    <li>/orders/batch</li>
+                    <li>/orders/feed</li>
+                    <li>/orders/by_customer/{customer_id}/feed</li>
                     <li>/orders/{order_id}/details</li>
                     <li>/orders/{order_id}/total_price</li>
+                    <li>/orders/totals/verify</li>
+                    <li>/orders/totals/rebuild</li>
+                    <li>/orders/archive</li>
+                    <li>/orders/archive/status</li>
                     <li>/orders/add</li>
+                    <li>/orders/create</li>
                     <li>/orders/{order_id}/change_status</li>
                     <li>/orders/{order_id}/add_items</li>
                     <li>/orders/{order_id}/delete</li>
                     <li>/orders/{order_id}/remove_item/{detail_id}</li>
                     <li>/clients/all_info</li>
+                    <li>/clients/all_info/stream</li>
                     <li>/clients/add</li>
                     <li>/clients/{client_id}/edit</li>
                     <li>/clients/{client_id}/delete</li>
+                    <li>/clients/cache/stats</li>
+                    <li>/analytics/revenue</li>
+                    <li>/analytics/average_ticket</li>
+                    <li>/analytics/items/top</li>
+                    <li>/analytics/customers/lifetime_value</li>
+                    <li>/analytics/customers/{customer_id}/lifetime_value</li>
+                    <li>/analytics/rollups/refresh</li>
+                    <li>/menu/export</li>
+                    <li>/menu/import</li>
+                    <li>/clients/export</li>
+                    <li>/clients/import</li>
+                    <li>/orders/export</li>
+                    <li>/orders/import</li>
+                    <li>/pool/stats</li>
+                    <li>/pool/replicas</li>
+                    <li>/admission/stats</li>
+                    <li>/metrics</li>
                 </ul>
             </body>
         </html>
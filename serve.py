@@ -0,0 +1,43 @@
+# Punto de entrada para producción: varios procesos de uvicorn sobre el mismo puerto, cada uno con su propia app
+# (main.create_app), su pool, su conexión LISTEN y sus cachés. Cada worker abre hasta DB_POOL_MAX_SIZE conexiones más
+# la de LISTEN, así que workers * (DB_POOL_MAX_SIZE + 1) tiene que caber en max_connections de Postgres.
+#
+# Al recibir SIGTERM/SIGINT cada worker deja de aceptar conexiones, espera hasta --graceful-timeout a que terminen las
+# peticiones en curso (los feeds SSE se cortan al vencerse) y luego cierra colas, listener y pools en el lifespan.
+#
+#   python serve.py --workers 4 --port 8000
+#   WEB_CONCURRENCY=4 PORT=8000 python serve.py
+import argparse
+import os
+import uvicorn
+
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", "8000"))
+GRACEFUL_TIMEOUT = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+KEEP_ALIVE_TIMEOUT = int(os.environ.get("KEEP_ALIVE_TIMEOUT", "5"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API with several worker processes")
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY, help="Worker processes (or WEB_CONCURRENCY)")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--graceful-timeout", type=int, default=GRACEFUL_TIMEOUT, help="Seconds to drain in-flight requests on shutdown")
+    parser.add_argument("--keep-alive", type=int, default=KEEP_ALIVE_TIMEOUT)
+    args = parser.parse_args()
+
+    uvicorn.run(
+        "main:create_app",
+        factory=True,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        timeout_keep_alive=args.keep_alive,
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
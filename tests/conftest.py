@@ -0,0 +1,100 @@
+# Las pruebas que tocan la base de datos corren contra TEST_DATABASE_URL, que se migra al empezar. Debe ser una base
+# desechable: la regresión de planes la vuelve a llenar con datos sintéticos y el archivo de pedidos mueve todo lo
+# entregado hace más de 90 días. Sin TEST_DATABASE_URL esas pruebas se saltan y solo corren las que no la necesitan.
+#
+#   TEST_DATABASE_URL=postgres://localhost/restaurant_test python -m pytest -q
+#   TEST_DATABASE_URL=postgres://localhost/restaurant_test DB_MODE=async python -m pytest -q
+import os
+import sys
+import uuid
+import pytest
+from psycopg2 import connect, OperationalError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+# database.py lee DATABASE_URL al importarse, así que va antes de importar main. Sin LISTEN ni tareas de fondo, para
+# que cada prueba vea solo lo que hace ella y las cachés se invaliden por las llamadas directas de los managers.
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+os.environ.setdefault("DB_LISTEN", "0")
+os.environ.setdefault("STARTUP_PRIME_CACHES", "0")
+os.environ.setdefault("ANALYTICS_REFRESH_INTERVAL", "0")
+os.environ.setdefault("ARCHIVE_INTERVAL", "0")
+
+
+@pytest.fixture(scope="session")
+def db():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    try:
+        conn = connect(TEST_DATABASE_URL)
+    except OperationalError as e:
+        pytest.skip(f"Test database is not reachable: {e}")
+    from migrations import migrate
+    migrate(conn)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture(scope="session")
+def api(db):
+    from fastapi.testclient import TestClient
+    from main import app
+    with TestClient(app) as client:
+        yield client
+
+
+def execute(db, query, params=None):
+    with db.cursor() as cursor:
+        cursor.execute(query, params)
+        rows = cursor.fetchall() if cursor.description else None
+    db.commit()
+    return rows
+
+
+@pytest.fixture
+def sql(db):
+    return lambda query, params=None: execute(db, query, params)
+
+
+@pytest.fixture
+def customer(db):
+    customer_id = execute(
+        db, "INSERT INTO client (name, clerkid) VALUES (%s, %s) RETURNING id", ("Test client", f"test_{uuid.uuid4().hex}")
+    )[0][0]
+    yield customer_id
+    execute(db, "DELETE FROM sales_rollup_queue WHERE order_id IN (SELECT order_id FROM orders WHERE customer_id = %s)", (customer_id,))
+    execute(db, "DELETE FROM orders_archive WHERE customer_id = %s", (customer_id,))
+    execute(db, "DELETE FROM orders WHERE customer_id = %s", (customer_id,))
+    execute(db, "DELETE FROM client WHERE id = %s", (customer_id,))
+
+
+@pytest.fixture
+def menu_item(db):
+    # Fábrica: menu_item(precio) da de alta un producto y lo borra (con sus líneas) al terminar la prueba
+    created = []
+
+    def create(price: float):
+        item_id = execute(db, "INSERT INTO menu (name, price) VALUES (%s, %s) RETURNING menu_id", ("Test item", price))[0][0]
+        created.append(item_id)
+        return item_id
+
+    yield create
+    for item_id in created:
+        execute(db, "DELETE FROM orderdetails WHERE item_id = %s", (item_id,))
+        execute(db, "DELETE FROM orderdetails_archive WHERE item_id = %s", (item_id,))
+        execute(db, "DELETE FROM menu WHERE menu_id = %s", (item_id,))
+
+
+@pytest.fixture
+def create_order(api):
+    def create(customer_id: int, *lines, idempotency_key: str = None):
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else {}
+        items = [{"item_id": item_id, "quantity": quantity} for item_id, quantity in lines]
+        response = api.post("/orders/create", json={"customer_id": customer_id, "items": items}, headers=headers)
+        assert response.status_code == 200, response.text
+        return response.json()["result"]["order_id"]
+
+    return create
@@ -0,0 +1,42 @@
+import asyncio
+import uuid
+from admission import PostgresBucketStore, classify, forwarded_client
+
+
+def scope_with(forwarded_for: str):
+    return {"headers": [(b"x-forwarded-for", forwarded_for.encode())]}
+
+
+def test_forwarded_client_skips_trusted_proxies_from_the_right():
+    scope = scope_with("6.6.6.6, 1.2.3.4, 10.0.0.2")
+    assert forwarded_client(scope, {"10.0.0.2"}) == "1.2.3.4"
+    assert forwarded_client(scope, {"10.0.0.2", "1.2.3.4"}) == "6.6.6.6"
+
+
+def test_forwarded_client_with_any_proxy_uses_the_hop_it_added():
+    # El 6.6.6.6 lo escribió el cliente; el proxy que llama solo agregó el último
+    assert forwarded_client(scope_with("6.6.6.6, 1.2.3.4"), {"*"}) == "1.2.3.4"
+    assert forwarded_client({"headers": []}, {"*"}) is None
+
+
+def test_cached_reads_skip_the_queue_only_without_a_query_string():
+    assert classify("GET", "/menu/all_info").name == "cached"
+    assert classify("GET", "/clients/by_clerk/user_1").name == "cached"
+    assert classify("GET", "/menu/all_info", b"limit=50&after=100").name == "lists"
+    assert classify("GET", "/menu/3", b"nocache=1").name == "reads"
+
+
+def test_postgres_bucket_store_uses_its_own_pool(db):
+    store = PostgresBucketStore(pool_size=1)
+    key = f"test:{uuid.uuid4()}"
+
+    async def take_three():
+        try:
+            return [await store.take(key, 1, 2) for _ in range(3)]
+        finally:
+            await store.close()
+
+    first, second, third = asyncio.run(take_three())
+    assert first == second == 0
+    assert 0 < third <= 1
+    assert store.stats()["errors"] == 0
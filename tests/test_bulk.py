@@ -0,0 +1,134 @@
+import csv
+import io
+import json
+import select
+import uuid
+import pytest
+from psycopg2 import connect
+
+
+@pytest.fixture
+def tag(sql):
+    # Prefijo de los nombres y clerkid que importa cada prueba, para borrarlos al terminar
+    tag = f"bulk_{uuid.uuid4().hex[:12]}"
+    yield tag
+    sql("DELETE FROM menu WHERE name LIKE %s", (f"{tag}%",))
+    sql("DELETE FROM client WHERE clerkid LIKE %s", (f"{tag}%",))
+
+
+def import_file(api, table: str, body: str, **params):
+    return api.post(f"/{table}/import", content=body.encode(), params=params)
+
+
+def menu_csv(tag: str):
+    return f"name,price\n{tag} soup,4.50\n{tag} broken,-1\n"
+
+
+def test_import_skips_invalid_rows_and_reports_them(api, sql, tag):
+    response = import_file(api, "menu", menu_csv(tag))
+
+    assert response.status_code == 200
+    report = response.json()
+    assert (report["rows"], report["imported"], report["rejected"], report["committed"]) == (2, 1, 1, True)
+    assert [error["line"] for error in report["errors"]] == [3]
+    assert sql("SELECT name, price FROM menu WHERE name LIKE %s", (f"{tag}%",)) == [(f"{tag} soup", 4.5)]
+
+
+def test_import_abort_rejects_the_whole_file(api, sql, tag):
+    response = import_file(api, "menu", menu_csv(tag), on_error="abort")
+
+    assert response.status_code == 422
+    report = response.json()
+    assert (report["imported"], report["rejected"], report["committed"]) == (0, 1, False)
+    assert sql("SELECT count(*) FROM menu WHERE name LIKE %s", (f"{tag}%",)) == [(0,)]
+
+
+def test_import_dry_run_validates_without_writing(api, sql, tag):
+    report = import_file(api, "menu", menu_csv(tag), dry_run="true").json()
+
+    assert (report["imported"], report["rejected"], report["committed"]) == (1, 1, False)
+    assert sql("SELECT count(*) FROM menu WHERE name LIKE %s", (f"{tag}%",)) == [(0,)]
+
+
+def exported_clients(api, tag: str):
+    rows = csv.DictReader(io.StringIO(api.get("/clients/export", params={"format": "csv"}).text))
+    return sorted((row for row in rows if row["clerkid"].startswith(tag)), key=lambda row: row["id"])
+
+
+def test_clients_csv_round_trip(api, sql, tag):
+    body = (
+        "name,address,phone_number,clerkid\n"
+        f'"Ana, the first","12 ""Main"" St",555,{tag}_1\n'
+        f"Luis,,,{tag}_2\n"
+    )
+    assert import_file(api, "clients", body).json()["imported"] == 2
+    exported = exported_clients(api, tag)
+    assert [(row["name"], row["address"], row["phone_number"]) for row in exported] == [
+        ("Ana, the first", '12 "Main" St', "555"), ("Luis", "", ""),
+    ]
+
+    # Lo exportado se vuelve a importar tal cual, con sus ids
+    sql("DELETE FROM client WHERE clerkid LIKE %s", (f"{tag}%",))
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=list(exported[0]))
+    writer.writeheader()
+    writer.writerows(exported)
+    assert import_file(api, "clients", output.getvalue()).json()["imported"] == 2
+    assert exported_clients(api, tag) == exported
+
+
+def exported_orders(api, customer: int):
+    lines = api.get("/orders/export", params={"format": "ndjson"}).text.splitlines()
+    return [row for row in map(json.loads, lines) if row["customer_id"] == customer]
+
+
+def order_lines(rows):
+    return sorted((row["order_status"], row["delivered_at"], row["item_id"], row["quantity"], row["unit_price"]) for row in rows)
+
+
+def test_orders_ndjson_round_trip(api, sql, customer, menu_item):
+    soup, bread = menu_item(6), menu_item(2)
+    body = "\n".join(json.dumps(row) for row in [
+        {"order_ref": "a", "customer_id": customer, "item_id": soup, "quantity": 2},
+        {"order_ref": "a", "customer_id": customer, "item_id": bread, "quantity": 1},
+        {
+            "order_ref": "b", "customer_id": customer, "order_status": "Entregado",
+            "delivered_at": "2026-01-02T03:04:05Z", "item_id": soup, "quantity": 3, "unit_price": 5.5,
+        },
+    ])
+    assert import_file(api, "orders", body, format="ndjson").json()["imported"] == 3
+    exported = exported_orders(api, customer)
+    assert order_lines(exported) == sorted([
+        ("En cola", None, soup, 2, 6), ("En cola", None, bread, 1, 2),
+        ("Entregado", "2026-01-02T03:04:05.000000Z", soup, 3, 5.5),
+    ])
+    totals = sorted(total for (total,) in sql("SELECT total_price FROM orders WHERE customer_id = %s", (customer,)))
+    assert totals == [14, 16.5]
+
+    sql("DELETE FROM sales_rollup_queue WHERE order_id IN (SELECT order_id FROM orders WHERE customer_id = %s)", (customer,))
+    sql("DELETE FROM orders WHERE customer_id = %s", (customer,))
+    reimported = "\n".join(json.dumps(row) for row in exported)
+    assert import_file(api, "orders", reimported, format="ndjson").json()["imported"] == 3
+    assert order_lines(exported_orders(api, customer)) == order_lines(exported)
+
+
+def test_orders_import_sends_a_single_resync(api, db, customer, menu_item):
+    item_id = menu_item(3)
+    listener = connect(db.dsn)
+    listener.autocommit = True
+    try:
+        with listener.cursor() as cursor:
+            cursor.execute("LISTEN order_changed")
+        body = "\n".join(
+            json.dumps({"order_ref": str(ref), "customer_id": customer, "item_id": item_id, "quantity": 1}) for ref in range(50)
+        )
+        assert import_file(api, "orders", body, format="ndjson").json()["imported"] == 50
+
+        events = []
+        while select.select([listener], [], [], 0.2)[0]:
+            listener.poll()
+            events.extend(json.loads(notify.payload) for notify in listener.notifies)
+            listener.notifies.clear()
+    finally:
+        listener.close()
+    assert events == [{"event": "resync"}]
@@ -0,0 +1,86 @@
+import asyncio
+from types import SimpleNamespace
+from cache import ClientCache, MenuCache, etag_matches
+
+
+def test_etag_matches_uses_weak_comparison():
+    etag = '"abc"'
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('W/"abc"', etag)
+    assert etag_matches('"xyz", W/"abc"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"abcd"', etag)
+    assert not etag_matches("abc", etag)
+    assert not etag_matches(None, etag)
+
+
+def test_menu_cache_ignores_values_loaded_before_an_invalidation():
+    cache = MenuCache()
+    generation = cache.generation
+    cache.invalidate(1)
+    cache.set(1, {"menu_id": 1}, generation)
+    assert cache.get(1) is None
+
+
+def test_menu_cache_coalesces_concurrent_misses():
+    cache = MenuCache()
+    loads = []
+
+    async def load():
+        loads.append(1)
+        await asyncio.sleep(0.01)
+        return {"menu_id": 1}
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_load(1, load) for _ in range(5)))
+
+    entries = asyncio.run(main())
+    assert len(loads) == 1
+    assert len({entry.etag for entry in entries}) == 1
+    assert cache.stats()["coalesced"] == 4
+
+
+def test_client_cache_invalidates_every_key_of_a_client():
+    cache = ClientCache()
+    client = SimpleNamespace(id=7)
+    cache.set((cache.BY_ID, 7), client, 0)
+    cache.set((cache.BY_CLERK, "old_clerk"), client, 0)
+
+    # El aviso trae el clerkid nuevo; el anterior se encuentra por el id
+    cache.invalidate(7, "new_clerk")
+
+    assert cache.get((cache.BY_ID, 7)) is None
+    assert cache.get((cache.BY_CLERK, "old_clerk")) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_client_cache_keeps_unknown_clients_in_the_negative_cache():
+    cache = ClientCache(maxsize=2)
+    for client_id in range(3):
+        cache.set((cache.BY_ID, client_id), None, 0)
+    cache.set((cache.BY_ID, 10), SimpleNamespace(id=10), 0)
+
+    stats = cache.stats()
+    assert (stats["entries"], stats["negative_entries"], stats["evictions"]) == (1, 2, 1)
+    assert cache.get((cache.BY_ID, 0)) is None
+    assert cache.get((cache.BY_ID, 2)).value is None
+
+
+def test_client_cache_does_not_share_a_load_started_before_an_invalidation():
+    cache = ClientCache()
+    values = iter([SimpleNamespace(id=1, name="old"), SimpleNamespace(id=1, name="new")])
+
+    async def load():
+        value = next(values)
+        await asyncio.sleep(0.01)
+        return value
+
+    async def main():
+        stale = asyncio.ensure_future(cache.get_or_load((cache.BY_ID, 1), load))
+        await asyncio.sleep(0)
+        cache.invalidate(1)
+        fresh = await cache.get_or_load((cache.BY_ID, 1), load)
+        return (await stale).name, fresh.name
+
+    assert asyncio.run(main()) == ("old", "new")
+    assert cache.get((cache.BY_ID, 1)).value.name == "new"
@@ -0,0 +1,25 @@
+from orders import OrderManager, OrderCreate
+from ingest import _Write, write_batch
+
+
+def test_failed_writes_roll_back_only_their_savepoint(api, db, sql, customer, menu_item, create_order):
+    item_id = menu_item(4)
+    open_order = create_order(customer, (item_id, 1))
+    delivered_order = create_order(customer, (item_id, 1))
+    for _ in range(2):
+        assert api.put(f"/orders/{delivered_order}/change_status").status_code == 200
+
+    new_order = OrderCreate(customer_id=customer, items=[{"item_id": item_id, "quantity": 2}])
+    writes = [
+        _Write(None, OrderManager.add_items_to_order, (open_order, item_id, 2), None),
+        _Write(None, OrderManager.add_items_to_order, (delivered_order, item_id, 1), None),
+        _Write(None, OrderManager.add_items_to_order, (open_order, 0, 1), None),
+        _Write(None, OrderManager.create_order_with_items, (customer, new_order.items), None),
+    ]
+    outcomes = write_batch(db, writes)
+
+    errors = [error.status_code if error else None for _, error in outcomes]
+    assert errors == [None, 400, 404, None]
+    created = outcomes[3][0]["result"]["order_id"]
+    totals = dict(sql("SELECT order_id, total_price FROM orders WHERE customer_id = %s", (customer,)))
+    assert totals == {open_order: 12, delivered_order: 4, created: 8}
@@ -0,0 +1,34 @@
+import pytest
+from psycopg2 import errors
+from migrations import Migration, migrate
+
+UNIQUE_INDEX = Migration(
+    9001,
+    "test_unique_index",
+    ["CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS migration_test_key ON migration_test (clerkid)"],
+    transactional=False,
+)
+
+
+@pytest.fixture
+def migration_test(sql):
+    sql("CREATE TABLE migration_test (clerkid TEXT)")
+    yield
+    sql("DROP TABLE migration_test")
+    sql("DELETE FROM schema_migrations WHERE version = %s", (UNIQUE_INDEX.version,))
+
+
+def test_failed_concurrent_index_is_rebuilt_on_retry(db, sql, migration_test):
+    sql("INSERT INTO migration_test VALUES ('user_1'), ('user_1')")
+    with pytest.raises(errors.UniqueViolation):
+        migrate(db, [UNIQUE_INDEX])
+    assert sql("SELECT indisvalid FROM pg_index WHERE indexrelid = 'migration_test_key'::regclass") == [(False,)]
+
+    sql("DELETE FROM migration_test")
+    assert migrate(db, [UNIQUE_INDEX]) == [UNIQUE_INDEX.version]
+
+    assert sql("SELECT indisvalid FROM pg_index WHERE indexrelid = 'migration_test_key'::regclass") == [(True,)]
+    sql("INSERT INTO migration_test VALUES ('user_1')")
+    with pytest.raises(errors.UniqueViolation):
+        sql("INSERT INTO migration_test VALUES ('user_1')")
+    db.rollback()
@@ -0,0 +1,120 @@
+import uuid
+from decimal import Decimal
+
+
+def test_change_status_with_stale_from_status_is_a_conflict(api, customer, menu_item, create_order):
+    order_id = create_order(customer, (menu_item(10), 1))
+
+    advanced = api.put(f"/orders/{order_id}/change_status", params={"from_status": "En cola"})
+    assert advanced.status_code == 200
+    assert advanced.json()["result"]["order_status"] == "En proceso"
+
+    # Una segunda terminal que aún ve el pedido "En cola" no lo avanza otra vez
+    stale = api.put(f"/orders/{order_id}/change_status", params={"from_status": "En cola"})
+    assert stale.status_code == 409
+    assert stale.json()["detail"] == "Order status is En proceso, expected En cola"
+    assert api.get(f"/orders/by_customer/{customer}").json()[0]["order_status"] == "En proceso"
+
+
+
+def test_change_status_of_missing_order(api):
+    assert api.put("/orders/0/change_status", params={"from_status": "En cola"}).status_code == 404
+
+
+
+def test_create_order_replays_with_the_same_idempotency_key(api, sql, customer, menu_item, create_order):
+    item_id = menu_item(12.5)
+    key = f"test-{uuid.uuid4()}"
+
+    first = create_order(customer, (item_id, 2), idempotency_key=key)
+    replayed = create_order(customer, (item_id, 2), idempotency_key=key)
+
+    assert replayed == first
+    assert sql("SELECT count(*) FROM orders WHERE customer_id = %s", (customer,))[0][0] == 1
+
+
+
+def test_change_status_replays_instead_of_advancing_twice(api, customer, menu_item, create_order):
+    order_id = create_order(customer, (menu_item(10), 1))
+    headers = {"Idempotency-Key": f"test-{uuid.uuid4()}"}
+
+    first = api.put(f"/orders/{order_id}/change_status", headers=headers)
+    replayed = api.put(f"/orders/{order_id}/change_status", headers=headers)
+
+    assert first.status_code == replayed.status_code == 200
+    assert replayed.json() == first.json()
+    assert api.get(f"/orders/by_customer/{customer}").json()[0]["order_status"] == "En proceso"
+
+
+
+def test_idempotency_key_reused_for_a_different_request(api, customer, menu_item, create_order):
+    item_id = menu_item(10)
+    key = f"test-{uuid.uuid4()}"
+    create_order(customer, (item_id, 1), idempotency_key=key)
+
+    response = api.post(
+        "/orders/create", json={"customer_id": customer, "items": [{"item_id": item_id, "quantity": 3}]},
+        headers={"Idempotency-Key": key},
+    )
+    assert response.status_code == 422
+    assert response.json()["detail"] == f"Idempotency-Key {key} was already used for a different request"
+
+
+
+def test_menu_price_change_reprices_only_queued_orders(api, sql, customer, menu_item, create_order):
+    item_id = menu_item(10)
+    queued = create_order(customer, (item_id, 2))
+    in_process = create_order(customer, (item_id, 2))
+    delivered = create_order(customer, (item_id, 2))
+    assert api.put(f"/orders/{in_process}/change_status").status_code == 200
+    for _ in range(2):
+        assert api.put(f"/orders/{delivered}/change_status").status_code == 200
+
+    assert api.put(f"/menu/{item_id}/edit", params={"nombre": "Test item", "precio": 15}).status_code == 200
+
+    prices = dict(sql(
+        "SELECT order_id, unit_price FROM orderdetails WHERE order_id = ANY(%s)", ([queued, in_process, delivered],)
+    ))
+    assert prices == {queued: Decimal("15.00"), in_process: Decimal("10.00"), delivered: Decimal("10.00")}
+    assert api.get(f"/orders/{queued}/total_price").json()["total_price"] == 30
+    assert api.get(f"/orders/{in_process}/total_price").json()["total_price"] == 20
+    assert api.get("/orders/totals/verify").json() == []
+
+
+
+def test_orders_by_customer_pages_with_keyset_cursor(api, customer, menu_item, create_order):
+    item_id = menu_item(5)
+    order_ids = [create_order(customer, (item_id, 1)) for _ in range(3)]
+
+    first = api.get(f"/orders/by_customer/{customer}", params={"limit": 2})
+    assert [order["order_id"] for order in first.json()] == order_ids[:0:-1]
+    before = first.headers["X-Next-Before"]
+
+    last = api.get(f"/orders/by_customer/{customer}", params={"limit": 2, "before": before})
+    assert [order["order_id"] for order in last.json()] == order_ids[:1]
+    assert "X-Next-Before" not in last.headers
+
+
+
+def test_archived_orders_are_still_readable(api, db, sql, customer, menu_item, create_order):
+    from archive import ArchiveManager
+
+    order_id = create_order(customer, (menu_item(8), 3))
+    for _ in range(2):
+        assert api.put(f"/orders/{order_id}/change_status").status_code == 200
+    # Como si se hubiera entregado hace tiempo y analytics.py ya lo hubiera sumado a los rollups
+    sql("UPDATE orders SET delivered_at = now() - interval '200 days' WHERE order_id = %s", (order_id,))
+    sql("DELETE FROM sales_rollup_queue WHERE order_id = %s", (order_id,))
+
+    while ArchiveManager.archive_orders(db, 1000, 90) == 1000:
+        pass
+
+    assert sql("SELECT count(*) FROM orders WHERE order_id = %s", (order_id,))[0][0] == 0
+    orders = api.get(f"/orders/by_customer/{customer}").json()
+    assert [(order["order_id"], order["order_status"]) for order in orders] == [(order_id, "Entregado")]
+    details = api.get(f"/orders/{order_id}/details").json()
+    assert [(line["quantity"], line["unit_price"]) for line in details] == [(3, 8)]
+    for params in ({"order_ids": [order_id]}, {"customer_id": customer}):
+        batch = api.get("/orders/batch", params=params).json()
+        assert [(order["order_id"], order["total_price"], len(order["items"])) for order in batch] == [(order_id, 24, 1)]
+    assert order_id not in [order["order_id"] for order in api.get("/orders/batch", params={"status": "Entregado"}).json()]
@@ -0,0 +1,21 @@
+import pytest
+from benchmarks.datagen import seed, table_counts
+from benchmarks.query_plans import CASES, MIN_ROWS_FOR_SEQ_SCAN, large_tables, run_case, sample_ids
+
+# Suficiente para que orders, orderdetails y client pasen MIN_ROWS_FOR_SEQ_SCAN y un Seq Scan sobre ellas cuente
+PLAN_COUNTS = {"clients": 20000, "menu_items": 300, "orders": 50000, "details_per_order": 3}
+
+
+@pytest.fixture(scope="module")
+def plan_database(db):
+    # Solo se vuelve a sembrar si hace falta (por ejemplo, después de que otra prueba archivó el historial)
+    if table_counts(db)["orders"] < PLAN_COUNTS["orders"]:
+        seed(db, **PLAN_COUNTS)
+    return sample_ids(db), large_tables(db, MIN_ROWS_FOR_SEQ_SCAN)
+
+
+@pytest.mark.parametrize("case", CASES, ids=[case.name for case in CASES])
+def test_query_plan_within_budget(db, plan_database, case):
+    sample, large = plan_database
+    result = run_case(db, case, sample, large)
+    assert result["ok"], "\n".join(result["problems"])
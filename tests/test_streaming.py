@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+import main
+
+
+class FakeConnection:
+    # Lleva la cuenta de cuántas veces se tomó y se liberó la conexión
+    def __init__(self):
+        self.entered = 0
+        self.exits = []
+
+    def __call__(self, request=None):
+        return self
+
+    async def __aenter__(self):
+        self.entered += 1
+        return object()
+
+    async def __aexit__(self, *exc_info):
+        self.exits.append(exc_info[0])
+        return False
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    fake = FakeConnection()
+    monkeypatch.setattr(main, "db_connection", fake)
+    return fake
+
+
+def rows(conn, chunk_size):
+    yield [{"id": 1}]
+    yield [{"id": 2}]
+
+
+async def read_body(response):
+    return b"".join([chunk async for chunk in response.body_iterator])
+
+
+def test_stream_releases_the_connection_once(connection):
+    async def run():
+        response = await main.stream_response(None, rows, "ndjson", 10)
+        body = await read_body(response)
+        await response.background()
+        return body
+
+    assert asyncio.run(run()) == b'{"id":1}\n{"id":2}\n'
+    assert connection.exits == [None]
+
+
+def test_stream_never_started_is_released_by_the_background_task(connection):
+    # El cliente se fue antes de que Starlette empezara a recorrer el cuerpo
+    async def run():
+        response = await main.stream_response(None, rows, "json", 10)
+        await response.background()
+
+    asyncio.run(run())
+    assert connection.exits == [None]
+
+
+def test_stream_setup_error_releases_the_connection(connection):
+    def broken(conn, chunk_size):
+        raise RuntimeError("cursor failed")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(main.stream_response(None, broken, "ndjson", 10))
+    assert connection.entered == 1
+    assert connection.exits == [RuntimeError]